@@ -5,6 +5,9 @@ from bayespy import model
 from bayespy import network
 from bayespy import template
 from bayespy import visual
+from bayespy import vectorized
+from bayespy import aio
+from bayespy import distributed
 from bayespy.jni import bayesServer as _bs
 from bayespy import utils
 
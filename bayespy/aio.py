@@ -0,0 +1,125 @@
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import bayespy.data
+import bayespy.jni
+import bayespy.model
+from bayespy.model import QueryBase
+
+
+class AsyncModel:
+    """
+    Async counterparts to SingleQuery.query and NetworkModel.batch_query, so inference doesn't block the event loop
+    (e.g. in an aiohttp service). Inference runs on a bounded pool of JVM-attached threads, each with its own
+    inference engine over the model's network.
+
+    Single queries made at about the same time with the same queries are coalesced (see RequestCoalescer): they're
+    gathered for up to max_latency seconds (or until there are max_batch_size of them) and run as one micro-batch on
+    a worker thread, against queries which that thread has already set up.
+
+    The network mustn't be changed (e.g. retrained) while the model is in use. Call close(), or use as an async
+    context manager.
+    :param max_workers: the number of inference threads
+    :param max_batch_size: the largest number of single queries run together
+    :param max_latency: the longest a single query waits for others to batch with, in seconds
+    :param max_queue_depth: the most single queries waiting to be batched, for each set of queries, beyond which
+    query raises queue.Full
+    :param vectorized: an optional bayespy.vectorized.MixtureModel of the network, used for single queries it supports
+    """
+
+    def __init__(self, model: bayespy.model.NetworkModel, logger: logging.Logger, max_workers: int = 4,
+                 max_batch_size: int = 32, max_latency: float = 0.002, max_queue_depth: int = 1024,
+                 vectorized=None):
+        self._model = model
+        self._network = model.get_network()
+        self._logger = logger
+        self._max_workers = max_workers
+        self._max_batch_size = max_batch_size
+        self._max_latency = max_latency
+        self._max_queue_depth = max_queue_depth
+        self._vectorized = vectorized
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, initializer=bayespy.jni.attach_thread,
+                                            initargs=(logger,))
+        # a coalescer for each set of queries, sharing the executor.
+        self._coalescers = {}
+        self._closed = False
+
+    @staticmethod
+    def _key(queries: List[QueryBase], aslist: bool):
+        return (tuple(query.cache_key() for query in queries), aslist)
+
+    def _get_coalescer(self, queries: List[QueryBase], aslist: bool) -> bayespy.model.RequestCoalescer:
+        key = self._key(queries, aslist)
+        if key not in self._coalescers:
+            self._coalescers[key] = bayespy.model.RequestCoalescer(
+                self._network, queries, self._logger, max_latency=self._max_latency,
+                max_batch_size=self._max_batch_size, max_queue_depth=self._max_queue_depth,
+                workers=self._max_workers, aslist=aslist, vectorized=self._vectorized, executor=self._executor)
+
+        return self._coalescers[key]
+
+    def get_metrics(self) -> dict:
+        """
+        :return: the metrics of the coalescer for each set of queries (see RequestCoalescer.get_metrics)
+        """
+        return {key: coalescer.get_metrics() for key, coalescer in self._coalescers.items()}
+
+    async def query(self, evidence: dict, queries: List[QueryBase], aslist=False, timeout: float = None):
+        """
+        Run queries on the network given some evidence, as SingleQuery.query
+        :param evidence: a dictionary of evidence (see Evidence.apply)
+        :param timeout: seconds to wait for the result, raises asyncio.TimeoutError after that
+        :return: the results of each query, as with SingleQuery.query
+        """
+        if self._closed:
+            raise ValueError("AsyncModel has been closed")
+
+        if not hasattr(queries, "__getitem__"):
+            queries = [queries]
+
+        # cancelling the wrapped future (including on timeout) cancels the request, if it hasn't been run yet.
+        future = asyncio.wrap_future(self._get_coalescer(queries, aslist).submit(evidence))
+        return await asyncio.wait_for(future, timeout)
+
+    async def batch_query(self, dataset: bayespy.data.DataSet, queries: List[QueryBase], timeout: float = None,
+                          **kwargs):
+        """
+        Query every row in the dataset, as NetworkModel.batch_query (which takes the same keyword arguments). If
+        cancelled or timed out, the query carries on in the background but its result is discarded.
+        :param timeout: seconds to wait for the result, raises asyncio.TimeoutError after that
+        """
+        if self._closed:
+            raise ValueError("AsyncModel has been closed")
+
+        loop = asyncio.get_event_loop()
+        batch = loop.run_in_executor(self._executor, functools.partial(self._model.batch_query, dataset, queries,
+                                                                       **kwargs))
+        return await asyncio.wait_for(batch, timeout)
+
+    def _close(self):
+        for coalescer in self._coalescers.values():
+            coalescer.close()
+
+        def clear():
+            for coalescer in self._coalescers.values():
+                coalescer.clear_thread_state()
+
+        bayespy.model._detach_executor_threads(self._executor, self._max_workers, on_detach=clear)
+        self._executor.shutdown()
+
+    async def close(self):
+        if self._closed:
+            return
+
+        self._closed = True
+        # blocks until queued requests have been run, so off the event loop.
+        await asyncio.get_event_loop().run_in_executor(None, self._close)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, type, value, traceback):
+        await self.close()
@@ -6,7 +6,8 @@ import pandas as pd
 from sqlalchemy import create_engine
 import uuid
 import shutil
-from bayespy.jni import bayesServer, bayesServerAnalysis, bayesServerDiscovery, jp
+import hashlib
+from bayespy.jni import bayesServer, bayesServerAnalysis, bayesServerDiscovery, ensure_started, jp
 import os
 
 class DataFrameReader:
@@ -210,28 +211,151 @@ def create_histogram(series):
 
     return bayesServerAnalysis().HistogramDensity.learn(jp.java.util.Arrays.asList(values), hdo)
 
+def _as_integer_indexes(indexes) -> np.array:
+    """
+    The indexes as an int64 array, raising ValueError if they aren't integers (e.g. a dataframe with a string index),
+    as rows are selected from storage by their integer ix.
+    """
+    values = np.asarray(indexes)
+    if len(values) == 0:
+        return values.astype(np.int64)
+
+    if values.dtype.kind == 'f' and np.all(np.mod(values, 1) == 0):
+        return values.astype(np.int64)
+
+    if values.dtype.kind not in ('i', 'u'):
+        raise ValueError("Rows can only be selected from storage by integer indexes, not {} (e.g. {!r}), reset the "
+                         "dataframe's index first".format(values.dtype, values[0]))
+
+    return values.astype(np.int64)
+
+
+def _get_contiguous_ranges(indexes: np.array):
+    """
+    Get the (start, end) pairs of contiguous runs in a sorted array of indexes, or None if they are not sorted and
+    unique.
+    """
+    if len(indexes) == 0:
+        return []
+
+    steps = np.diff(indexes)
+    if np.any(steps <= 0):
+        return None
+
+    breaks = np.where(steps != 1)[0]
+    starts = indexes[np.r_[0, breaks + 1]]
+    ends = indexes[np.r_[breaks, len(indexes) - 1]]
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
+def _get_java_type(dtype):
+    if DataFrame.is_float(dtype):
+        return jp.JClass("java.lang.Double").class_
+    if DataFrame.is_int(dtype):
+        return jp.JClass("java.lang.Long").class_
+    if DataFrame.is_bool(dtype):
+        return jp.JClass("java.lang.Boolean").class_
+
+    return jp.JClass("java.lang.String").class_
+
+
+def _to_java_values(values: np.ndarray, dtype) -> list:
+    # plain Python values, which JPype boxes as Double, Long, Boolean and String, with None for missing values.
+    nulls = pd.isnull(values)
+    if DataFrame.is_numeric(dtype) or DataFrame.is_bool(dtype):
+        column = values.tolist()
+        for i in np.flatnonzero(nulls):
+            column[i] = None
+
+        return column
+
+    return [None if null else str(value) for value, null in zip(values, nulls)]
+
+
+def create_data_table(df: pd.DataFrame, index_label='ix'):
+    """
+    Copy a dataframe in to a Bayes Server DataTable, with the index as an additional column (index_label) in the
+    same way as DataSet.write stores it. Reading the table then happens entirely in the JVM, with one call from Python
+    per row to fill it rather than a call back in to Python for every value read. The copy is boxed, so takes
+    roughly 20 bytes of JVM heap per value.
+    """
+    ensure_started()
+    table = bayesServer().data.DataTable()
+    columns = [(index_label, np.asarray(df.index.values), df.index.dtype)] + \
+              [(str(c), df[c].values, df[c].dtype) for c in df.columns]
+
+    values = []
+    for name, column, dtype in columns:
+        table.getColumns().add(name, _get_java_type(dtype))
+        values.append(_to_java_values(column, dtype))
+
+    rows = table.getRows()
+    row_type = jp.JArray(jp.java.lang.Object)
+    for row in zip(*values):
+        rows.add(row_type(row))
+
+    return table
+
+
+class InMemoryDataReaderCommand:
+    """
+    A Bayes Server DataReaderCommand over a dataframe. The dataframe is copied in to a Java DataTable the first time
+    it is needed (see create_data_table), and the same table is read by every reader the command creates.
+    """
+
+    def __init__(self, df: pd.DataFrame, index_label='ix'):
+        self._df = df
+        self._index_label = index_label
+        self._table = None
+
+    def get_data_table(self):
+        if self._table is None:
+            self._table = create_data_table(self._df, index_label=self._index_label)
+
+        return self._table
+
+    def as_java(self):
+        # a Java command, which holds the table itself, so nothing needs keeping alive in Python.
+        return bayesServer().data.DataTableDataReaderCommand(self.get_data_table())
+
+
 class DataSet:
-    def __init__(self, df: pd.DataFrame, db_folder: str, logger: logging.Logger, identifier:str=None):
+    def __init__(self, df: pd.DataFrame, db_folder: str, logger: logging.Logger, identifier:str=None,
+                 in_memory=False):
+        """
+        :param in_memory: if True, data is read straight from the dataframe rather than being written to and read
+        back from SQLite, in which case db_folder is not used.
+        """
         if identifier is None:
             self.uuid = str(uuid.uuid4()).replace("-","")
         else:
             self.uuid = identifier
 
         self._db_dir = db_folder
-        self._create_folder()
-        filename = "sqlite:///{}.db".format(os.path.join(self._db_dir, "db", self.uuid))
-        self._engine = create_engine(filename)
+        self._in_memory = in_memory
+        if not in_memory:
+            self._create_folder()
+            filename = "sqlite:///{}.db".format(os.path.join(self._db_dir, "db", self.uuid))
+            self._engine = create_engine(filename)
+
         self.table = "table_" + self.uuid
         self._logger = logger
         self.data = df
 
     def subset(self, indices:List[int]):
-        return DataSet(self.data.iloc[indices], self._db_dir, self._logger, identifier=self.uuid)
+        return DataSet(self.data.iloc[indices], self._db_dir, self._logger, identifier=self.uuid,
+                       in_memory=self._in_memory)
 
     def get_dataframe(self):
         return self.data
 
+    def is_in_memory(self):
+        return self._in_memory
+
     def get_connection(self):
+        if self._in_memory:
+            return None
+
         return "jdbc:sqlite:{}.db".format(os.path.join(self._db_dir, "db", self.uuid))
 
     def _create_folder(self):
@@ -239,10 +363,61 @@ class DataSet:
             os.makedirs(os.path.join(self._db_dir, "db"))
 
     def write(self):
+        if self._in_memory:
+            self._logger.debug("Reading {} rows from memory, nothing to write".format(len(self.data)))
+            return
+
         self._logger.info("Writing {} rows to storage".format(len(self.data)))
         self.data.to_sql(self.table, self._engine, if_exists='replace', index_label='ix', index=True)
         self._logger.info("Finished writing {} rows to storage".format(len(self.data)))
 
+    def create_select_statement(self, indexes=[], strategy=None, max_ranges=100):
+        """
+        Create the SQL to select a subset of rows from storage, avoiding very large 'in' clauses.
+        :param indexes: the indexes of the rows to select (defaults to every row in the dataset)
+        :param strategy: 'range' uses 'ix between' clauses, and requires sorted, unique indexes. 'table' writes the
+        indexes to a separate table which is joined on ix. 'in' lists every index. If None, 'range' is used when the
+        indexes are sorted and form no more than max_ranges contiguous ranges, otherwise 'table'.
+        :return: the select statement
+        """
+        if len(indexes) == 0:
+            indexes = self.get_dataframe().index
+
+        indexes = _as_integer_indexes(indexes)
+        ranges = _get_contiguous_ranges(indexes)
+
+        if strategy is None:
+            strategy = 'range' if ranges is not None and len(ranges) <= max_ranges else 'table'
+
+        self._logger.debug("Selecting {} rows from {} using the '{}' strategy".format(len(indexes), self.table,
+                                                                                    strategy))
+
+        if strategy == 'range':
+            if ranges is None:
+                raise ValueError("The range strategy requires sorted, unique indexes")
+
+            if len(ranges) == 0:
+                return "select * from {} where 1 = 0".format(self.table)
+
+            return "select * from {} where {}".format(self.table, " or ".join(
+                "ix between {} and {}".format(start, end) for start, end in ranges))
+
+        if strategy == 'table':
+            index_table = self._write_index_table(indexes)
+            return "select {0}.* from {0} inner join {1} on {0}.ix = {1}.ix".format(self.table, index_table)
+
+        if strategy == 'in':
+            return "select * from {} where ix in ({})".format(self.table, ",".join(str(i) for i in indexes))
+
+        raise ValueError("Strategy {} was not recognised".format(strategy))
+
+    def _write_index_table(self, indexes: np.array) -> str:
+        # not an sqlite temp table, as those are only visible on the connection that created them, rather than
+        # the JDBC connection used by Bayes Server. It's removed along with everything else in cleanup.
+        index_table = "{}_subset_{}".format(self.table, hashlib.sha1(indexes.tobytes()).hexdigest()[:16])
+        pd.DataFrame({'ix': indexes}).to_sql(index_table, self._engine, if_exists='replace', index=False)
+        return index_table
+
     def create_data_reader_command(self, indexes=[]):
         """
         Get the data reader
@@ -250,16 +425,19 @@ class DataSet:
         :return: a a DatabaseDataReaderCommand
         """
 
-        if len(indexes) == 0:
-            indexes = self.get_dataframe().index.tolist()
+        if self._in_memory:
+            df = self.get_dataframe() if len(indexes) == 0 else self.get_dataframe().loc[indexes]
+            return InMemoryDataReaderCommand(df).as_java()
 
         data_reader_command = bayesServer().data.DatabaseDataReaderCommand(
-            self.get_connection(),
-            "select * from {} where ix in ({})".format(self.table, ",".join(str(i) for i in indexes)))
+            self.get_connection(), self.create_select_statement(indexes))
 
         return data_reader_command
 
     def cleanup(self):
+        if self._in_memory:
+            return
+
         self._logger.debug("Cleaning up: deleting db folder")
         try:
             shutil.rmtree(os.path.join(self._db_dir, "db"))
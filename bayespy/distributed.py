@@ -0,0 +1,232 @@
+import abc
+import logging
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import multiprocess
+import numpy as np
+import pandas as pd
+
+import bayespy.model
+import bayespy.vectorized
+
+# Data-parallel EM for mixture models (see bayespy.vectorized.MixtureModel). The data is split into shards, each of
+# which calculates the expected sufficient statistics of its rows under the current parameters (the E-step). The
+# coordinator sums them and re-estimates the parameters (the M-step), then sends the new parameters back out. As the
+# statistics add up exactly, the parameters are the same as EM over all of the data in one process. Missing values
+# are handled as in EM, through their conditional expectations, so the results match NetworkModel.train with
+# priors=False from the same starting point (see tests/test_distributed.py).
+
+
+class Shard(abc.ABC):
+    """
+    A part of the training data, which calculates sufficient statistics on request. The parameters are sent as a
+    MixtureModel, which is plain numpy and so can be pickled, e.g. to implement a shard on another machine over RPC.
+    """
+
+    @abc.abstractmethod
+    def statistics(self, model: bayespy.vectorized.MixtureModel) -> bayespy.vectorized.SufficientStatistics:
+        pass
+
+    @abc.abstractmethod
+    def get_case_count(self) -> int:
+        pass
+
+    def close(self):
+        pass
+
+
+class LocalShard(Shard):
+    """
+    A shard held in this process
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self._df = df
+
+    def statistics(self, model: bayespy.vectorized.MixtureModel) -> bayespy.vectorized.SufficientStatistics:
+        return model.statistics(self._df)
+
+    def get_case_count(self) -> int:
+        return len(self._df)
+
+
+def _identity(df):
+    return df
+
+
+def _serve_shard(connection, loader, args):
+    # exceptions are sent back as text, as they may not pickle.
+    try:
+        df = loader(*args)
+    except BaseException:
+        connection.send(('error', traceback.format_exc()))
+        return
+
+    connection.send(('ok', len(df)))
+    while True:
+        model = connection.recv()
+        if model is None:
+            break
+
+        try:
+            connection.send(('ok', model.statistics(df)))
+        except BaseException:
+            connection.send(('error', traceback.format_exc()))
+
+
+class ProcessShard(Shard):
+    """
+    A shard held by its own worker process, which loads the data once and keeps it for every iteration. The workers
+    only use numpy, so don't start a JVM.
+    :param data: a dataframe, or a function which loads one (called in the worker with args, e.g. pd.read_csv and a
+    path), so that the data doesn't need to be loaded by the coordinator
+    """
+
+    def __init__(self, data, *args):
+        loader = data if callable(data) else _identity
+        args = args if callable(data) else (data,)
+        context = multiprocess.get_context('spawn')
+        self._connection, child_connection = context.Pipe()
+        self._process = context.Process(target=_serve_shard, args=(child_connection, loader, args), daemon=True)
+        self._process.start()
+        # so that recv raises EOFError, rather than blocking, if the worker dies.
+        child_connection.close()
+        try:
+            self._case_count = self._receive()
+        except BaseException:
+            self.close()
+            raise
+
+    def _receive(self):
+        try:
+            status, value = self._connection.recv()
+        except EOFError:
+            raise RuntimeError("Shard worker process {} exited".format(self._process.pid))
+
+        if status == 'error':
+            raise RuntimeError("Shard worker process failed:\n{}".format(value))
+
+        return value
+
+    def statistics(self, model: bayespy.vectorized.MixtureModel) -> bayespy.vectorized.SufficientStatistics:
+        self._connection.send(model)
+        return self._receive()
+
+    def get_case_count(self) -> int:
+        return self._case_count
+
+    def close(self):
+        if self._process is not None:
+            try:
+                self._connection.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+
+            self._process.join(timeout=10)
+            if self._process.is_alive():
+                self._process.terminate()
+
+            self._connection.close()
+            self._process = None
+
+
+def create_process_shards(df: pd.DataFrame, processes: int = None) -> List[ProcessShard]:
+    """
+    Split a dataframe into one shard per process
+    """
+    if processes is None:
+        processes = max(multiprocess.cpu_count() - 1, 1)
+
+    shards = []
+    try:
+        for rows in np.array_split(np.arange(len(df)), processes):
+            shards.append(ProcessShard(df.iloc[rows]))
+    except BaseException:
+        for shard in shards:
+            shard.close()
+        raise
+
+    return shards
+
+
+class DistributedTrainer:
+    """
+    Trains the parameters of a mixture model (a latent variable which is the only parent of every other node) with
+    EM over shards of the data, which can be in other processes or on other machines (see Shard).
+
+    EM starts from the network's current parameters, so the network needs training first, e.g. with
+    NetworkModel.train on a sample of the data, which also makes a good starting point. Learning is maximum
+    likelihood, without the priors Bayes Server adds by default (see NetworkModel.train's priors).
+    :param max_iterations: the most iterations of EM
+    :param tolerance: stop once the log likelihood changes by less than this, relative to its size
+    """
+
+    def __init__(self, network, shards: List[Shard], logger: logging.Logger, latent_variable_name: str = 'Cluster',
+                 max_iterations: int = 100, tolerance: float = 1e-6):
+        if len(shards) == 0:
+            raise ValueError("At least one shard is needed")
+
+        if max_iterations < 1:
+            raise ValueError("max_iterations should be at least 1, not {}".format(max_iterations))
+
+        self._network = network
+        self._shards = shards
+        self._logger = logger
+        self._latent_variable_name = latent_variable_name
+        self._max_iterations = max_iterations
+        self._tolerance = tolerance
+
+    def _statistics(self, executor: ThreadPoolExecutor, model: bayespy.vectorized.MixtureModel):
+        statistics = None
+        for shard_statistics in executor.map(lambda shard: shard.statistics(model), self._shards):
+            statistics = shard_statistics if statistics is None else statistics.add(shard_statistics)
+
+        return statistics
+
+    def train(self) -> bayespy.model.TrainingResults:
+        model = bayespy.vectorized.MixtureModel.from_network(self._network,
+                                                             latent_variable_name=self._latent_variable_name)
+        self._logger.info("Training model on {} shards of {} rows...".format(
+            len(self._shards), sum(shard.get_case_count() for shard in self._shards)))
+
+        trace = []
+        converged = False
+        previous = None
+        start = time.perf_counter()
+        # the shards are in other processes (or machines), so a thread each is enough to run them all at once.
+        with ThreadPoolExecutor(max_workers=len(self._shards)) as executor:
+            for iteration in range(self._max_iterations):
+                statistics = self._statistics(executor, model)
+                model = model.maximise(statistics)
+                trace.append({'iteration': iteration + 1, 'loglikelihood': statistics.loglikelihood,
+                              'elapsed_seconds': time.perf_counter() - start})
+                self._logger.debug("Training iteration {}".format(trace[-1]))
+
+                if previous is not None and abs(statistics.loglikelihood - previous) <= \
+                        self._tolerance * abs(previous):
+                    converged = True
+                    break
+
+                previous = statistics.loglikelihood
+
+        model.write_to_network(self._network)
+        bayespy.model.QueryCache.invalidate_network(self._network)
+        self._logger.info("Finished training model")
+
+        # the log likelihood is of the parameters before the last M-step, as with Bayes Server.
+        return bayespy.model.TrainingResults(self._network, {
+            'converged': converged, 'loglikelihood': statistics.loglikelihood, 'iteration_count': len(trace),
+            'case_count': statistics.case_count, 'shards': len(self._shards), 'trace': trace}, self._logger)
+
+    def close(self):
+        for shard in self._shards:
+            shard.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
@@ -2,58 +2,276 @@ import jpype as jp
 import os
 import bayespy.utils
 import platform
+import threading
+import copy
+import re
+
+class JvmProfile:
+    """
+    The options the JVM is started with.
+    :param heap_space: maximum heap size, e.g. '6g'
+    :param gc: garbage collector, one of 'serial', 'parallel', 'g1' or None for the JVM's default
+    :param class_data_sharing: 'auto', 'on', 'off' or None for the JVM's default (-Xshare)
+    :param tiered_stop_at_level: stop tiered compilation at this level (1 = C1 only, quicker to warm up but slower
+    at peak), None to leave it on
+    :param app_cds_archive: path to an application class data sharing archive for the Bayes Server classes. If the
+    file doesn't exist, it is written when the JVM exits and used from the next start. Only used on JDK 13 or later,
+    ignored on older (or unknown) versions.
+    :param include_jdbc: whether to put the SQLite JDBC driver on the classpath, only needed for datasets which
+    aren't in memory
+    :param extra_options: any other options to pass to the JVM
+    """
+
+    _GC_OPTIONS = {'serial': '-XX:+UseSerialGC', 'parallel': '-XX:+UseParallelGC', 'g1': '-XX:+UseG1GC'}
+
+    def __init__(self, heap_space='6g', gc=None, class_data_sharing=None, tiered_stop_at_level=None,
+                 app_cds_archive=None, include_jdbc=True, extra_options=None):
+        if gc is not None and gc not in self._GC_OPTIONS:
+            raise ValueError("gc {} not recognised, use one of {}".format(gc, list(self._GC_OPTIONS.keys())))
+
+        if class_data_sharing not in (None, 'auto', 'on', 'off'):
+            raise ValueError("class_data_sharing {} not recognised".format(class_data_sharing))
+
+        self.heap_space = heap_space
+        self.gc = gc
+        self.class_data_sharing = class_data_sharing
+        self.tiered_stop_at_level = tiered_stop_at_level
+        self.app_cds_archive = app_cds_archive
+        self.include_jdbc = include_jdbc
+        self.extra_options = [] if extra_options is None else list(extra_options)
+
+    def get_heap_bytes(self) -> int:
+        units = {'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+        heap_space = str(self.heap_space).strip().lower()
+        if heap_space[-1] in units:
+            return int(float(heap_space[:-1]) * units[heap_space[-1]])
+
+        return int(heap_space)
+
+    def get_classpath(self):
+        path_to_package = bayespy.utils.get_path_to_parent_dir(__file__)
+        separator = ";"
+        if platform.system() == "Linux":
+            separator = ":"
+
+        jars = [os.path.join(path_to_package, 'bin/bayesserver-7.8.jar')]
+        jdbc = os.path.join(path_to_package, 'bin/sqlite-jdbc-3.8.11.2.jar')
+        if self.include_jdbc and os.path.exists(jdbc):
+            jars.append(jdbc)
+
+        return separator.join(jars)
+
+    def get_options(self, java_version: int = None):
+        """
+        :param java_version: the major version of the JVM, which decides whether the AppCDS archive can be used
+        """
+        options = ["-Djava.class.path={}".format(self.get_classpath()), "-Xmx{}".format(self.heap_space)]
+
+        if self.gc is not None:
+            options.append(self._GC_OPTIONS[self.gc])
+
+        if self.gc in (None, 'parallel'):
+            options.append("-XX:-UseGCOverheadLimit")
+
+        if self.class_data_sharing is not None:
+            options.append("-Xshare:{}".format(self.class_data_sharing))
+
+        if self.tiered_stop_at_level is not None:
+            options.append("-XX:TieredStopAtLevel={}".format(self.tiered_stop_at_level))
+
+        # dynamic archives (ArchiveClassesAtExit) were added in JDK 13, older JVMs won't start with the option.
+        if self.app_cds_archive is not None and java_version is not None and java_version >= 13:
+            if os.path.exists(self.app_cds_archive):
+                options.append("-XX:SharedArchiveFile={}".format(self.app_cds_archive))
+            else:
+                options.append("-XX:ArchiveClassesAtExit={}".format(self.app_cds_archive))
+
+        return options + self.extra_options
+
+def _cache_dir():
+    # the package folder may be read only, or shared between JVM versions.
+    if platform.system() == "Windows":
+        base = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+    else:
+        base = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+
+    return os.path.join(base, 'bayespy')
+
+def _app_cds_archive_path():
+    return os.path.join(_cache_dir(), 'bayesserver-7.8.jsa')
+
+def get_java_version(jvm_path: str = None):
+    """
+    The major version of the JVM (e.g. 8 or 17), from the release file of the Java installation, or None if it
+    can't be found.
+    """
+    path = os.path.dirname(jvm_path if jvm_path is not None else jp.getDefaultJVMPath())
+    while True:
+        release = os.path.join(path, 'release')
+        if os.path.isfile(release):
+            with open(release) as fh:
+                match = re.search(r'JAVA_VERSION="(\d+)(?:\.(\d+))?', fh.read())
+            if match is None:
+                return None
+            major = int(match.group(1))
+            # versions before 9 are 1.x
+            return int(match.group(2)) if major == 1 and match.group(2) is not None else major
+
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+# named profiles which can be passed to attach.
+#  default: as before, a large heap for training in the main process.
+#  worker: query worker processes, which can be long lived (e.g. QueryWorkerPool), so a small heap but full tiered
+#  compilation.
+#  fast_start: short lived processes, C1 only and serial GC for a quick start over peak throughput, plus an AppCDS
+#  archive of the Bayes Server classes (generated on the first run, in the user's cache folder).
+#  throughput: long running jobs, parallel GC and full tiered compilation.
+PROFILES = {
+    'default': JvmProfile(heap_space='6g'),
+    'worker': JvmProfile(heap_space='1g', class_data_sharing='auto'),
+    'fast_start': JvmProfile(heap_space='1g', gc='serial', class_data_sharing='auto', tiered_stop_at_level=1,
+                             app_cds_archive=_app_cds_archive_path()),
+    'throughput': JvmProfile(heap_space='6g', gc='parallel'),
+}
+
+def get_profile(profile) -> JvmProfile:
+    if isinstance(profile, JvmProfile):
+        return profile
+
+    if profile not in PROFILES:
+        raise ValueError("JVM profile {} not recognised, use one of {}".format(profile, list(PROFILES.keys())))
+
+    return PROFILES[profile]
+
+# options recorded by attach, the JVM is started with these on first use (see ensure_started).
+_jvm_options = {'profile': PROFILES['default'], 'logger': None}
+_thread_state = threading.local()
+
+# resolved packages, keyed by package name.
+_packages = {}
+
+class _CachedPackage:
+    """
+    Wraps a jp.JPackage so that each class, enum or sub package is only resolved once; after the first lookup the
+    handle is held as a plain attribute on the wrapper.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._package = jp.JPackage(name)
+
+    def __getattr__(self, item):
+        if item.startswith('__'):
+            raise AttributeError(item)
+
+        value = getattr(self._package, item)
+        if isinstance(value, jp.JPackage):
+            value = _CachedPackage("{}.{}".format(self._name, item))
+
+        setattr(self, item, value)
+        return value
+
+    def __repr__(self):
+        return "<cached java package {}>".format(self._name)
 
 def attach_thread(logger=None):
+    if getattr(_thread_state, 'attached', False):
+        return
+
     if not jp.isThreadAttachedToJVM():
         if logger is not None:
             logger.debug("Attaching thread to JVM")
         jp.attachThreadToJVM()
 
-def attach(logger=None, heap_space='6g'):
+    _thread_state.attached = True
+
+def _start_jvm(logger, profile: JvmProfile):
+    jvm_path = jp.getDefaultJVMPath()
+    options = profile.get_options(java_version=get_java_version(jvm_path))
     if logger is not None:
-        logger.debug("JVM Started: {}".format(jp.isJVMStarted()))
+         logger.debug("Starting JVM ({})...".format(" ".join(options)))
+
+    # the JVM writes the archive when it exits, but won't create its folder.
+    if any(option.startswith("-XX:ArchiveClassesAtExit=") for option in options):
+        os.makedirs(os.path.dirname(profile.app_cds_archive), exist_ok=True)
+
+    jp.startJVM(jvm_path, *options)
+
+    if logger is not None:
+         logger.debug("JVM Started.")
 
+def ensure_started():
+    """
+    Starts the JVM (with the options given to attach) if it isn't running yet, and attaches the calling thread.
+    The accessors below call this, code using jp directly before any of them should call it first.
+    """
     if not jp.isJVMStarted():
-        path_to_package = bayespy.utils.get_path_to_parent_dir(__file__)
-        separator = ";"
-        if platform.system() == "Linux":
-            separator = ":"
+        _start_jvm(_jvm_options['logger'], _jvm_options['profile'])
 
-        classpath = ".{0}{1}{0}{2}".format(separator, os.path.join(path_to_package, 'bin/bayesserver-7.8.jar'),
-                                           os.path.join(path_to_package, 'bin/sqlite-jdbc-3.8.11.2.jar'))
+    # so it doesn't crash if called by a Python thread.
+    attach_thread(_jvm_options['logger'])
 
-        if logger is not None:
-             logger.debug("Starting JVM ({})...".format(classpath))
+def attach(logger=None, heap_space=None, lazy=False, profile='default'):
+    """
+    Set up and start the JVM.
+    :param heap_space: maximum heap size, overrides the profile's. Options only have an effect if the JVM hasn't been
+    started yet
+    :param lazy: if True, don't start the JVM until first use of one of the accessors (e.g. bayesServer()), so
+    configuring doesn't pay the startup cost unless it's needed. Code using jp directly should call ensure_started
+    first.
+    :param profile: the name of one of PROFILES, or a JvmProfile
+    """
+    if logger is not None:
+        logger.debug("JVM Started: {}".format(jp.isJVMStarted()))
 
-        jp.startJVM(jp.getDefaultJVMPath(), "-Djava.class.path={}".format(classpath), "-XX:-UseGCOverheadLimit", "-Xmx{}".format(heap_space))
+    if not jp.isJVMStarted():
+        profile = get_profile(profile)
+        if heap_space is not None and heap_space != profile.heap_space:
+            profile = copy.copy(profile)
+            profile.heap_space = heap_space
 
-        if logger is not None:
-             logger.debug("JVM Started.")
-        # so it doesn't crash if called by a Python thread.
-    attach_thread(logger)
+        _jvm_options.update({'profile': profile, 'logger': logger})
+
+    if not lazy or jp.isJVMStarted():
+        ensure_started()
 
 def detach():
-    if jp.isThreadAttachedToJVM():
+    if jp.isJVMStarted() and jp.isThreadAttachedToJVM():
         jp.detachThreadFromJVM()
 
+    _thread_state.attached = False
+
+def _package(name):
+    if not getattr(_thread_state, 'attached', False):
+        ensure_started()
+
+    package = _packages.get(name)
+    if package is None:
+        package = _CachedPackage(name)
+        _packages[name] = package
+
+    return package
+
 def bayesServer():
-    return jp.JPackage("com.bayesserver")
+    return _package("com.bayesserver")
 
 def bayesServerInference():
-    return jp.JPackage("com.bayesserver.inference")
+    return _package("com.bayesserver.inference")
 
 def bayesServerAnalysis():
-    return jp.JPackage("com.bayesserver.analysis")
+    return _package("com.bayesserver.analysis")
 
 def bayesServerParams():
-    return jp.JPackage("com.bayesserver.learning.parameters")
+    return _package("com.bayesserver.learning.parameters")
 
 def bayesServerDiscovery():
-    return jp.JPackage("com.bayesserver.data.discovery")
+    return _package("com.bayesserver.data.discovery")
 
 def bayesServerStructure():
-    return jp.JPackage("com.bayesserver.learning.structure")
+    return _package("com.bayesserver.learning.structure")
 
 def bayesServerSampling():
-    return jp.JPackage("com.bayesserver.data.sampling")
-
+    return _package("com.bayesserver.data.sampling")
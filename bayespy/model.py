@@ -17,9 +17,21 @@ import logging
 import multiprocess.context as ctx
 import pathos.multiprocessing as mp
 import itertools
+import json
 import math
+import os
+import contextlib
+import copy
+import hashlib
+import inspect
+import queue
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 
-from typing import List
+from typing import List, Tuple
 
 
 class QueryOutput:
@@ -28,17 +40,263 @@ class QueryOutput:
         self.discrete = discrete
 
 
+class ResultBuffer:
+    """
+    Preallocated, columnar storage for the results of a batch query over a chunk of rows.
+
+    Memory is fixed when the buffer is created: 8 bytes per row for each numeric column and for the caseid,
+    and 8 bytes per row for each object column plus the (usually shared) objects it points to. Integer and boolean
+    columns have no missing value, so also keep a mask of the rows written (1 byte per row). So the ceiling for a
+    chunk is roughly rows * 8 * (number of columns + 1) bytes, see estimate_memory.
+
+    Rows which were never written (e.g. a failed query) are NaN in float columns and None in object columns. Integer
+    and boolean columns with unwritten rows become float (NaN) and object (None) columns respectively in to_frame.
+    """
+
+    def __init__(self, columns: List[Tuple[str, str]], size: int):
+        self._size = size
+        self._arrays = OrderedDict()
+        self._written = {}
+        for name, dtype in columns:
+            self._allocate(name, dtype)
+
+        self.caseid = np.zeros(size, dtype=np.int64)
+
+    @staticmethod
+    def _is_masked(dtype) -> bool:
+        return np.dtype(dtype).kind not in ('f', 'c', 'O')
+
+    def _allocate(self, name, dtype):
+        dtype = np.dtype(dtype)
+        if dtype.kind in ('f', 'c'):
+            self._arrays[name] = np.full(self._size, np.nan, dtype=dtype)
+        elif dtype.kind == 'O':
+            self._arrays[name] = np.full(self._size, None, dtype=dtype)
+        else:
+            self._arrays[name] = np.zeros(self._size, dtype=dtype)
+            self._written[name] = np.zeros(self._size, dtype=bool)
+
+    def set(self, name: str, row: int, value) -> None:
+        if name not in self._arrays:
+            # a query that hasn't declared its columns, so fall back to a generic column.
+            self._allocate(name, 'object')
+
+        self._arrays[name][row] = value
+        if name in self._written:
+            self._written[name][row] = True
+
+    def _column(self, name, rows):
+        values = self._arrays[name][:rows]
+        if name not in self._written:
+            return values
+
+        written = self._written[name][:rows]
+        if written.all():
+            return values
+
+        missing = np.nan if values.dtype.kind in ('i', 'u') else None
+        values = values.astype(float if missing is np.nan else object)
+        values[~written] = missing
+        return values
+
+    def to_frame(self, rows: int = None) -> pd.DataFrame:
+        if rows is None:
+            rows = self._size
+
+        data = OrderedDict([('caseid', self.caseid[:rows])])
+        for name in self._arrays.keys():
+            data[name] = self._column(name, rows)
+
+        return pd.DataFrame(data)
+
+    def get_allocated_memory(self) -> int:
+        """
+        The number of bytes allocated by the buffer, excluding any objects referenced by object columns.
+        """
+        return self.caseid.nbytes + sum(values.nbytes for values in self._arrays.values()) + \
+            sum(written.nbytes for written in self._written.values())
+
+    @staticmethod
+    def estimate_memory(columns: List[Tuple[str, str]], rows: int) -> int:
+        """
+        The number of bytes allocated by a buffer with the specified columns and rows, excluding any objects
+        referenced by object columns.
+        """
+        return rows * (np.dtype(np.int64).itemsize +
+                       sum(np.dtype(dtype).itemsize + (1 if ResultBuffer._is_masked(dtype) else 0)
+                           for _, dtype in columns))
+
+
 class QueryBase:
+    def __new__(cls, *args, **kwargs):
+        query = super().__new__(cls)
+        # the constructor's arguments (with defaults filled in) identify the query for caching, as attributes can
+        # change once the query has been set up.
+        try:
+            arguments = inspect.signature(cls.__init__).bind(query, *args, **kwargs)
+            arguments.apply_defaults()
+            query._constructor_arguments = tuple(arguments.arguments.items())[1:]
+        except TypeError:
+            # e.g. when unpickling, after which the attributes (including these) are restored.
+            query._constructor_arguments = ()
+
+        return query
+
     def setup(self, network, inference_engine, query_options) -> None:
         pass
 
     def results(self, inference_engine, query_output) -> dict:
         pass
 
+    def columns(self) -> List[Tuple[str, str]]:
+        """
+        The (name, dtype) of each column written by this query, available once setup has been called.
+        """
+        return []
+
+    def write(self, inference_engine, query_output, buffer: ResultBuffer, row: int) -> None:
+        """
+        Write the results of the current query in to a row of the buffer, subclasses can override this to avoid
+        creating an intermediate dictionary.
+        """
+        for name, value in self.results(inference_engine, query_output).items():
+            buffer.set(name, row, value)
+
+    def cache_key(self) -> tuple:
+        """
+        A hashable description of the query, used by QueryCache. By default, built from the arguments the query was
+        constructed with.
+        """
+        items = []
+        for name, value in self._constructor_arguments:
+            canonical = _canonical_value(value)
+            items.append((name, repr(value) if canonical is _UNHASHABLE else canonical))
+
+        return (type(self).__name__,) + tuple(items)
+
     def use_pandas(self):
         return True
 
 
+_UNHASHABLE = object()
+
+
+def _canonical_value(value):
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return value
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.dtype):
+        return str(value)
+    if isinstance(value, (list, tuple)):
+        values = tuple(_canonical_value(v) for v in value)
+        return _UNHASHABLE if _UNHASHABLE in values else values
+    if isinstance(value, dict):
+        values = tuple(sorted((str(k), _canonical_value(v)) for k, v in value.items()))
+        return _UNHASHABLE if any(v is _UNHASHABLE for _, v in values) else values
+
+    return _UNHASHABLE
+
+
+# a generated id for each network, held weakly so entries go when the network does. identityHashCode can collide.
+_network_ids = weakref.WeakKeyDictionary()
+_network_ids_lock = threading.Lock()
+_next_network_id = itertools.count()
+
+
+def _network_key(network) -> int:
+    with _network_ids_lock:
+        key = _network_ids.get(network)
+        if key is None:
+            key = next(_next_network_id)
+            _network_ids[network] = key
+
+        return key
+
+
+class QueryCache:
+    """
+    An LRU cache of query results, keyed by the network, the evidence (as a dictionary) and the queries, for when
+    the same evidence is queried over and over (e.g. from a dashboard). Entries are evicted when there are more
+    than max_size, or after ttl seconds (if specified), and are invalidated when a network is retrained through
+    NetworkModel.
+    """
+
+    _caches = weakref.WeakSet()
+
+    def __init__(self, max_size: int = 1024, ttl: float = None):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        QueryCache._caches.add(self)
+
+    @staticmethod
+    def create_key(network, evidence: dict, queries: List[QueryBase], aslist=False) -> tuple:
+        canonical_evidence = tuple(sorted((str(k), _canonical_value(v)) for k, v in evidence.items()))
+        return (_network_key(network), canonical_evidence, tuple(query.cache_key() for query in queries), aslist)
+
+    def get(self, key):
+        """
+        :return: a tuple of (found, value)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._ttl is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                self.evictions += 1
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return False, None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[1]
+
+    def put(self, key, value) -> None:
+        expires = None if self._ttl is None else time.monotonic() + self._ttl
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, network=None) -> None:
+        """
+        Remove the entries for a network, or every entry if network is None
+        """
+        with self._lock:
+            if network is None:
+                self._entries.clear()
+                return
+
+            key = _network_key(network)
+            for k in [k for k in self._entries if k[0] == key]:
+                del self._entries[k]
+
+    @staticmethod
+    def invalidate_network(network) -> None:
+        """
+        Remove a network's entries from every cache, e.g. when it has been retrained, along with its query planner
+        calibrations.
+        """
+        for cache in list(QueryCache._caches):
+            cache.invalidate(network)
+
+        _invalidate_calibrations(network)
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'size': len(self._entries)}
+
+
 class InferenceEngine:
     _inference_factory = None
 
@@ -68,14 +326,94 @@ class InferenceEngine:
         return inference_engine, query_options, query_output
 
 
+class EnginePool:
+    """
+    A bounded, thread safe pool of inference engines over one network, as relevance tree engines are expensive to
+    build for large networks. Engines are checked out and returned (or use engine() as a context manager); on return
+    their evidence and query distributions are cleared, so the next caller gets a clean engine. If all max_size
+    engines are checked out, checkout waits for one to be returned.
+    """
+
+    def __init__(self, network, max_size: int = 4):
+        self._network = network
+        self._max_size = max_size
+        self._idle = []
+        self._condition = threading.Condition()
+        self.created = 0
+        self.reused = 0
+        self.checked_out = 0
+        self.waits = 0
+
+    def get_network(self):
+        return self._network
+
+    def checkout(self, timeout: float = None):
+        """
+        :param timeout: seconds to wait for an engine if they're all in use, raises TimeoutError after that
+        :return: an inference engine, which must be given back with checkin
+        """
+        with self._condition:
+            if len(self._idle) == 0 and self.checked_out >= self._max_size:
+                self.waits += 1
+                if not self._condition.wait_for(lambda: len(self._idle) > 0 or self.checked_out < self._max_size,
+                                                timeout):
+                    raise TimeoutError("No inference engine returned to the pool within {}s".format(timeout))
+
+            self.checked_out += 1
+            if len(self._idle) > 0:
+                self.reused += 1
+                return self._idle.pop()
+
+            self.created += 1
+
+        try:
+            return InferenceEngine(self._network).create_engine()
+        except BaseException:
+            with self._condition:
+                self.checked_out -= 1
+                self.created -= 1
+                self._condition.notify()
+            raise
+
+    def checkin(self, inference_engine):
+        """
+        Return an engine to the pool, clearing its evidence and query distributions
+        """
+        try:
+            inference_engine.getEvidence().clear()
+            inference_engine.getQueryDistributions().clear()
+        finally:
+            with self._condition:
+                self.checked_out -= 1
+                self._idle.append(inference_engine)
+                self._condition.notify()
+
+    @contextlib.contextmanager
+    def engine(self, timeout: float = None):
+        inference_engine = self.checkout(timeout=timeout)
+        try:
+            yield inference_engine
+        finally:
+            self.checkin(inference_engine)
+
+    def get_metrics(self) -> dict:
+        with self._condition:
+            return {'created': self.created, 'reused': self.reused, 'checked_out': self.checked_out,
+                    'idle': len(self._idle), 'waits': self.waits, 'max_size': self._max_size}
+
+
 class SingleQuery:
-    def __init__(self, network, inference_engine, logger):
+    def __init__(self, network, inference_engine, logger, cache: QueryCache = None):
+        """
+        :param cache: an optional QueryCache, used when evidence is passed as a dictionary
+        """
         self._factory = bayesServerInference().RelevanceTreeInferenceFactory()
         self._query_options = self._factory.createQueryOptions()
         self._query_output = self._factory.createQueryOutput()
         self._inference_engine = inference_engine
         self._network = network
         self._logger = logger
+        self._cache = cache
 
     def query_as_df(self, queries: List[QueryBase], evidence=None, clear_evidence=True) -> pd.DataFrame:
         r = self.query(queries, evidence = evidence, clear_evidence = clear_evidence)
@@ -88,8 +426,20 @@ class SingleQuery:
         """
         Query a number of variables (if none, then query all variables in the network)
         :param variables: a list of variables, or none
+        :param evidence: a Java evidence instance, or a dictionary of evidence (see Evidence.apply), which is
+        needed for the results to be cached
         :return: a QueryOutput object with separate continuous/ discrete dataframes
         """
+        key = None
+        if isinstance(evidence, dict):
+            if self._cache is not None:
+                key = QueryCache.create_key(self._network, evidence, queries, aslist=aslist)
+                found, value = self._cache.get(key)
+                if found:
+                    return [dict(r) for r in value] if isinstance(value, list) else dict(value)
+
+            evidence = Evidence(self._network, self._inference_engine).apply(evidence)
+
         for query in queries:
             query.setup(self._network, self._inference_engine, self._query_options)
 
@@ -109,10 +459,20 @@ class SingleQuery:
             self._inference_engine.getEvidence().clear()
 
         if len(queries) == 1 and not aslist:
-            return results[0]
+            results = results[0]
+
+        if key is not None:
+            self._cache.put(key, [dict(r) for r in results] if isinstance(results, list) else dict(results))
 
         return results
 
+    def prepare(self, queries: List[QueryBase]):
+        """
+        Set up the queries once, for when the same queries are run many times with different evidence
+        :return: a PreparedQuery
+        """
+        return PreparedQuery(self._network, queries, self._logger, inference_engine=self._inference_engine)
+
 
 class Evidence:
     def __init__(self, network, inference):
@@ -120,7 +480,7 @@ class Evidence:
         self._inference = inference
         self._evidence = inference.getEvidence()
         self._evidence.clear()
-        self._variables = network.getVariables()
+        self._index = bayespy.network.get_index(network)
 
     def apply(self, evidence: dict):
         """
@@ -130,24 +490,381 @@ class Evidence:
         :return: Nothing
         """
         for key, value in evidence.items():
-            v = self._variables.get(key)
-            if bayespy.network.is_variable_discrete(v):
-                if v is None:
-                    raise ValueError("Node {} does not exist".format(key))
+            if not self._index.variable_exists(key):
+                raise ValueError("Node {} does not exist".format(key))
 
-                st = v.getStates().get(value)
+            if self._index.is_discrete(key):
+                st = self._index.get_state(key, value)
                 if st is None:
                     raise ValueError("State {} does not exist in variable {}".format(value, key))
 
                 self._evidence.setState(st)
 
-            elif bayespy.network.is_variable_continuous(v):
-                self._evidence.set(v, jp.java.lang.Double(value))
+            elif self._index.is_continuous(key):
+                self._evidence.set(self._index.get_variable(key), jp.java.lang.Double(value))
 
 
         return self._evidence
 
 
+class PreparedQuery:
+    """
+    A set of queries which are set up against an inference engine once. Each call then only swaps the evidence and
+    re-runs inference, reusing the query distributions, query options and query output, so the cost of a call
+    doesn't grow with the number of calls (unlike calling SingleQuery.query repeatedly, which adds new query
+    distributions to the engine every time).
+    """
+
+    def __init__(self, network, queries: List[QueryBase], logger: logging.Logger, inference_engine=None):
+        if not hasattr(queries, "__getitem__"):
+            queries = [queries]
+
+        factory = InferenceEngine.get_inference_factory()
+        if inference_engine is None:
+            inference_engine = factory.createInferenceEngine(network)
+
+        self._network = network
+        self._logger = logger
+        self._queries = queries
+        self._inference_engine = inference_engine
+        self._query_options = factory.createQueryOptions()
+        self._query_output = factory.createQueryOutput()
+        self._evidence = Evidence(network, inference_engine)
+
+        query_distributions = inference_engine.getQueryDistributions()
+        existing = query_distributions.size()
+        for query in queries:
+            query.setup(network, inference_engine, self._query_options)
+
+        self._query_distributions = [query_distributions.get(i) for i in range(existing, query_distributions.size())]
+
+    def get_inference_engine(self):
+        return self._inference_engine
+
+    def columns(self) -> List[Tuple[str, str]]:
+        return [column for query in self._queries for column in query.columns()]
+
+    def _run(self, evidence):
+        current = self._inference_engine.getEvidence()
+        if isinstance(evidence, dict):
+            current.clear()
+            self._evidence.apply(evidence)
+        elif evidence is None:
+            current.clear()
+        elif not current.equals(evidence):
+            # copied rather than set, so the engine keeps the evidence instance held by self._evidence.
+            current.copy(evidence)
+
+        try:
+            self._inference_engine.query(self._query_options, self._query_output)
+        except BaseException as e:
+            self._logger.error(e)
+
+    def query(self, evidence=None, aslist=False):
+        """
+        Run the queries
+        :param evidence: a dictionary of evidence (see Evidence.apply), a Java evidence instance, or None
+        :return: the results of each query, as with SingleQuery.query
+        """
+        self._run(evidence)
+        results = [query.results(self._inference_engine, self._query_output) for query in self._queries]
+        self._inference_engine.getEvidence().clear()
+
+        if len(self._queries) == 1 and not aslist:
+            return results[0]
+
+        return results
+
+    def query_into(self, buffer: ResultBuffer, row: int, evidence=None) -> None:
+        """
+        Run the queries, writing the results in to a row of a preallocated buffer (see columns()), rather than
+        creating dictionaries.
+        """
+        self._run(evidence)
+        for query in self._queries:
+            query.write(self._inference_engine, self._query_output, buffer, row)
+
+        self._inference_engine.getEvidence().clear()
+
+    def close(self):
+        """
+        Remove the query distributions from the inference engine, if it is going to be used for anything else.
+        """
+        query_distributions = self._inference_engine.getQueryDistributions()
+        for qd in self._query_distributions:
+            query_distributions.remove(qd)
+
+        self._query_distributions = []
+
+
+def _detach_executor_threads(executor: ThreadPoolExecutor, max_workers: int, on_detach=None):
+    """
+    Detach every thread of an executor from the JVM. Each task waits on a barrier until all max_workers have one,
+    so every thread runs exactly one.
+    """
+    barrier = threading.Barrier(max_workers)
+
+    def detach():
+        if on_detach is not None:
+            on_detach()
+        barrier.wait()
+        bayespy.jni.detach()
+
+    for future in [executor.submit(detach) for i in range(max_workers)]:
+        future.result()
+
+
+class RequestCoalescer:
+    """
+    Gathers single queries (evidence dictionaries) arriving from any number of threads for up to max_latency seconds,
+    or until there are max_batch_size of them, and runs them together, so the per-call overhead of inference is
+    shared. Batches run on engines which are reused (a PreparedQuery per worker thread), or through the vectorised
+    engine if one is given and supports the queries. Callers get a concurrent.futures.Future for their result.
+
+    At most max_queue_depth requests wait to be batched; beyond that, submit raises queue.Full so the caller can shed
+    load. Call close(), or use as a context manager.
+    :param queries: the queries to run for every request
+    :param workers: the number of threads running batches, ignored if an executor is passed in
+    :param aslist: the shape of each result, as with SingleQuery.query
+    :param vectorized: an optional bayespy.vectorized.MixtureModel of the same network
+    :param executor: an optional ThreadPoolExecutor (with JVM-attached threads) to share with other coalescers, which
+    the caller is then responsible for shutting down
+    """
+
+    def __init__(self, network, queries: List[QueryBase], logger: logging.Logger, max_latency: float = 0.005,
+                 max_batch_size: int = 64, max_queue_depth: int = 1024, workers: int = 1, aslist=False,
+                 vectorized=None, executor: ThreadPoolExecutor = None):
+        if not hasattr(queries, "__getitem__"):
+            queries = [queries]
+
+        self._network = network
+        self._queries = copy.deepcopy(queries)
+        self._logger = logger
+        self._max_latency = max_latency
+        self._max_batch_size = max_batch_size
+        self._aslist = aslist
+
+        self._vectorized = None
+        if vectorized is not None:
+            if vectorized.supports(self._queries):
+                self._vectorized = vectorized
+            else:
+                logger.info("Queries aren't supported by vectorised inference, using the inference engine")
+
+        self._owns_executor = executor is None
+        self._workers = workers
+        self._executor = executor if executor is not None else ThreadPoolExecutor(
+            max_workers=workers, initializer=bayespy.jni.attach_thread, initargs=(logger,))
+        # bounds the batches waiting on the executor, so back pressure reaches the request queue.
+        self._in_flight = threading.BoundedSemaphore(2 * workers)
+        self._local = threading.local()
+
+        self._queue = queue.Queue(maxsize=max_queue_depth)
+        self._lock = threading.Lock()
+        self._metrics = {'requests': 0, 'rejected': 0, 'cancelled': 0, 'failed': 0, 'batches': 0,
+                         'vectorized_batches': 0, 'batched_requests': 0, 'max_queue_depth': 0, 'wait_seconds': 0.0,
+                         'batch_seconds': 0.0}
+        self._closed = False
+        self._dispatcher = threading.Thread(target=self._dispatch, name="RequestCoalescer", daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, evidence: dict) -> Future:
+        """
+        Queue a request
+        :param evidence: a dictionary of evidence (see Evidence.apply)
+        :return: a Future of the results
+        """
+        future = Future()
+        # checked and queued under the lock, so nothing can be queued after close has queued the sentinel.
+        with self._lock:
+            if self._closed:
+                raise ValueError("RequestCoalescer has been closed")
+
+            try:
+                self._queue.put_nowait((evidence, future, time.perf_counter()))
+            except queue.Full:
+                self._metrics['rejected'] += 1
+                raise
+
+            self._metrics['requests'] += 1
+            self._metrics['max_queue_depth'] = max(self._metrics['max_queue_depth'], self._queue.qsize())
+
+        return future
+
+    def query(self, evidence: dict, timeout: float = None):
+        """
+        Queue a request and wait for its results
+        :param timeout: seconds to wait, raises concurrent.futures.TimeoutError after that (and the request is
+        dropped if it hasn't been run yet)
+        """
+        future = self.submit(evidence)
+        try:
+            return future.result(timeout)
+        except BaseException:
+            future.cancel()
+            raise
+
+    def _dispatch(self):
+        stopping = False
+        while not stopping:
+            request = self._queue.get()
+            if request is None:
+                break
+
+            batch = [request]
+            deadline = request[2] + self._max_latency
+            while len(batch) < self._max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+
+                if request is None:
+                    stopping = True
+                    break
+
+                batch.append(request)
+
+            self._in_flight.acquire()
+            try:
+                self._executor.submit(self._run_batch, batch)
+            except RuntimeError as e:
+                # a shared executor which has been shut down.
+                self._in_flight.release()
+                self._fail(batch, e)
+
+    @staticmethod
+    def _fail(batch, exception: BaseException):
+        for _, future, _ in batch:
+            if future.set_running_or_notify_cancel():
+                future.set_exception(exception)
+
+    def _get_prepared_query(self) -> PreparedQuery:
+        prepared = getattr(self._local, 'prepared', None)
+        if prepared is None:
+            prepared = self._local.prepared = PreparedQuery(self._network, copy.deepcopy(self._queries),
+                                                            self._logger)
+
+        return prepared
+
+    def _format(self, results):
+        if len(self._queries) == 1 and not self._aslist:
+            return results[0]
+
+        return results
+
+    def _query_vectorized(self, evidence: List[dict]):
+        df = pd.DataFrame(evidence, index=range(len(evidence)))
+        per_query = [self._vectorized.query(df, [query]).to_dict('records') for query in self._queries]
+        return [(True, self._format([results[i] for results in per_query])) for i in range(len(evidence))]
+
+    def _query_engine(self, evidence: List[dict]):
+        prepared = self._get_prepared_query()
+        results = []
+        for e in evidence:
+            try:
+                results.append((True, prepared.query(evidence=e, aslist=self._aslist)))
+            except Exception as ex:
+                results.append((False, ex))
+
+        return results
+
+    def _run_batch(self, batch):
+        try:
+            started = time.perf_counter()
+            # callers which have given up (cancelled or timed out) are dropped.
+            requests = [request for request in batch if request[1].set_running_or_notify_cancel()]
+            if len(requests) > 0:
+                evidence = [request[0] for request in requests]
+                try:
+                    if self._vectorized is not None:
+                        results = self._query_vectorized(evidence)
+                    else:
+                        results = self._query_engine(evidence)
+                except Exception as ex:
+                    results = [(False, ex)] * len(requests)
+
+                for (_, future, _), (success, value) in zip(requests, results):
+                    if success:
+                        future.set_result(value)
+                    else:
+                        future.set_exception(value)
+
+            with self._lock:
+                self._metrics['cancelled'] += len(batch) - len(requests)
+                if len(requests) > 0:
+                    self._metrics['batches'] += 1
+                    self._metrics['vectorized_batches'] += 1 if self._vectorized is not None else 0
+                    self._metrics['batched_requests'] += len(requests)
+                    self._metrics['failed'] += sum(1 for request in requests
+                                                   if request[1].exception() is not None)
+                    self._metrics['wait_seconds'] += sum(started - request[2] for request in requests)
+                    self._metrics['batch_seconds'] += time.perf_counter() - started
+        finally:
+            self._in_flight.release()
+
+    def get_metrics(self) -> dict:
+        """
+        :return: counts of requests (queued, rejected because the queue was full, cancelled before they were run and
+        failed), batches, the current and largest queue depth, the mean batch size, the mean time requests waited to
+        be batched and the mean time to run a batch (in milliseconds)
+        """
+        with self._lock:
+            metrics = dict(self._metrics)
+
+        batches = max(metrics['batches'], 1)
+        batched_requests = max(metrics['batched_requests'], 1)
+        metrics.update({'queue_depth': self._queue.qsize(),
+                        'mean_batch_size': metrics['batched_requests'] / batches,
+                        'mean_wait_ms': 1000 * metrics.pop('wait_seconds') / batched_requests,
+                        'mean_batch_ms': 1000 * metrics.pop('batch_seconds') / batches})
+        return metrics
+
+    def clear_thread_state(self):
+        """
+        Drop the calling thread's engine, before the thread is detached from the JVM
+        """
+        self._local.prepared = None
+
+    def close(self):
+        """
+        Run any requests which are still queued, then stop. Requests submitted after this raise ValueError.
+        """
+        with self._lock:
+            if self._closed:
+                return
+
+            self._closed = True
+
+        self._queue.put(None)
+        self._dispatcher.join()
+
+        # the dispatcher stops at the sentinel, so anything left (e.g. if it failed) would otherwise never complete.
+        remaining = []
+        while True:
+            try:
+                request = self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if request is not None:
+                remaining.append(request)
+
+        self._fail(remaining, RuntimeError("RequestCoalescer was closed before the request was run"))
+        if self._owns_executor:
+            _detach_executor_threads(self._executor, self._workers, on_detach=self.clear_thread_state)
+            self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
 class Distribution:
 
     def __init__(self, head_variables: List[str], tail_variables: List[str], states: List[str]):
@@ -244,12 +961,16 @@ class QueryConditionalJointProbability(QueryBase):
     def get_tail_variables(self):
         return self._tail_variables
 
+    def cache_key(self):
+        return (type(self).__name__, tuple(self._head_variables), tuple(self._tail_variables))
+
     def setup(self, network, inference_engine, query_options):
+        index = bayespy.network.get_index(network)
         contexts = []
         for h in self._head_variables + self._tail_variables:
-            v = bayespy.network.get_variable(network, h)
+            v = index.get_variable(h)
 
-            if bayespy.network.is_variable_discrete(v):
+            if index.is_discrete(h):
                 if h in self._head_variables:
                     raise ValueError("Bayespy only supports discrete tail variables (BayesServer is fine with it though!)")
 
@@ -262,33 +983,36 @@ class QueryConditionalJointProbability(QueryBase):
                                                                     else bayesServer().HeadTail.TAIL))
 
         self._network = network
+        self._index = index
         self._distribution = bayesServer().CLGaussian(contexts)
         self._query_distribution = bayesServerInference().QueryDistribution(self._distribution)
         inference_engine.getQueryDistributions().add(self._query_distribution)
 
+    def columns(self):
+        state_names = [self._index.get_state_names(v) for v in self._tail_variables]
+
+        return [(Distribution(self._head_variables, self._tail_variables, list(states)).key(), 'object')
+                for states in itertools.product(*state_names)]
+
     def results(self, inference_engine, query_output):
         results = {}
-        def state_generator(variables):
-            for v in variables:
-                tv = bayespy.network.get_variable(self._network, v)
-                yield [state for state in tv.getStates()]
+        head = [self._index.get_variable(h) for h in self._head_variables]
+        state_array_type = jp.JArray(bayesServer().State)
 
-        for state_combinations in itertools.product(*state_generator(self._tail_variables)):
+        for state_combinations in itertools.product(*[self._index.get_states(v) for v in self._tail_variables]):
 
-            state_array = jp.JArray(state_combinations[0].getClass())(len(state_combinations))
+            state_array = state_array_type(len(state_combinations))
             for i, state in enumerate(state_combinations):
                 state_array[i] = state
 
             dist = Distribution(self._head_variables, self._tail_variables,
                                      [state.getName() for state in state_combinations])
 
-            for i,h in enumerate(self._head_variables):
-                v = bayespy.network.get_variable(self._network, h)
+            for i,v in enumerate(head):
                 mean = self._distribution.getMean(v, state_array)
                 if dist.is_covariant():
                     dist.append_mean(mean)
-                    for j,h1 in enumerate(self._head_variables):
-                        v1 = bayespy.network.get_variable(self._network, h1)
+                    for j,v1 in enumerate(head):
                         cov = self._distribution.getCovariance(v, v1, state_array)
                         dist.set_covariance_value(i, j, cov)
                 else:
@@ -328,6 +1052,23 @@ class QueryStatistics(QueryBase):
 
         return result
 
+    def columns(self):
+        columns = []
+        if self._calc_loglikelihood:
+            columns.append((self._loglikelihood_column, 'float64'))
+
+        if self._calc_conflict:
+            columns.append((self._conflict_column, 'float64'))
+
+        return columns
+
+    def write(self, inference_engine, query_output, buffer, row):
+        if self._calc_loglikelihood:
+            buffer.set(self._loglikelihood_column, row, query_output.getLogLikelihood().floatValue())
+
+        if self._calc_conflict:
+            buffer.set(self._conflict_column, row, query_output.getConflict().floatValue())
+
 
 # seems like a better name than QueryStatistics, so just having this here.
 class QueryModelStatistics(QueryStatistics):
@@ -346,10 +1087,12 @@ class QueryMostLikelyState(QueryBase):
     def setup(self, network, inference_engine, query_options):
         distribution = None
 
-        self._variable = bayespy.network.get_variable(network, self._target_variable_name)
+        index = bayespy.network.get_index(network)
+        self._variable = index.get_variable(self._target_variable_name)
 
-        if bayespy.network.is_variable_discrete(self._variable):
+        if index.is_discrete(self._target_variable_name):
             distribution = bayesServer().Table(self._variable)
+            self._states = index.get_states(self._target_variable_name)
 
         if distribution is None:
             raise ValueError("{} needs to be discrete in QueryMostLikelyState".format(self._target_variable_name))
@@ -360,31 +1103,51 @@ class QueryMostLikelyState(QueryBase):
         self._distribution = distribution
         inference_engine.getQueryDistributions().add(qd)
 
-    def results(self, inference_engine, query_output):
+    def _most_likely_state(self):
         states = {}
-        for state in self._variable.getStates():
+        for state in self._states:
             states.update({state.getName(): self._distribution.get([state])})
 
         # get the most likely state
         max_state = max(states.keys(), key=(lambda key: states[key]))
-        max_state_name = bayespy.data.DataFrame.cast2(self._output_dtype, max_state)
+        return bayespy.data.DataFrame.cast2(self._output_dtype, max_state)
+
+    def results(self, inference_engine, query_output):
+        return {self._target_variable_name + self._suffix: self._most_likely_state()}
+
+    def columns(self):
+        dtype = self._output_dtype
+        if not bayespy.data.DataFrame.is_numeric(dtype) and not bayespy.data.DataFrame.is_bool(dtype):
+            dtype = 'object'
 
-        return {self._target_variable_name + self._suffix: max_state_name}
+        return [(self._target_variable_name + self._suffix, dtype)]
+
+    def write(self, inference_engine, query_output, buffer, row):
+        buffer.set(self._target_variable_name + self._suffix, row, self._most_likely_state())
 
 class QueryStateProbability(QueryMostLikelyState):
 
     def __init__(self, target_variable_name, suffix="_probability"):
         super().__init__(target_variable_name=target_variable_name, output_dtype="float64", suffix=suffix)
 
+    def _column_name(self, state_name):
+        return self._target_variable_name + bayespy.network.STATE_DELIMITER + state_name + self._suffix
+
     def results(self, inference_engine, query_output):
         states = {}
-        for state in self._variable.getStates():
+        for state in self._states:
             p = self._distribution.get([state])
-            states.update({self._target_variable_name + bayespy.network.STATE_DELIMITER + state.getName()
-                           + self._suffix: p})
+            states.update({self._column_name(state.getName()): p})
 
         return states
 
+    def columns(self):
+        return [(self._column_name(state.getName()), 'float64') for state in self._states]
+
+    def write(self, inference_engine, query_output, buffer, row):
+        for state in self._states:
+            buffer.set(self._column_name(state.getName()), row, self._distribution.get([state]))
+
 
 class QueryLogLikelihood(QueryBase):
     def __init__(self, variable_names, column_name: str = '_loglikelihood'):
@@ -398,7 +1161,8 @@ class QueryLogLikelihood(QueryBase):
         self._column_name = column_name
 
     def setup(self, network, inference_engine, query_options):
-        variables = [bayespy.network.get_variable(network, n) for n in self._variable_names]
+        index = bayespy.network.get_index(network)
+        variables = [index.get_variable(n) for n in self._variable_names]
         if len(variables) == 1:
             self._distribution = bayesServer().CLGaussian(variables[0])
         else:
@@ -417,6 +1181,9 @@ class QueryLogLikelihood(QueryBase):
         result.update({":".join(self._variable_names) + self._column_name: value})
         return result
 
+    def columns(self):
+        return [(":".join(self._variable_names) + self._column_name, 'float64')]
+
 
 class QueryMeanVariance(QueryBase):
     def __init__(self, variable_name, retract_evidence=True, result_mean_suffix='_mean',
@@ -429,9 +1196,10 @@ class QueryMeanVariance(QueryBase):
         self._output_dtype = output_dtype
 
     def setup(self, network, inference_engine, query_options):
-        self._variable = bayespy.network.get_variable(network, self._variable_name)
+        index = bayespy.network.get_index(network)
+        self._variable = index.get_variable(self._variable_name)
 
-        if not bayespy.network.is_variable_continuous(self._variable):
+        if not index.is_continuous(self._variable_name):
             raise ValueError("{} needs to be continuous.".format(self._variable_name))
 
         self._query = bayesServer().CLGaussian(self._variable)
@@ -449,17 +1217,67 @@ class QueryMeanVariance(QueryBase):
         return {self._variable_name + self._result_mean_suffix: mean,
                 self._variable_name + self._result_variance_suffix: self._query.getVariance(self._variable)}
 
+    def columns(self):
+        mean_dtype = 'float64' if self._output_dtype is None else self._output_dtype
+        return [(self._variable_name + self._result_mean_suffix, mean_dtype),
+                (self._variable_name + self._result_variance_suffix, 'float64')]
+
+
+# networks deserialised in this process, keyed by a hash of their xml, so that a long-lived worker only
+# parses each network once.
+_network_cache = OrderedDict()
+_NETWORK_CACHE_SIZE = 8
+
+
+def _get_cached_network(network: str):
+    key = hashlib.sha1(network.encode('utf-8')).hexdigest()
+    if key in _network_cache:
+        _network_cache.move_to_end(key)
+        return _network_cache[key]
 
-def _batch_query(df: pd.DataFrame, connection_string: str, network: str, table_name: str,
+    jnetwork = bayespy.network.create_network_from_string(network)
+    _network_cache[key] = jnetwork
+    if len(_network_cache) > _NETWORK_CACHE_SIZE:
+        _network_cache.popitem(last=False)
+
+    return jnetwork
+
+
+def _batch_query(df: pd.DataFrame, connection_string: str, network: str, select_statement: str,
                  variable_references: List[str],
                  queries, logger, i):
-    bayespy.jni.attach(logger, heap_space='1g')
-    data_reader = bayesServer().data.DatabaseDataReaderCommand(
-        connection_string,
-        "select * from {} where ix in ({})".format(table_name,
-                                                   ",".join(str(i) for i in df.index.tolist()))).executeReader()
+    bayespy.jni.attach(logger, profile='worker')
+    return _query_rows(df, connection_string, _get_cached_network(network), select_statement, variable_references,
+                       queries, logger, i)
+
+
+def _query_row(inference_engine, query_options, query_output, queries, buffer: ResultBuffer, row: int,
+               logger) -> bool:
+    """
+    Run inference on the engine's current evidence, writing the results in to a row of the buffer. If inference
+    fails, nothing is written, so the row is left missing rather than holding the previous row's output.
+    :return: whether inference succeeded
+    """
+    try:
+        inference_engine.query(query_options, query_output)
+    except BaseException as e:
+        logger.error(e)
+        return False
+
+    for query in queries:
+        query.write(inference_engine, query_output, buffer, row)
+
+    return True
+
+
+def _query_rows(df: pd.DataFrame, connection_string: str, network, select_statement: str,
+                variable_references: List[str], queries, logger, i):
+    if connection_string is None:
+        # in-memory dataset, so read straight from the slice of the dataframe that was passed in.
+        data_reader = bayespy.data.create_data_table(df).createDataReader()
+    else:
+        data_reader = bayesServer().data.DatabaseDataReaderCommand(connection_string, select_statement).executeReader()
 
-    network = bayespy.network.create_network_from_string(network)
     reader_options = bayesServer().data.ReaderOptions("ix")
     variable_refs = list(bayespy.network.create_variable_references(network, df,
                                                                     variable_references=variable_references))
@@ -473,25 +1291,18 @@ def _batch_query(df: pd.DataFrame, connection_string: str, network: str, table_n
     for query in queries:
         query.setup(network, inference_engine, query_options)
 
-    results = []
+    columns = [column for query in queries for column in query.columns()]
+    logger.debug("Allocating {} bytes for the results of {} rows".format(
+        ResultBuffer.estimate_memory(columns, len(df)), len(df)))
+
+    buffer = ResultBuffer(columns, len(df))
+    row = 0
     try:
         while reader.read(inference_engine.getEvidence(), bayesServer().data.DefaultReadOptions(True)):
-            result = {}
-
-            try:
-                inference_engine.query(query_options, query_output)
-            except BaseException as e:
-                logger.error(e)
-                # inference_engine.getEvidence().clear()
-                # continue
-
-            for query in queries:
-                result = {**result, **query.results(inference_engine, query_output)}
-
+            _query_row(inference_engine, query_options, query_output, queries, buffer, row, logger)
             inference_engine.getEvidence().clear()
-            result.update({'caseid': int(reader.getReadInfo().getCaseId().toString())})
-
-            results.append(result)
+            buffer.caseid[row] = int(reader.getReadInfo().getCaseId().toString())
+            row += 1
 
             if i % 500 == 0:
                 logger.info("Queried case {}".format(i))
@@ -500,40 +1311,312 @@ def _batch_query(df: pd.DataFrame, connection_string: str, network: str, table_n
     finally:
         reader.close()
         # bayespy.jni.detach()
-    return results
+    return buffer.to_frame(row)
+
+
+def _timed_batch_query(chunk_id: int, df: pd.DataFrame, connection_string: str, network: str, select_statement: str,
+                       variable_references: List[str], queries, logger):
+    started = time.time()
+    startup = _start_worker(network)
+    results = _batch_query(df, connection_string, network, select_statement, variable_references, queries, logger, 0)
+    return results, {'chunk': chunk_id, 'rows': len(df), 'started': started, 'seconds': time.time() - started,
+                     'worker': os.getpid(), 'startup_seconds': startup}
+
+
+class QueryWorkerPool:
+    """
+    A long-lived pool of worker processes for batch queries. Each worker starts its JVM and parses a network the
+    first time it is needed, and keeps both for subsequent calls, so the start up cost is only paid once rather
+    than on every call to BatchQuery.query. Either call close() or use as a context manager.
+    """
+
+    def __init__(self, logger: logging.Logger, processes: int = None):
+        if processes is None:
+            processes = 1 if mp.cpu_count() == 1 else mp.cpu_count() - 1
+
+        self._logger = logger
+        self._pool = None
+        self.processes = processes
+
+    def start(self):
+        if self._pool is None:
+            self._logger.info("Starting {} query worker processes".format(self.processes))
+            # bit nasty, but the only way I could get jpype to stop hanging in Linux.
+            ctx._force_start_method('spawn')
+            self._pool = mp.Pool(processes=self.processes)
+
+        return self
+
+    def map(self, func, iterable):
+        return self.start()._pool.map(func, iterable)
+
+    def imap_unordered(self, func, iterable):
+        """
+        As map, but each worker takes the next item as soon as it's free, and results are returned as they finish
+        """
+        return self.start()._pool.imap_unordered(func, iterable)
+
+    def submit(self, func, *args):
+        """
+        Run func asynchronously on one of the workers
+        :return: an AsyncResult
+        """
+        return self.start()._pool.apply_async(func, args)
+
+    def is_running(self) -> bool:
+        return self._pool is not None
+
+    def close(self):
+        if self._pool is not None:
+            self._logger.info("Stopping query worker processes")
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+def _start_worker(network: str) -> float:
+    # the seconds spent starting the JVM and parsing the network, close to zero if the process already has both.
+    start = time.perf_counter()
+    bayespy.jni.attach(profile='worker')
+    _get_cached_network(network)
+    return time.perf_counter() - start
+
+# the cost of starting a query worker process (spawn, JVM start and parsing the network), taken from the last pool of
+# workers started by a query rather than measured separately.
+_worker_startup_seconds = None
+
+
+def _record_worker_startup(pool_started: float, timings: List[dict]) -> None:
+    global _worker_startup_seconds
+    if len(timings) > 0:
+        # the time until the first chunk reached a worker, plus the slowest JVM start and network parse.
+        _worker_startup_seconds = max(min(timing['started'] for timing in timings) - pool_started, 0.0) + \
+                                  max(timing['startup_seconds'] for timing in timings)
+
+# calibrations by network, queries and reader, as querying the sample costs about as much as a small query.
+_calibrations = OrderedDict()
+_calibrations_lock = threading.Lock()
+_CALIBRATION_CACHE_SIZE = 32
+
+
+def _invalidate_calibrations(network) -> None:
+    key = _network_key(network)
+    with _calibrations_lock:
+        for calibration_key in [k for k in _calibrations.keys() if k[0] == key]:
+            del _calibrations[calibration_key]
+
+
+class QueryPlan:
+    def __init__(self, workers: int, chunk_size: int, predicted_seconds: float, per_row_seconds: float,
+                 chunk_setup_seconds: float, startup_seconds: float, worker_memory: int):
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.predicted_seconds = predicted_seconds
+        self.per_row_seconds = per_row_seconds
+        self.chunk_setup_seconds = chunk_setup_seconds
+        self.startup_seconds = startup_seconds
+        self.worker_memory = worker_memory
+
+    def __repr__(self):
+        return "QueryPlan(workers={}, chunk_size={}, predicted_seconds={:.2f})".format(self.workers, self.chunk_size,
+                                                                                      self.predicted_seconds)
+
+
+class QueryPlanner:
+    """
+    Chooses the number of worker processes and chunk size for a batch query. The cost of querying a row and of
+    setting up the queries on a chunk is measured by querying a small sample of rows in this process, with the same
+    reader (in memory or from the database) as the query itself, once per network and set of queries. The cost of
+    starting a worker (zero if a warm pool is being used) is taken from the last time workers were started by a
+    query, with DEFAULT_STARTUP_SECONDS used until then. The plan with the lowest predicted wall time is chosen, with
+    no more workers than fit in the memory budget.
+    :param sample_size: the number of rows to calibrate on
+    :param memory_budget: bytes available to workers, defaults to 80% of the currently available physical memory
+    :param max_workers: defaults to cpu_count() - 1
+    :param chunks_per_worker: the number of chunks to aim for per worker, so that a worker which finishes early can
+    take more work rather than waiting on the slowest
+    """
+
+    # memory used by a worker process (Python, pandas and the JVM itself) on top of the JVM heap.
+    WORKER_OVERHEAD_BYTES = 200 * 1024 ** 2
+    # the cost of starting a worker, until one has been measured.
+    DEFAULT_STARTUP_SECONDS = 3.0
+
+    def __init__(self, logger: logging.Logger, sample_size: int = 100, memory_budget: int = None,
+                 max_workers: int = None, chunks_per_worker: int = 4):
+        self._logger = logger
+        self._chunks_per_worker = chunks_per_worker
+        self._sample_size = sample_size
+        self._memory_budget = memory_budget
+        self._max_workers = max(mp.cpu_count() - 1, 1) if max_workers is None else max_workers
+
+    @staticmethod
+    def get_available_memory():
+        try:
+            return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+        except (ValueError, OSError, AttributeError):
+            return None
+
+    def _time_rows(self, network, df, queries, variable_references, datastore):
+        connection_string = None if datastore is None else datastore.get_connection()
+        select_statement = None if connection_string is None else datastore.create_select_statement(df.index)
+        start = time.perf_counter()
+        results = _query_rows(df, connection_string, network, select_statement, variable_references,
+                              copy.deepcopy(queries), self._logger, 0)
+        return time.perf_counter() - start, results
+
+    def calibrate(self, network, data: pd.DataFrame, queries: List[QueryBase], variable_references: List[str] = [],
+                  datastore=None):
+        """
+        Query a sample of rows in this process, or return the costs measured last time for the same network, queries
+        and reader
+        :param datastore: the DataSet the data is read from, so the sample is read in the same way as the query
+        :return: a tuple of (seconds per row, seconds to set up a chunk, bytes per row of data and results)
+        """
+        sample = data.iloc[:self._sample_size]
+        if len(sample) < 2:
+            return 0.0, 0.0, 0
+
+        in_memory = datastore is None or datastore.get_connection() is None
+        key = (_network_key(network), tuple(query.cache_key() for query in queries), tuple(variable_references),
+               in_memory, len(sample))
+        with _calibrations_lock:
+            if key in _calibrations:
+                _calibrations.move_to_end(key)
+                return _calibrations[key]
+
+        # the first call warms up the JVM, the single row call then gives the fixed cost of a chunk.
+        self._time_rows(network, sample.iloc[:1], queries, variable_references, datastore)
+        sample_seconds, results = self._time_rows(network, sample, queries, variable_references, datastore)
+        single_seconds, _ = self._time_rows(network, sample.iloc[:1], queries, variable_references, datastore)
+
+        per_row = max((sample_seconds - single_seconds) / (len(sample) - 1), 0.0)
+        row_bytes = (sample.memory_usage(deep=True).sum() + results.memory_usage(deep=True).sum()) / len(sample)
+        calibration = (per_row, max(single_seconds - per_row, 0.0), row_bytes)
+        with _calibrations_lock:
+            _calibrations[key] = calibration
+            if len(_calibrations) > _CALIBRATION_CACHE_SIZE:
+                _calibrations.popitem(last=False)
+
+        return calibration
+
+    def get_startup_seconds(self) -> float:
+        """
+        :return: the cost of starting a worker process, as measured the last time workers were started
+        """
+        return self.DEFAULT_STARTUP_SECONDS if _worker_startup_seconds is None else _worker_startup_seconds
+
+    @staticmethod
+    def _predict(rows, workers, chunk_size, per_row, chunk_setup, startup):
+        chunks = math.ceil(rows / chunk_size)
+        return startup + math.ceil(chunks / workers) * (chunk_size * per_row + chunk_setup)
+
+    def plan(self, network, data: pd.DataFrame, queries: List[QueryBase], variable_references: List[str] = [],
+             warm_workers: int = None, datastore=None) -> QueryPlan:
+        """
+        :param network: the (Java) network
+        :param warm_workers: the number of processes in an already started pool, if there is one
+        :param datastore: the DataSet the data is read from, if any
+        """
+        rows = len(data)
+        per_row, chunk_setup, row_bytes = self.calibrate(network, data, queries, variable_references,
+                                                         datastore=datastore)
+        serial_seconds = rows * per_row + chunk_setup
+
+        network_str = network.saveToString()
+        worker_memory = int(bayespy.jni.get_profile('worker').get_heap_bytes() + self.WORKER_OVERHEAD_BYTES +
+                            len(network_str))
+
+        memory_budget = self._memory_budget
+        if memory_budget is None:
+            available = self.get_available_memory()
+            memory_budget = None if available is None else int(available * 0.8)
+
+        max_workers = self._max_workers if warm_workers is None else warm_workers
+        if memory_budget is not None and warm_workers is None:
+            max_workers = min(max_workers, max(int(memory_budget // worker_memory), 1))
+
+        max_workers = max(min(max_workers, rows), 1)
+
+        # inline, in this process, has no startup cost
+        best = QueryPlan(1, max(rows, 1), serial_seconds, per_row, chunk_setup, 0.0, 0)
+        startup = 0.0 if warm_workers is not None else self.get_startup_seconds()
+        if max_workers > 1 and serial_seconds > startup:
+            # keep the fixed cost of each chunk at 5% or less of the time spent querying it.
+            min_chunk = 1 if per_row == 0 else int(math.ceil(20 * chunk_setup / per_row))
+            for workers in range(2, max_workers + 1):
+                # several chunks per worker, unless that makes them so small their setup dominates, and fewer rows
+                # if a worker can't hold that many rows and their results.
+                chunk_size = min(max(math.ceil(rows / (workers * self._chunks_per_worker)), min_chunk),
+                                 math.ceil(rows / workers))
+                if memory_budget is not None and warm_workers is None:
+                    max_chunk = (memory_budget - workers * worker_memory) / max(workers * row_bytes, 1)
+                    if max_chunk < 1:
+                        break
+                    chunk_size = min(chunk_size, int(max_chunk))
+
+                predicted = self._predict(rows, workers, chunk_size, per_row, chunk_setup, startup)
+                if predicted < best.predicted_seconds:
+                    best = QueryPlan(workers, chunk_size, predicted, per_row, chunk_setup, startup, worker_memory)
+
+        self._logger.info("Query plan for {} rows: {} worker(s), chunks of {} rows, predicted {:.2f}s "
+                          "(per row {:.2e}s, chunk setup {:.3f}s, worker startup {:.2f}s, worker memory {:.0f}MB, "
+                          "budget {})".format(rows, best.workers, best.chunk_size, best.predicted_seconds, per_row,
+                                              chunk_setup, best.startup_seconds, worker_memory / 1024 ** 2,
+                                              "unlimited" if memory_budget is None
+                                              else "{:.0f}MB".format(memory_budget / 1024 ** 2)))
+        return best
 
 
 class BatchQuery:
-    def __init__(self, network, datastore, logger: logging.Logger):
+    def __init__(self, network, datastore, logger: logging.Logger, pool: QueryWorkerPool = None,
+                 planner: QueryPlanner = None):
 
         self._logger = logger
         self._datastore = datastore
+        self._pool = pool
+        self._jnetwork = network
+        self._planner = QueryPlanner(logger) if planner is None else planner
+        self._chunk_timings = []
         # serialise the network as a string.
         self._network = network.saveToString()
 
-    def _calc_num_threads(self, df_size: int, query_size: int) -> int:
-        num_queries = df_size * query_size
+    def get_chunk_timings(self) -> pd.DataFrame:
+        """
+        :return: for each chunk queried by the last call to query or query_iter, the number of rows, the worker (pid)
+        which queried it, when it started (seconds from the first chunk starting) and how long it took
+        """
+        timings = pd.DataFrame(self._chunk_timings, columns=['chunk', 'rows', 'started', 'seconds', 'worker',
+                                                             'startup_seconds'])
+        if len(timings) > 0:
+            timings['started'] -= timings['started'].min()
+
+        return timings.sort_values('chunk').set_index('chunk')
 
-        if mp.cpu_count() == 1:
-            max = 1
-        else:
-            max = mp.cpu_count() - 1
-
-        calc = int(num_queries / 5000)
-        if calc > max:
-            r = max
-        elif calc <= 1:
-            if num_queries > 1000:
-                r = 2
-            else:
-                r = 1
-        else:
-            r = calc
+    def _record_timing(self, result):
+        df, timing = result
+        self._chunk_timings.append(timing)
+        return df
 
-        return r
+    def _plan(self, queries, variable_references) -> QueryPlan:
+        return self._planner.plan(self._jnetwork, self._datastore.data, queries,
+                                  variable_references=variable_references,
+                                  warm_workers=None if self._pool is None else self._pool.processes,
+                                  datastore=self._datastore)
 
     def query(self, queries: List[QueryBase] = [QueryStatistics()], append_to_df=True,
               variable_references: List[str] = []):
+        """
+        Query every row in the datastore. Each worker writes its results in to a preallocated ResultBuffer, so the
+        memory used by the results is bounded by ResultBuffer.estimate_memory for the declared query columns (plus
+        one copy when the chunks are concatenated).
+        """
 
         if not hasattr(queries, "__getitem__"):
             queries = [queries]
@@ -541,34 +1624,455 @@ class BatchQuery:
         nt = self._network
         logger = self._logger
         conn = self._datastore.get_connection()
-        table = self._datastore.table
-        processes = self._calc_num_threads(len(self._datastore.data), len(queries))
-
-        self._logger.info("Using {} processes to query {} rows".format(processes, len(self._datastore.data)))
-
-        if processes == 1:
-            pdf = pd.DataFrame(_batch_query(self._datastore.data, conn, nt, table,
-                                            variable_references, queries,
-                                            logger, 0))
+        plan = self._plan(queries, variable_references)
+        processes = plan.workers
+        data = self._datastore.data
+
+        self._logger.info("Using {} processes to query {} rows".format(processes, len(data)))
+
+        # the select statements are created up front, as subsets may need an index table writing to the database.
+        chunks = [(i, df, None if conn is None else self._datastore.create_select_statement(df.index))
+                  for i, df in enumerate([data.iloc[start:start + plan.chunk_size]
+                                          for start in range(0, max(len(data), 1), plan.chunk_size)])]
+
+        def query_chunk(chunk):
+            return _timed_batch_query(chunk[0], chunk[1], conn, nt, chunk[2], variable_references, queries, logger)
+
+        self._chunk_timings = []
+        # chunks are taken by whichever worker is free, so finish in any order; the results are put back in order
+        # by caseid.
+        if self._pool is not None:
+            pdf = pd.concat([self._record_timing(r) for r in self._pool.imap_unordered(query_chunk, chunks)])
+        elif processes == 1:
+            pdf = pd.concat([self._record_timing(query_chunk(chunk)) for chunk in chunks])
         else:
             # bit nasty, but the only way I could get jpype to stop hanging in Linux.
             ctx._force_start_method('spawn')
 
+            pool_started = time.time()
             with mp.Pool(processes=processes) as pool:
-                pdf = pd.DataFrame()
-                for result_set in pool.map(lambda df: _batch_query(df, conn, nt, table,
-                                                                   variable_references, queries,
-                                                                   logger, 0),
-                                           np.array_split(self._datastore.data, processes)):
-                    pdf = pdf.append(pd.DataFrame(result_set))
+                pdf = pd.concat([self._record_timing(r) for r in pool.imap_unordered(query_chunk, chunks)])
 
-        df = pdf.set_index('caseid')
+            _record_worker_startup(pool_started, self._chunk_timings)
+
+        timings = self.get_chunk_timings()
+        self._logger.debug("Queried {} chunks, median {:.2f}s, slowest {:.2f}s".format(
+            len(timings), timings['seconds'].median(), timings['seconds'].max()))
+
+        df = pdf.set_index('caseid').sort_index()
 
         if append_to_df:
             return self._datastore.data.join(df)
         else:
             return df
 
+    def query_iter(self, queries: List[QueryBase] = [QueryStatistics()], chunk_size: int = 50000,
+                   variable_references: List[str] = [], max_pending: int = None, chunks=None):
+        """
+        Query the datastore in chunks, yielding a dataframe of results (indexed by caseid, to join back on to the
+        original data) for each chunk as soon as a worker finishes it. At most max_pending chunks are queued or held
+        by the workers at any time, so the memory used by the results is bounded by the chunk size rather than the
+        size of the data.
+
+        The input isn't reduced though: the datastore's dataframe is already held in memory (as DataSet.data),
+        whether or not it's read from SQLite. To bound the input as well, pass chunks instead, which are read one at
+        a time as the workers need them.
+        :param chunk_size: the number of rows queried by a worker at a time, ignored if chunks are given
+        :param max_pending: the maximum number of chunks in flight, defaults to twice the number of processes
+        :param chunks: an optional iterable of dataframes to query instead of the datastore, e.g.
+        pd.read_csv(path, chunksize=50000). Their indexes become the caseids, so should be unique across chunks.
+        They're always queried on worker processes (the pool, if there is one), as their size isn't known up front.
+        """
+        if not hasattr(queries, "__getitem__"):
+            queries = [queries]
+
+        nt = self._network
+        logger = self._logger
+
+        if chunks is None:
+            conn = self._datastore.get_connection()
+            data = self._datastore.data
+
+            def read_chunks():
+                for start in range(0, len(data), chunk_size):
+                    df = data.iloc[start:start + chunk_size]
+                    yield df, None if conn is None else self._datastore.create_select_statement(df.index)
+
+            description = "{} rows in chunks of {}".format(len(data), chunk_size)
+        else:
+            conn = None
+
+            def read_chunks():
+                for df in chunks:
+                    yield df, None
+
+            description = "chunks of data"
+
+        self._chunk_timings = []
+        if chunks is None and self._pool is None and self._plan(queries, variable_references).workers == 1:
+            for i, (df, select_statement) in enumerate(read_chunks()):
+                yield self._record_timing(_timed_batch_query(i, df, conn, nt, select_statement, variable_references,
+                                                             queries, logger)).set_index('caseid')
+            return
+
+        pool = self._pool if self._pool is not None else QueryWorkerPool(logger)
+        pool_started = time.time()
+        if max_pending is None:
+            max_pending = 2 * pool.processes
+
+        self._logger.info("Querying {}, with at most {} chunks in flight".format(description, max_pending))
+
+        pending = []
+        try:
+            for i, (df, select_statement) in enumerate(read_chunks()):
+                while len(pending) >= max_pending:
+                    yield self._wait_for_chunk(pending)
+
+                pending.append(pool.submit(_timed_batch_query, i, df, conn, nt, select_statement,
+                                           variable_references, queries, logger))
+
+            while len(pending) > 0:
+                yield self._wait_for_chunk(pending)
+        finally:
+            if pool is not self._pool:
+                pool.close()
+                _record_worker_startup(pool_started, self._chunk_timings)
+
+    def _wait_for_chunk(self, pending) -> pd.DataFrame:
+        # take whichever chunk finishes first, rather than waiting on them in order.
+        while True:
+            for i, result in enumerate(pending):
+                if result.ready():
+                    return self._record_timing(pending.pop(i).get()).set_index('caseid')
+
+            pending[0].wait(0.05)
+
+class ThreadedBatchQuery:
+    """
+    As BatchQuery, but queries on a pool of threads in this process rather than worker processes. The threads share
+    one JVM and the network, with an inference engine (and a copy of the queries) per chunk, so memory doesn't grow
+    with a JVM and network per core. Bayes Server inference runs in the JVM without holding the GIL.
+
+    The network mustn't be changed while a query is running.
+    """
+
+    def __init__(self, network, datastore, logger: logging.Logger, max_workers: int = None):
+        self._logger = logger
+        self._datastore = datastore
+        self._network = network
+        self._max_workers = mp.cpu_count() if max_workers is None else max_workers
+
+    def _query_chunk(self, df, connection_string, select_statement, variable_references, queries):
+        bayespy.jni.attach_thread(self._logger)
+        try:
+            return _query_rows(df, connection_string, self._network, select_statement, variable_references,
+                               queries, self._logger, 0)
+        finally:
+            bayespy.jni.detach()
+
+    def query(self, queries: List[QueryBase] = [QueryStatistics()], append_to_df=True,
+              variable_references: List[str] = []):
+        if not hasattr(queries, "__getitem__"):
+            queries = [queries]
+
+        conn = self._datastore.get_connection()
+        workers = max(min(self._max_workers, len(self._datastore.data)), 1)
+        self._logger.info("Using {} threads to query {} rows".format(workers, len(self._datastore.data)))
+
+        chunks = [(df, None if conn is None else self._datastore.create_select_statement(df.index))
+                  for df in np.array_split(self._datastore.data, workers)]
+
+        # queries hold the distributions they set up on an engine, so each chunk needs its own copy.
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(self._query_chunk, df, conn, select_statement, variable_references,
+                                       copy.deepcopy(queries))
+                       for df, select_statement in chunks]
+
+            df = pd.concat([future.result() for future in futures]).set_index('caseid')
+
+        if append_to_df:
+            return self._datastore.data.join(df)
+        else:
+            return df
+
+def _structure_fingerprint(network) -> str:
+    # the nodes, variables, states and links, but not the distributions, which change as the network is trained.
+    parts = []
+    for node in network.getNodes():
+        parts.append(str(node.getName()))
+        for variable in node.getVariables():
+            parts.append("{}:{}".format(variable.getName(),
+                                        ",".join(str(state.getName()) for state in variable.getStates())))
+
+    for link in network.getLinks():
+        parts.append("{}->{}".format(link.getFrom().getName(), link.getTo().getName()))
+
+    return hashlib.sha1("\n".join(parts).encode('utf-8')).hexdigest()
+
+
+def _data_fingerprint(df: pd.DataFrame) -> str:
+    digest = hashlib.sha1(",".join(str(c) for c in df.columns).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    return digest.hexdigest()
+
+
+class TrainingCheckpoint:
+    """
+    Periodically saves the network being trained to disk, so that a long training run which is killed can be
+    resumed (see NetworkModel.train). Files are written to a temporary file and then renamed over the last
+    checkpoint, so a crash mid-write leaves the previous checkpoint intact. Iteration metadata is written alongside,
+    to path + '.json', including fingerprints of the network structure and data, so that a checkpoint is only
+    resumed by the same run.
+    :param path: the .bayes file to write
+    :param interval_seconds: the least time between checkpoints
+    :param interval_iterations: checkpoint every this many iterations instead, if set
+    :param resume_on_mismatch: resume from an existing checkpoint even if it was saved by a run with a different
+    network structure, data, seed or priors (with a warning), rather than raising ValueError
+    """
+
+    def __init__(self, path: str, logger: logging.Logger, interval_seconds: float = 600.0,
+                 interval_iterations: int = None, resume_on_mismatch: bool = False):
+        self._path = path
+        self._metadata_path = path + '.json'
+        self._logger = logger
+        self._interval_seconds = interval_seconds
+        self._interval_iterations = interval_iterations
+        self._resume_on_mismatch = resume_on_mismatch
+        self._last_saved = None
+
+    def get_path(self) -> str:
+        return self._path
+
+    def exists(self) -> bool:
+        return os.path.exists(self._path)
+
+    def load(self):
+        """
+        :return: the network saved at the last checkpoint
+        """
+        if not self.exists():
+            raise ValueError("Checkpoint {} does not exist".format(self._path))
+
+        return bayespy.network.create_network_from_file(self._path)
+
+    def get_metadata(self) -> dict:
+        if not os.path.exists(self._metadata_path):
+            return {}
+
+        with open(self._metadata_path) as fh:
+            return json.load(fh)
+
+    def get_iteration(self) -> int:
+        """
+        :return: the iteration the checkpoint was saved at, counting any iterations before it was resumed
+        """
+        return int(self.get_metadata().get('iteration', 0))
+
+    def check_run(self, run: dict) -> None:
+        """
+        Check the checkpoint was saved by the same run, i.e. every item of run matches the saved metadata
+        """
+        saved = self.get_metadata()
+        mismatched = [key for key in sorted(run) if saved.get(key) != run[key]]
+        if len(mismatched) > 0:
+            message = "Checkpoint {} was saved by a different training run ({} differ)".format(
+                self._path, ", ".join(mismatched))
+            if not self._resume_on_mismatch:
+                raise ValueError(message + ", remove it or set resume_on_mismatch to resume from it anyway")
+
+            self._logger.warning(message)
+
+    def start(self):
+        self._last_saved = time.perf_counter()
+
+    def is_due(self, iteration: int) -> bool:
+        if self._interval_iterations is not None:
+            return iteration % self._interval_iterations == 0
+
+        return time.perf_counter() - self._last_saved >= self._interval_seconds
+
+    @staticmethod
+    def _write(path: str, content: str):
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as fh:
+            fh.write(content)
+            fh.flush()
+            os.fsync(fh.fileno())
+
+        os.replace(temp_path, path)
+
+    def save(self, network, info, metadata: dict):
+        """
+        Save the distributions as they are at the current iteration
+        :param network: the network being trained, which Bayes Server only updates once learning has finished
+        :param info: the ParameterLearningProgressInfo of the iteration, with the distributions monitored
+        """
+        snapshot = network.copy()
+        for node in network.getNodes():
+            distribution = info.getMonitoredDistribution(node)
+            if distribution is not None:
+                bayespy.network.set_distribution_copy(snapshot.getNodes().get(node.getName()), distribution)
+
+        self._write(self._path, snapshot.saveToString())
+        metadata = dict(metadata, saved=time.time())
+        self._write(self._metadata_path, json.dumps(metadata, default=float))
+        self._last_saved = time.perf_counter()
+        self._logger.info("Saved training checkpoint at iteration {} to {}".format(metadata.get('iteration'),
+                                                                                self._path))
+
+    def remove(self):
+        for path in [self._path, self._metadata_path]:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class TrainingProgress:
+    """
+    Implements the Bayes Server ParameterLearningProgress and Stop interfaces, recording the log likelihood and
+    timing of each EM iteration (see TrainingResults.get_trace) and optionally stopping learning early.
+    :param callback: called after each iteration with a dictionary of 'iteration', 'loglikelihood',
+    'loglikelihood_delta', 'elapsed_seconds', 'iteration_seconds' and 'cases_per_second'. Return True to stop.
+    :param max_seconds: stop once learning has taken longer than this
+    :param min_loglikelihood_delta: stop once the log likelihood improves by less than this in an iteration
+    :param monitor_loglikelihood: calculate the log likelihood at each iteration, which costs a little extra time.
+    Needed for min_loglikelihood_delta.
+    :param checkpoint: an optional TrainingCheckpoint, to save the network periodically during training
+    """
+
+    def __init__(self, logger: logging.Logger, callback=None, max_seconds: float = None,
+                 min_loglikelihood_delta: float = None, monitor_loglikelihood: bool = True,
+                 checkpoint: TrainingCheckpoint = None):
+        if min_loglikelihood_delta is not None and not monitor_loglikelihood:
+            raise ValueError("min_loglikelihood_delta needs monitor_loglikelihood")
+
+        self._logger = logger
+        self._callback = callback
+        self._max_seconds = max_seconds
+        self._min_loglikelihood_delta = min_loglikelihood_delta
+        self.monitor_loglikelihood = monitor_loglikelihood
+        self._checkpoint = checkpoint
+        self._network = None
+        self._metadata = {}
+        self._trace = []
+        self._stop = False
+        self._stop_reason = None
+        self._case_count = None
+        self._started = None
+        self._last = None
+        self._java_progress = None
+        self._java_stop = None
+        self._iteration_offset = 0
+
+    def copy(self) -> 'TrainingProgress':
+        """
+        A new instance with the same settings, e.g. for each of several restarts.
+        """
+        return TrainingProgress(self._logger, callback=self._callback, max_seconds=self._max_seconds,
+                                min_loglikelihood_delta=self._min_loglikelihood_delta,
+                                monitor_loglikelihood=self.monitor_loglikelihood, checkpoint=self._checkpoint)
+
+    def get_checkpoint(self) -> TrainingCheckpoint:
+        return self._checkpoint
+
+    def start(self, case_count: int, network=None, metadata: dict = None, iteration_offset: int = 0):
+        """
+        :param network: the network being trained, needed for checkpoints
+        :param metadata: saved with each checkpoint
+        :param iteration_offset: the iterations already run, when resuming from a checkpoint
+        """
+        if self._checkpoint is not None:
+            if network is None:
+                raise ValueError("The network is needed to save checkpoints")
+
+            self._checkpoint.start()
+
+        self._network = network
+        self._metadata = metadata or {}
+        self._trace = []
+        self._stop = False
+        self._stop_reason = None
+        self._case_count = case_count
+        self._iteration_offset = iteration_offset
+        self._started = self._last = time.perf_counter()
+
+    # the proxies are held by this instance, as Java doesn't keep their Python side alive. The instance is referenced
+    # until learning returns, so the proxies are too.
+    def as_java_progress(self):
+        if self._java_progress is None:
+            self._java_progress = jp.JProxy("com.bayesserver.learning.parameters.ParameterLearningProgress",
+                                            inst=self)
+
+        return self._java_progress
+
+    def as_java_stop(self):
+        if self._java_stop is None:
+            self._java_stop = jp.JProxy("com.bayesserver.Stop", inst=self)
+
+        return self._java_stop
+
+    def get_trace(self) -> List[dict]:
+        return list(self._trace)
+
+    def get_stop_reason(self) -> str:
+        return self._stop_reason
+
+    def _request_stop(self, reason: str):
+        if not self._stop:
+            self._logger.info("Stopping training early at iteration {}: {}".format(len(self._trace), reason))
+            self._stop = True
+            self._stop_reason = reason
+
+    def update(self, info):
+        now = time.perf_counter()
+        loglikelihood = info.getLogLikelihood()
+        loglikelihood = loglikelihood.floatValue() if loglikelihood is not None else np.nan
+        previous = self._trace[-1]['loglikelihood'] if len(self._trace) > 0 else np.nan
+        iteration_seconds = now - self._last
+        self._last = now
+
+        entry = {'iteration': info.getIterationCount() + self._iteration_offset, 'loglikelihood': loglikelihood,
+                 'loglikelihood_delta': loglikelihood - previous, 'elapsed_seconds': now - self._started,
+                 'iteration_seconds': iteration_seconds,
+                 'cases_per_second': self._case_count / iteration_seconds if iteration_seconds > 0 else np.nan}
+        self._trace.append(entry)
+        self._logger.debug("Training iteration {}".format(entry))
+
+        # exceptions can't be raised back through Bayes Server, so a failing callback stops learning instead.
+        try:
+            if self._callback is not None and self._callback(dict(entry)):
+                self._request_stop("stopped by callback")
+        except Exception as e:
+            self._logger.exception(e)
+            self._request_stop("callback raised {}".format(e))
+
+        if self._max_seconds is not None and entry['elapsed_seconds'] > self._max_seconds:
+            self._request_stop("exceeded {} seconds".format(self._max_seconds))
+
+        if self._min_loglikelihood_delta is not None and abs(entry['loglikelihood_delta']) < \
+                self._min_loglikelihood_delta:
+            self._request_stop("log likelihood changed by less than {}".format(self._min_loglikelihood_delta))
+
+        if self._checkpoint is not None and not self._stop and self._checkpoint.is_due(entry['iteration']):
+            try:
+                self._checkpoint.save(self._network, info, dict(self._metadata, **entry))
+            except Exception as e:
+                # carry on training, the previous checkpoint is still there.
+                self._logger.warning("Failed to save training checkpoint: {}".format(e))
+
+    def getDistributionMonitoring(self):
+        # the distributions at each iteration are only available to checkpoint if they're monitored.
+        if self._checkpoint is not None:
+            return bayesServerParams().DistributionMonitoring.ALL
+
+        return bayesServerParams().DistributionMonitoring.NONE
+
+    def getStop(self):
+        return self._stop
+
+    def setStop(self, value):
+        self._stop = bool(value)
+
+
 class TrainingResults:
     def __init__(self, network, results: dict, logger: logging.Logger):
         self._network = network
@@ -578,6 +2082,15 @@ class TrainingResults:
     def get_metrics(self) -> dict:
         return self._metrics
 
+    def get_iteration_count(self) -> int:
+        return self._metrics.get('iteration_count')
+
+    def get_trace(self) -> pd.DataFrame:
+        """
+        The log likelihood and timing of each iteration, when trained with a TrainingProgress
+        """
+        return pd.DataFrame(self._metrics.get('trace', []))
+
     def get_network(self):
         return self._network
 
@@ -611,6 +2124,8 @@ class NetworkModel:
         self._jnetwork = network
         self._inference_factory = InferenceEngine(network)
         self._logger = logger
+        # the expected sufficient statistics of the data the model was last trained or updated with, see update.
+        self._statistics = None
 
     def get_network(self):
         return self._jnetwork
@@ -625,37 +2140,283 @@ class NetworkModel:
     def is_trained(self):
         return bayespy.network.is_trained(self._jnetwork)
 
-    def train(self, dataset: bayespy.data.DataSet) -> TrainingResults:
+    @staticmethod
+    def _learn(network, dataset: bayespy.data.DataSet, seed: int = None, maximum_concurrency: int = None,
+               init_from=None, progress: TrainingProgress = None, priors: bool = True, max_iterations: int = None,
+               tolerance: float = None, data_reader_command=None, run: dict = None,
+               iteration_offset: int = 0) -> dict:
         """
-        Train a model on data provided in the constructor
+        :param data_reader_command: the dataset's data reader command, if it has already been created, e.g. to share
+        one between restarts
+        :param run: identifies the run in checkpoint metadata
+        :param iteration_offset: the iterations already run, when resuming from a checkpoint
         """
-        learning = bayesServerParams().ParameterLearning(self._jnetwork,
-                                                         self._inference_factory.get_inference_factory())
+        learning = bayesServerParams().ParameterLearning(network, InferenceEngine.get_inference_factory())
         learning_options = bayesServerParams().ParameterLearningOptions()
+        if seed is not None:
+            learning_options.setSeed(jp.java.lang.Integer(seed))
+
+        if not priors:
+            learning_options.getPriors().zeroAll()
+
+        if max_iterations is not None:
+            learning_options.setMaximumIterations(max_iterations)
+
+        if iteration_offset > 0:
+            # the iterations run before the checkpoint count towards the maximum.
+            learning_options.setMaximumIterations(max(learning_options.getMaximumIterations() - iteration_offset, 1))
+
+        if tolerance is not None:
+            learning_options.setTolerance(jp.java.lang.Double(tolerance))
+
+        if init_from is not None:
+            # start EM from the other network's parameters, rather than initialising them from the data.
+            bayespy.network.copy_distributions(init_from, network)
+            learning_options.getInitialization().setInitializeDistributions(False)
 
-        data_reader_command = dataset.create_data_reader_command()
+        if progress is not None:
+            progress.start(len(dataset.get_dataframe()), network=network,
+                           metadata=dict(run or {}, seed=seed, warm_start=init_from is not None),
+                           iteration_offset=iteration_offset)
+            learning_options.setProgress(progress.as_java_progress())
+            learning_options.setStopping(progress.as_java_stop())
+            learning_options.setMonitorLogLikelihood(progress.monitor_loglikelihood)
+
+        if maximum_concurrency is not None:
+            learning_options.setMaximumConcurrency(jp.java.lang.Integer(maximum_concurrency))
+
+        if data_reader_command is None:
+            data_reader_command = dataset.create_data_reader_command()
 
         reader_options = bayesServer().data.ReaderOptions()
 
-        variable_references = list(bayespy.network.create_variable_references(self._jnetwork, dataset.get_dataframe()))
+        variable_references = list(bayespy.network.create_variable_references(network, dataset.get_dataframe()))
 
         evidence_reader_command = bayesServer().data.DefaultEvidenceReaderCommand(data_reader_command,
                                                                                   jp.java.util.Arrays.asList(
                                                                                       variable_references),
                                                                                   reader_options)
 
-        self._logger.info("Training model...")
         result = learning.learn(evidence_reader_command, learning_options)
+
+        metrics = {'converged': result.getConverged(),
+                   'loglikelihood': result.getLogLikelihood().floatValue(),
+                   'iteration_count': result.getIterationCount() + iteration_offset,
+                   'case_count': result.getCaseCount(),
+                   'weighted_case_count': result.getWeightedCaseCount(),
+                   'unweighted_case_count': result.getUnweightedCaseCount(),
+                   'bic': result.getBIC().floatValue(),
+                   'seed': seed, 'warm_start': init_from is not None}
+        if iteration_offset > 0:
+            metrics['resumed_from_iteration'] = iteration_offset
+
+        if progress is not None:
+            metrics['trace'] = progress.get_trace()
+            metrics['stop_reason'] = progress.get_stop_reason()
+
+        return metrics
+
+    def _learn_restart(self, network, dataset: bayespy.data.DataSet, restart: int, seed: int,
+                       maximum_concurrency: int, progress: TrainingProgress = None, **learning) -> dict:
+        bayespy.jni.attach_thread(self._logger)
+        try:
+            metrics = self._learn(network, dataset, seed=seed, maximum_concurrency=maximum_concurrency,
+                                  progress=progress, **learning)
+        except Exception as e:
+            self._logger.warning("Training restart {} failed: {}".format(restart, e))
+            metrics = {'error': str(e), 'seed': seed}
+        finally:
+            bayespy.jni.detach()
+
+        metrics['restart'] = restart
+        return metrics
+
+    def train(self, dataset: bayespy.data.DataSet, restarts: int = 1, n_jobs: int = 1,
+              select_by: str = 'loglikelihood', seed: int = None, keep_statistics: bool = False,
+              latent_variable_name: str = 'Cluster', init_from=None,
+              progress: TrainingProgress = None, priors: bool = True, max_iterations: int = None,
+              tolerance: float = None) -> TrainingResults:
+        """
+        Train a model on data provided in the constructor
+        :param restarts: the number of times to run EM from different (random) starting points, e.g. for mixture
+        models which can get stuck in poor local optima. The best is kept, and the metrics of every restart are in
+        the 'restarts' entry of the TrainingResults.
+        :param n_jobs: the number of restarts trained at once, each on its own thread and copy of the network
+        :param select_by: 'loglikelihood' or 'bic', larger is better for both (Bayes Server's BIC is the penalised
+        log likelihood)
+        :param seed: the seed of the first restart, the rest use seed + 1, seed + 2... Random if not set.
+        :param keep_statistics: keep the sufficient statistics of the data, so the model can be updated with new data
+        later without retraining (see update). Only for mixture models, i.e. a latent variable which is the only
+        parent of every other node. This costs an extra pass over the data, holding an N x K array of the latent
+        posterior, so is off by default.
+        :param latent_variable_name: the latent variable of the mixture model, when keeping statistics
+        :param init_from: a trained network (or NetworkModel) with the same structure, e.g. from a previous fold or
+        the previous day's data, whose parameters EM starts from. It usually converges in far fewer iterations than
+        from scratch, see the 'iteration_count' metric.
+        :param progress: an optional TrainingProgress, to follow the iterations as they run or stop early. Each
+        restart gets its own copy. If it has a TrainingCheckpoint which exists, e.g. from a run which crashed,
+        training resumes from it (as init_from), counting the iterations already run towards max_iterations, and the
+        checkpoint is removed once training finishes. A checkpoint saved by a run with a different network
+        structure, data, seed or priors raises ValueError (see TrainingCheckpoint's resume_on_mismatch).
+        :param priors: use Bayes Server's default priors, which add virtual cases to avoid boundary conditions.
+        Without them learning is maximum likelihood, as with bayespy.distributed.DistributedTrainer.
+        :param max_iterations: the most iterations of EM, Bayes Server's default if not set
+        :param tolerance: the relative change in the parameters below which EM has converged, Bayes Server's default
+        if not set
+        """
+        if select_by not in ('loglikelihood', 'bic'):
+            raise ValueError("select_by should be 'loglikelihood' or 'bic', not {}".format(select_by))
+
+        if isinstance(init_from, NetworkModel):
+            init_from = init_from.get_network()
+
+        checkpoint = progress.get_checkpoint() if progress is not None else None
+        run = None
+        iteration_offset = 0
+        if checkpoint is not None:
+            if restarts > 1:
+                raise ValueError("Checkpoints can't be used with restarts, which would overwrite each other")
+
+            run = {'network': _structure_fingerprint(self._jnetwork),
+                   'data': _data_fingerprint(dataset.get_dataframe()), 'seed': seed, 'priors': priors}
+            if init_from is None and checkpoint.exists():
+                checkpoint.check_run(run)
+                iteration_offset = checkpoint.get_iteration()
+                self._logger.info("Resuming training from checkpoint {} ({})".format(checkpoint.get_path(),
+                                                                                   checkpoint.get_metadata()))
+                init_from = checkpoint.load()
+
+        if init_from is not None:
+            if restarts > 1:
+                raise ValueError("Restarts would all start from the same parameters when warm starting")
+
+            if not bayespy.network.is_trained(init_from):
+                raise ValueError("The network to initialise from needs to be trained")
+
+        learning = {'priors': priors, 'max_iterations': max_iterations, 'tolerance': tolerance}
+        self._logger.info("Training model...")
+        if restarts <= 1:
+            metrics = self._learn(self._jnetwork, dataset, seed=seed, init_from=init_from, progress=progress,
+                                  run=run, iteration_offset=iteration_offset, **learning)
+        else:
+            if seed is None:
+                seed = int(np.random.randint(0, 2 ** 30))
+
+            n_jobs = max(min(n_jobs, restarts), 1)
+            # share the cores between the restarts running at once, as Bayes Server learning is itself parallel.
+            maximum_concurrency = max(mp.cpu_count() // n_jobs, 1) if n_jobs > 1 else None
+            networks = [self._jnetwork.copy() for i in range(restarts)]
+            # created once, as for a subset of a dataset in storage this (re)writes an index table, which would race
+            # with the other restarts reading it.
+            learning['data_reader_command'] = dataset.create_data_reader_command()
+
+            self._logger.info("Running {} restarts, {} at a time".format(restarts, n_jobs))
+            with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+                runs = list(executor.map(lambda i: self._learn_restart(
+                    networks[i], dataset, i, seed + i, maximum_concurrency,
+                    progress=progress.copy() if progress is not None else None, **learning), range(restarts)))
+
+            succeeded = [run for run in runs if 'error' not in run]
+            if len(succeeded) == 0:
+                raise ValueError("All {} training restarts failed: {}".format(restarts, runs[0]['error']))
+
+            best = max(succeeded, key=lambda run: run[select_by])
+            for run in runs:
+                run['selected'] = run is best
+                self._logger.info("Restart {}: {}".format(run['restart'], run))
+
+            bayespy.network.copy_distributions(networks[best['restart']], self._jnetwork)
+            metrics = dict(best)
+            metrics['restarts'] = runs
+
         self._logger.info("Finished training model")
+        QueryCache.invalidate_network(self._jnetwork)
+        if checkpoint is not None:
+            checkpoint.remove()
+
+        self._statistics = None
+        if keep_statistics:
+            self._statistics = self._compute_statistics(dataset.get_dataframe(), latent_variable_name)
 
-        return TrainingResults(self._jnetwork, {'converged': result.getConverged(),
-                'loglikelihood': result.getLogLikelihood().floatValue(),
-                'iteration_count': result.getIterationCount(), 'case_count': result.getCaseCount(),
-                'weighted_case_count': result.getWeightedCaseCount(),
-                'unweighted_case_count': result.getUnweightedCaseCount(),
-                'bic': result.getBIC().floatValue()}, self._logger)
+        return TrainingResults(self._jnetwork, metrics, self._logger)
+
+    def _compute_statistics(self, df: pd.DataFrame, latent_variable_name: str, weight: float = 1.0):
+        import bayespy.vectorized
+        try:
+            mixture = bayespy.vectorized.MixtureModel.from_network(self._jnetwork,
+                                                                   latent_variable_name=latent_variable_name)
+        except ValueError as e:
+            self._logger.debug("Not keeping sufficient statistics, the network isn't a mixture model: {}".format(e))
+            return None
+
+        return mixture.statistics(df, weight=weight)
+
+    def update(self, dataset_delta: bayespy.data.DataSet, weight: float = 1.0, forgetting: float = 1.0,
+               latent_variable_name: str = 'Cluster') -> TrainingResults:
+        """
+        Update the parameters with new data, without revisiting the data the model was trained on. The sufficient
+        statistics kept from training (see train) are added to those of the new data, and the parameters re-estimated
+        from the total, i.e. one step of online EM. The cost is proportional to the new data.
+        :param weight: the weight of each new row relative to each existing one
+        :param forgetting: multiplies the existing statistics before the new data is added, e.g. 0.9 to weight recent
+        data more heavily when the data drifts. 1 keeps everything.
+        :param latent_variable_name: the latent variable of the mixture model
+        """
+        if self._statistics is None:
+            raise ValueError("The model has no sufficient statistics to update, train it with keep_statistics=True "
+                             "(only mixture models keep them)")
+
+        if not 0 < forgetting <= 1:
+            raise ValueError("forgetting should be in (0, 1], not {}".format(forgetting))
+
+        import bayespy.vectorized
+        df = dataset_delta.get_dataframe()
+        mixture = bayespy.vectorized.MixtureModel.from_network(self._jnetwork,
+                                                               latent_variable_name=latent_variable_name)
+        delta = mixture.statistics(df, weight=weight)
+        self._statistics = self._statistics.scale(forgetting).add(delta)
+        mixture.maximise(self._statistics).write_to_network(self._jnetwork)
+        QueryCache.invalidate_network(self._jnetwork)
+
+        self._logger.info("Updated model with {} rows".format(len(df)))
+        return TrainingResults(self._jnetwork, {'case_count': len(df), 'weighted_case_count': len(df) * weight,
+                                                'effective_case_count': self._statistics.case_count},
+                               self._logger)
 
     def batch_query(self, dataset: bayespy.data.DataSet, queries: List[QueryBase], append_to_df=True,
-                    variable_references: List[str] = []):
-        bq = BatchQuery(self._jnetwork, dataset, self._logger)
+                    variable_references: List[str] = [], pool: QueryWorkerPool = None, threaded=False,
+                    max_workers: int = None):
+        """
+        Query every row in the dataset
+        :param pool: an optional QueryWorkerPool, to reuse warm worker processes across calls
+        :param threaded: query on threads sharing this process' JVM (see ThreadedBatchQuery), rather than processes
+        :param max_workers: the number of threads when threaded, defaults to the number of cores
+        """
+        if threaded:
+            bq = ThreadedBatchQuery(self._jnetwork, dataset, self._logger, max_workers=max_workers)
+            return bq.query(queries, append_to_df=append_to_df, variable_references=variable_references)
+
+        bq = BatchQuery(self._jnetwork, dataset, self._logger, pool=pool)
         return bq.query(queries, append_to_df=append_to_df, variable_references=variable_references)
+
+    def batch_query_iter(self, dataset, queries: List[QueryBase], chunk_size: int = 50000,
+                         variable_references: List[str] = [], pool: QueryWorkerPool = None,
+                         max_pending: int = None):
+        """
+        Query every row in the dataset, yielding the results a chunk at a time rather than as one dataframe. Each
+        chunk is indexed by caseid, so can be joined back on to the data later, e.g. after writing it to disk.
+        :param dataset: a DataSet, which holds all of its data in memory, or an iterable of dataframes (e.g.
+        pd.read_csv(path, chunksize=50000)), which are read a chunk at a time so the input is bounded too (see
+        BatchQuery.query_iter)
+        :param chunk_size: the number of rows in each chunk, if dataset is a DataSet
+        :param pool: an optional QueryWorkerPool, otherwise one is started (and stopped) for this call
+        :param max_pending: the maximum number of chunks queued or being queried at once
+        """
+        if isinstance(dataset, bayespy.data.DataSet):
+            bq = BatchQuery(self._jnetwork, dataset, self._logger, pool=pool)
+            return bq.query_iter(queries, chunk_size=chunk_size, variable_references=variable_references,
+                                 max_pending=max_pending)
+
+        bq = BatchQuery(self._jnetwork, None, self._logger, pool=pool)
+        return bq.query_iter(queries, variable_references=variable_references, max_pending=max_pending,
+                             chunks=dataset)
@@ -3,6 +3,9 @@ import uuid
 from bayespy.jni import *
 from bayespy.data import DataFrame
 import os
+from collections import OrderedDict
+import threading
+import weakref
 
 
 def create_network():
@@ -126,6 +129,7 @@ class Builder:
             v.getStates().add(bayesServer().State("{}".format(Builder._create_interval_name(interval, decimal_places)), interval))
 
         network.getNodes().add(n)
+        invalidate_index(network)
         return n
 
     @staticmethod
@@ -138,6 +142,7 @@ class Builder:
         n_ = bayesServer().Node(v)
 
         network.getNodes().add(n_)
+        invalidate_index(network)
         
         return n_
 
@@ -149,12 +154,14 @@ class Builder:
             v.getStates().add(bayesServer().State("Cluster{}".format(i)))
 
         network.getNodes().add(parent)
+        invalidate_index(network)
         return parent
 
     @staticmethod
     def create_multivariate_continuous_node(network, variables, node_name):
         n_ = bayesServer().Node(node_name, [bayesServer().Variable(v, bayesServer().VariableValueType.CONTINUOUS) for v in variables])
         network.getNodes().add(n_)
+        invalidate_index(network)
         return n_
 
     @staticmethod
@@ -182,6 +189,7 @@ class Builder:
                     state.setValue(state.getName() == 'True')
 
         network.getNodes().add(n_)
+        invalidate_index(network)
 
         return n_
 
@@ -242,6 +250,7 @@ class NetworkBuilder:
             n_.setTemporalType(bayesServer().TemporalType.TEMPORAL)
 
         self._jnetwork.getNodes().add(n_)
+        invalidate_index(self._jnetwork)
 
         return n_
 
@@ -255,6 +264,7 @@ class NetworkBuilder:
             n_.setTemporalType(bayesServer().TemporalType.TEMPORAL)
 
         self._jnetwork.getNodes().add(n_)
+        invalidate_index(self._jnetwork)
 
         return n_
 
@@ -262,6 +272,7 @@ class NetworkBuilder:
         v = bayesServer().Variable(node_name, bayesServer().VariableValueType.CONTINUOUS)
         n_ = bayesServer().Node(v)
         self._jnetwork.getNodes().add(n_)
+        invalidate_index(self._jnetwork)
 
         return n_
 
@@ -284,6 +295,7 @@ class NetworkBuilder:
                     state.setValue(state.getName() == 'True')
 
         self._jnetwork.getNodes().add(n_)
+        invalidate_index(self._jnetwork)
 
         return n_
 
@@ -298,6 +310,7 @@ class NetworkBuilder:
                 v.getStates().add(bayesServer().State("Cluster{}".format(i)))
 
             self._jnetwork.getNodes().add(parent)
+            invalidate_index(self._jnetwork)
         else:
             parent = self._jnetwork.getNodes().get(parent_node)
 
@@ -324,12 +337,14 @@ class NetworkBuilder:
                     v.getStates().add(state)
 
                 self._jnetwork.getNodes().add(n_)
+                invalidate_index(self._jnetwork)
 
         if not continuous.empty:
             for n in continuous.columns:
                 v = bayesServer().Variable(n, bayesServer().VariableValueType.CONTINUOUS)
                 n_ = bayesServer().Node(v)
                 self._jnetwork.getNodes().add(n_)
+                invalidate_index(self._jnetwork)
 
     def remove_continuous_nodes(self):
         to_remove = []
@@ -340,6 +355,7 @@ class NetworkBuilder:
         for v in to_remove:
             node = v.getNode()
             self._jnetwork.getNodes().remove(node)
+            invalidate_index(self._jnetwork)
 
     def _create_links(self, parent):
         for node in self._jnetwork.getNodes():
@@ -396,24 +412,108 @@ def remove_node(network, node):
     if node is None:
         raise ValueError("Node must be specified when trying to remove it.")
     network.getNodes().remove(node)
+    invalidate_index(network)
 
 def get_number_of_states(network, variable):
     v = network.getVariables().get(variable)
     return len(v.getStates())
 
+class NetworkIndex:
+    """
+    A lookup of a network's variables, their value types and states by name, built once so that code on the per-row
+    path doesn't need to go through the JVM for each lookup. Use get_index to get the (cached) index for a network.
+    """
+
+    def __init__(self, network):
+        # weakly, as the index is cached against the network.
+        self._network = weakref.ref(network)
+        self._variables = {}
+        self._states = {}
+        self._discrete = {}
+        self._continuous = {}
+
+        discrete = bayesServer().VariableValueType.DISCRETE
+        continuous = bayesServer().VariableValueType.CONTINUOUS
+        for v in network.getVariables():
+            name = v.getName()
+            value_type = v.getValueType()
+            self._variables[name] = v
+            self._discrete[name] = value_type == discrete
+            self._continuous[name] = value_type == continuous
+            self._states[name] = OrderedDict((st.getName(), st) for st in v.getStates())
+
+        self.node_count = network.getNodes().size()
+
+    def get_network(self):
+        """
+        :return: the network, or None if it no longer exists
+        """
+        return self._network()
+
+    def get_variable(self, variable_name):
+        variable = self._variables.get(variable_name)
+        if variable is None:
+            raise ValueError("Variable {} does not exist".format(variable_name))
+
+        return variable
+
+    def variable_exists(self, variable_name):
+        return variable_name in self._variables
+
+    def get_variable_names(self):
+        return list(self._variables.keys())
+
+    def is_discrete(self, variable_name):
+        self.get_variable(variable_name)
+        return self._discrete[variable_name]
+
+    def is_continuous(self, variable_name):
+        self.get_variable(variable_name)
+        return self._continuous[variable_name]
+
+    def get_states(self, variable_name):
+        self.get_variable(variable_name)
+        return list(self._states[variable_name].values())
+
+    def get_state_names(self, variable_name):
+        self.get_variable(variable_name)
+        return list(self._states[variable_name].keys())
+
+    def get_state(self, variable_name, state_name):
+        """
+        :return: the state, or None if it doesn't exist
+        """
+        self.get_variable(variable_name)
+        return self._states[variable_name].get(str(state_name))
+
+# indexes by network, validated against the node count and explicitly invalidated by the functions in here that
+# add or remove nodes. Networks changed directly through the Java API should call invalidate_index. Networks are held
+# weakly, so an index goes when its network does.
+_indexes = weakref.WeakKeyDictionary()
+_indexes_lock = threading.Lock()
+
+def get_index(network) -> NetworkIndex:
+    with _indexes_lock:
+        index = _indexes.get(network)
+        if index is None or index.node_count != network.getNodes().size():
+            index = NetworkIndex(network)
+            _indexes[network] = index
+
+        return index
+
+def invalidate_index(network):
+    with _indexes_lock:
+        _indexes.pop(network, None)
+
 def get_state(network, variable_name, state_name):
-    variable = get_variable(network, variable_name)
-    for jstate in variable.getStates():
-        if jstate.getName() == str(state_name):
-            return jstate
+    return get_index(network).get_state(variable_name, state_name)
 
 def get_other_states_from_variable(network, target):
-    target_ = network.getVariables().get(target.variable)
-    for st in target_.getStates():
-        if st.getName() == str(target.state):
+    for state_name in get_index(network).get_state_names(target.variable):
+        if state_name == str(target.state):
             continue
 
-        yield state(target.variable, st.getName())
+        yield state(target.variable, state_name)
 
 def create_variable_references(network, data, variable_references=[]):
     """
@@ -422,28 +522,25 @@ def create_variable_references(network, data, variable_references=[]):
     :return: a list of 'VariableReference' objects
     """
 
-    variables = []
+    index = get_index(network)
 
     if len(variable_references) == 0:
-        variables = network.getVariables()
+        variable_names = index.get_variable_names()
     else:
-        for v in variable_references:
-            variables.append(bayespy.network.get_variable(network, v))
+        variable_names = variable_references
 
     latent_variable_name = "Cluster"
-    for v in variables:
-        if v.getName().startswith(latent_variable_name):
+    for name in variable_names:
+        v = index.get_variable(name)
+        if name.startswith(latent_variable_name):
             continue
 
-        if v.getName() not in data.columns:
+        if name not in data.columns:
             continue
 
-        name = v.getName()
-
         valueType = bayesServer().data.ColumnValueType.VALUE
 
-        if v.getStateValueType() != bayesServer().StateValueType.DOUBLE_INTERVAL \
-                and bayespy.network.is_variable_discrete(v):
+        if index.is_discrete(name) and v.getStateValueType() != bayesServer().StateValueType.DOUBLE_INTERVAL:
 
             if not DataFrame.is_int(data[name].dtype) and not DataFrame.is_bool(data[name].dtype):
                 valueType = bayesServer().data.ColumnValueType.NAME
@@ -470,6 +567,33 @@ def is_trained(network):
             
     return True
 
+def copy_distributions(source, target):
+    """
+    Copy the distributions of every node in source to the node with the same name in target, e.g. from a copy of a
+    network which has been trained separately. The networks need the same structure.
+    """
+    for node in target.getNodes():
+        source_node = source.getNodes().get(node.getName())
+        if source_node is None:
+            raise ValueError("Node {} does not exist in the source network".format(node.getName()))
+
+        distribution = source_node.getDistribution()
+        if distribution is not None:
+            set_distribution_copy(node, distribution)
+
+
+def set_distribution_copy(node, distribution):
+    """
+    Set a copy of a distribution, which can be from another network, on the node.
+    """
+    copy = node.newDistribution()
+    if isinstance(distribution, bayesServer().CLGaussian):
+        copy.copyFrom(distribution)
+    else:
+        distribution.copyTo(copy)
+
+    node.setDistribution(copy)
+
 
 class NetworkFactory:
     def __init__(self, logger, network_file_path = None, network = None):
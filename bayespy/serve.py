@@ -0,0 +1,332 @@
+"""
+A small HTTP server for querying trained networks (.bayes files), e.g. for local testing of a scoring service.
+
+    python -m bayespy.serve --model titanic=titanic.bayes --port 8080
+
+Endpoints:
+    GET  /health
+    GET  /models                  the names of the loaded models
+    GET  /models/<name>           the variables of a model, and their states
+    POST /models/<name>/query     {"evidence": {...} or [{...}, ...], "queries": [{"type": "QueryMostLikelyState",
+                                  "target_variable_name": "Survived"}, ...]}
+    GET  /metrics                 request counts and latency histograms per model, and engine pool counts
+"""
+
+import argparse
+import bisect
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import numpy as np
+
+import bayespy.jni
+import bayespy.model
+import bayespy.network
+
+# the query types which can be requested, by name. Any other keys in a query's JSON are passed to the constructor.
+QUERY_TYPES = {
+    'QueryStatistics': bayespy.model.QueryStatistics,
+    'QueryModelStatistics': bayespy.model.QueryModelStatistics,
+    'QueryMostLikelyState': bayespy.model.QueryMostLikelyState,
+    'QueryStateProbability': bayespy.model.QueryStateProbability,
+    'QueryMeanVariance': bayespy.model.QueryMeanVariance,
+    'QueryLogLikelihood': bayespy.model.QueryLogLikelihood,
+}
+
+
+def create_query(spec: dict) -> bayespy.model.QueryBase:
+    spec = dict(spec)
+    name = spec.pop('type', None)
+    if name not in QUERY_TYPES:
+        raise ValueError("Query type {} not recognised, use one of {}".format(name, list(QUERY_TYPES.keys())))
+
+    try:
+        return QUERY_TYPES[name](**spec)
+    except TypeError as e:
+        raise ValueError("Invalid arguments for {}: {}".format(name, e))
+
+
+class LatencyHistogram:
+    """
+    Counts of latencies in fixed buckets (upper bounds in milliseconds), with approximate percentiles taken from the
+    bucket bounds.
+    """
+
+    BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float('inf')]
+
+    def __init__(self):
+        self._counts = [0] * len(self.BUCKETS_MS)
+        self._count = 0
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        ms = seconds * 1000
+        with self._lock:
+            self._counts[bisect.bisect_left(self.BUCKETS_MS, ms)] += 1
+            self._count += 1
+            self._sum += ms
+
+    def _percentile(self, p):
+        target = p * self._count
+        total = 0
+        for bound, count in zip(self.BUCKETS_MS, self._counts):
+            total += count
+            if total >= target:
+                return bound
+
+        return self.BUCKETS_MS[-1]
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {'count': self._count,
+                    'mean_ms': self._sum / self._count if self._count > 0 else None,
+                    'p50_ms': self._percentile(0.5) if self._count > 0 else None,
+                    'p95_ms': self._percentile(0.95) if self._count > 0 else None,
+                    'p99_ms': self._percentile(0.99) if self._count > 0 else None,
+                    'buckets': [{'le_ms': 'inf' if np.isinf(bound) else bound, 'count': count}
+                                for bound, count in zip(self.BUCKETS_MS, self._counts)]}
+
+
+class ServedModel:
+    """
+    A network loaded from a .bayes file, with a pool of pre-built inference engines, so a request only sets up its
+    queries and evidence rather than building an engine.
+    :param engines: the number of engines, i.e. how many requests can be queried at once
+    :param timeout: seconds a request waits for an engine before failing
+    """
+
+    def __init__(self, name: str, path: str, logger: logging.Logger, engines: int = 4, timeout: float = 10.0):
+        self.name = name
+        self._logger = logger
+        self._network = bayespy.network.create_network_from_file(path)
+        self._timeout = timeout
+        self._engines = bayespy.model.EnginePool(self._network, max_size=engines)
+        # build the engines up front, rather than on the first requests.
+        for inference_engine in [self._engines.checkout() for i in range(engines)]:
+            self._engines.checkin(inference_engine)
+
+        self._histogram = LatencyHistogram()
+        self._errors = 0
+        self._lock = threading.Lock()
+        logger.info("Loaded model {} from {} with {} engines".format(name, path, engines))
+
+    def describe(self) -> dict:
+        index = bayespy.network.get_index(self._network)
+        return {'name': self.name,
+                'variables': [{'name': name, 'discrete': index.is_discrete(name),
+                               'states': index.get_state_names(name) if index.is_discrete(name) else []}
+                              for name in index.get_variable_names()]}
+
+    def query(self, evidence, query_specs):
+        """
+        :param evidence: a dictionary of evidence (see Evidence.apply) or a list of them
+        :param query_specs: a list of dictionaries, each with the query 'type' and its constructor's arguments
+        :return: a list of the results of each query, or a list of those if evidence was a list
+        """
+        start = time.perf_counter()
+        try:
+            queries = [create_query(spec) for spec in query_specs]
+            rows = evidence if isinstance(evidence, list) else [evidence]
+
+            # the pool clears the engine's evidence and query distributions when it's returned.
+            with self._engines.engine(timeout=self._timeout) as inference_engine:
+                prepared = bayespy.model.PreparedQuery(self._network, queries, self._logger,
+                                                       inference_engine=inference_engine)
+                results = [prepared.query(evidence=e, aslist=True) for e in rows]
+
+            return results if isinstance(evidence, list) else results[0]
+        except BaseException:
+            with self._lock:
+                self._errors += 1
+            raise
+        finally:
+            self._histogram.observe(time.perf_counter() - start)
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            errors = self._errors
+
+        return {'errors': errors, 'engines': self._engines.get_metrics(), 'latency': self._histogram.to_dict()}
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+
+    return str(value)
+
+
+def _validate_body(body) -> str:
+    """
+    :return: what's wrong with the body of a query request, or None if it's valid
+    """
+    if not isinstance(body, dict):
+        return "The body should be a JSON object, with 'evidence' and 'queries'"
+
+    evidence = body.get('evidence', {})
+    if not isinstance(evidence, dict) and not (isinstance(evidence, list) and
+                                                all(isinstance(e, dict) for e in evidence)):
+        return "'evidence' should be an object, or a list of objects"
+
+    queries = body.get('queries', [])
+    if not isinstance(queries, list) or not all(isinstance(query, dict) for query in queries):
+        return "'queries' should be a list of objects"
+
+    return None
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def _send(self, status: int, body):
+        content = json.dumps(body, default=_json_default).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _get_model(self, name):
+        model = self.server.models.get(name)
+        if model is None:
+            self._send(404, {'error': "Model {} not found".format(name)})
+
+        return model
+
+    def do_GET(self):
+        parts = [part for part in self.path.split('?')[0].split('/') if part != '']
+        if parts == ['health']:
+            self._send(200, {'status': 'ok'})
+        elif parts == ['models']:
+            self._send(200, {'models': sorted(self.server.models.keys())})
+        elif len(parts) == 2 and parts[0] == 'models':
+            model = self._get_model(parts[1])
+            if model is not None:
+                bayespy.jni.attach_thread(self.server.logger)
+                try:
+                    self._send(200, model.describe())
+                finally:
+                    bayespy.jni.detach()
+        elif parts == ['metrics']:
+            self._send(200, {name: model.get_metrics() for name, model in self.server.models.items()})
+        else:
+            self._send(404, {'error': "{} not found".format(self.path)})
+
+    def do_POST(self):
+        parts = [part for part in self.path.split('?')[0].split('/') if part != '']
+        if len(parts) != 3 or parts[0] != 'models' or parts[2] != 'query':
+            self._send(404, {'error': "{} not found".format(self.path)})
+            return
+
+        model = self._get_model(parts[1])
+        if model is None:
+            return
+
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8'))
+        except ValueError as e:
+            self._send(400, {'error': "Invalid JSON: {}".format(e)})
+            return
+
+        error = _validate_body(body)
+        if error is not None:
+            self._send(400, {'error': error})
+            return
+
+        # each request is handled on a new thread, which needs attaching to the JVM.
+        bayespy.jni.attach_thread(self.server.logger)
+        try:
+            results = model.query(body.get('evidence', {}), body.get('queries', []))
+            self._send(200, {'results': results})
+        except ValueError as e:
+            self._send(400, {'error': str(e)})
+        except TimeoutError as e:
+            self._send(503, {'error': str(e)})
+        except Exception as e:
+            self.server.logger.exception(e)
+            self._send(500, {'error': str(e)})
+        finally:
+            bayespy.jni.detach()
+
+    def log_message(self, format, *args):
+        self.server.logger.debug("%s - %s" % (self.address_string(), format % args))
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ModelServer:
+    """
+    Serve one or more models over HTTP (see the module docstring for the endpoints)
+    :param models: model names to paths of .bayes files
+    :param engines: the number of inference engines per model
+    """
+
+    def __init__(self, models: dict, logger: logging.Logger, host: str = '127.0.0.1', port: int = 8080,
+                 engines: int = 4):
+        self._logger = logger
+        bayespy.jni.attach(logger)
+        self._server = _ThreadingHTTPServer((host, port), _Handler)
+        self._server.logger = logger
+        self._server.models = {name: ServedModel(name, path, logger, engines=engines)
+                               for name, path in models.items()}
+        self._thread = None
+
+    def get_address(self):
+        return self._server.server_address
+
+    def serve_forever(self):
+        self._logger.info("Serving {} on http://{}:{}".format(sorted(self._server.models.keys()),
+                                                             *self.get_address()))
+        self._server.serve_forever()
+
+    def start(self):
+        """
+        Serve on a background thread
+        """
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def shutdown(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, type, value, traceback):
+        self.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve Bayes Server networks over HTTP")
+    parser.add_argument('--model', action='append', required=True, help="name=path/to/network.bayes, repeatable")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--engines', type=int, default=4, help="inference engines per model")
+    args = parser.parse_args()
+
+    logger = logging.getLogger()
+    logger.addHandler(logging.StreamHandler())
+    logger.setLevel(logging.INFO)
+
+    models = {}
+    for model in args.model:
+        name, _, path = model.partition('=')
+        if path == '':
+            raise ValueError("--model should be name=path, got {}".format(model))
+        models[name] = path
+
+    ModelServer(models, logger, host=args.host, port=args.port, engines=args.engines).serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -171,6 +171,7 @@ class WithDiscretisedVariables(Template):
             links_to = [link.getTo() for link in node.getLinks() if link.getTo().getName() != var]
 
             network.getNodes().remove(node)
+            bayespy.network.invalidate_index(network)
 
             n = builder.create_discretised_variable(network, network_factory.get_data(), var,
                                                     bin_count=self._bins[i], mode=self._mode)
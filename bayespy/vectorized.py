@@ -0,0 +1,625 @@
+import numpy as np
+import pandas as pd
+from typing import List
+
+import bayespy.data
+import bayespy.model
+import bayespy.network
+from bayespy.jni import jp
+
+# Vectorised inference for trained mixture models (a single discrete latent parent, e.g. the Cluster node created by
+# template.MixtureNaiveBayes, with independent children). The parameters are exported from the Java network once,
+# after which a whole dataframe of evidence can be scored in a handful of numpy operations rather than one JNI
+# round-trip per row.
+
+
+def _state_array(states):
+    state_array = jp.JArray(states[0].getClass())(len(states))
+    for i, state in enumerate(states):
+        state_array[i] = state
+
+    return state_array
+
+
+def _logsumexp(a: np.array, axis=1) -> np.array:
+    m = np.max(a, axis=axis, keepdims=True)
+    m[~np.isfinite(m)] = 0
+    with np.errstate(divide='ignore'):
+        return np.log(np.sum(np.exp(a - m), axis=axis)) + np.squeeze(m, axis=axis)
+
+
+def _log(a: np.array) -> np.array:
+    with np.errstate(divide='ignore'):
+        return np.log(a)
+
+
+# variances are floored at this when re-estimated, so a latent state with a single distinct value doesn't collapse.
+_MINIMUM_VARIANCE = 1e-9
+
+
+class DiscreteChild:
+    """
+    A discrete child of the latent variable, where table[k, s] = P(child = s | latent = k)
+    """
+
+    def __init__(self, name: str, states: List[str], table: np.array):
+        self.name = name
+        self.states = states
+        self.table = table
+        self._log_table = _log(table)
+        self._lookup = {state: i for i, state in enumerate(states)}
+
+    def codes(self, df: pd.DataFrame) -> np.array:
+        """
+        The state index of each row, or -1 if missing. Raises ValueError for a state the variable doesn't have, as
+        with Evidence.apply.
+        """
+        codes = np.full(len(df), -1, dtype=np.int64)
+        if self.name not in df.columns:
+            return codes
+
+        series = df[self.name]
+        observed = series.notnull().values
+        mapped = series[observed].astype(str).map(self._lookup)
+        unknown = mapped.isnull().values
+        if unknown.any():
+            raise ValueError("State {} does not exist in variable {}".format(
+                series[observed][unknown].iloc[0], self.name))
+
+        codes[observed] = mapped.values.astype(np.int64)
+        return codes
+
+    def log_likelihood(self, df: pd.DataFrame) -> np.array:
+        """
+        log P(evidence | latent = k) for each row and latent state, with missing values marginalised out (zero).
+        """
+        codes = self.codes(df)
+        ll = np.zeros((len(df), self.table.shape[0]))
+        observed = codes >= 0
+        ll[observed] = self._log_table[:, codes[observed]].T
+        return ll
+
+    def statistics(self, df: pd.DataFrame, posterior: np.array) -> dict:
+        """
+        The expected count of each (latent state, state) over the rows, given the posterior of the latent variable.
+        Rows where the variable is missing count towards each state in proportion to P(child = s | latent = k).
+        """
+        codes = self.codes(df)
+        observed = codes >= 0
+        indicators = np.zeros((int(observed.sum()), len(self.states)))
+        indicators[np.arange(len(indicators)), codes[observed]] = 1
+        missing = posterior[~observed].sum(axis=0)
+        return {'counts': posterior[observed].T.dot(indicators) + missing[:, np.newaxis] * self.table}
+
+    def maximise(self, statistics: dict) -> 'DiscreteChild':
+        counts = statistics['counts']
+        totals = counts.sum(axis=1, keepdims=True)
+        # latent states with no data keep their current distribution
+        table = np.where(totals > 0, counts / np.where(totals > 0, totals, 1), self.table)
+        return DiscreteChild(self.name, self.states, table)
+
+    def write(self, network, latent_states, index):
+        node = index.get_variable(self.name).getNode()
+        distribution = node.newDistribution()
+        states = index.get_states(self.name)
+        for k, latent_state in enumerate(latent_states):
+            for s, state in enumerate(states):
+                distribution.set(float(self.table[k, s]), [latent_state, state])
+
+        node.setDistribution(distribution)
+
+
+class GaussianChild:
+    """
+    A continuous child of the latent variable, with a univariate Gaussian for each latent state.
+    """
+
+    def __init__(self, name: str, mean: np.array, variance: np.array):
+        self.name = name
+        self.mean = mean
+        self.variance = variance
+
+    def log_likelihood(self, df: pd.DataFrame) -> np.array:
+        ll = np.zeros((len(df), len(self.mean)))
+        if self.name not in df.columns:
+            return ll
+
+        x = df[self.name].values.astype(np.float64)
+        observed = ~np.isnan(x)
+        d = x[observed, np.newaxis] - self.mean[np.newaxis, :]
+        ll[observed] = -0.5 * (np.log(2 * np.pi * self.variance)[np.newaxis, :] + d ** 2 / self.variance)
+        return ll
+
+    def statistics(self, df: pd.DataFrame, posterior: np.array) -> dict:
+        """
+        The expected zeroth, first and second moments of the variable for each latent state. Missing values
+        contribute the moments of the latent state's Gaussian.
+        """
+        if self.name in df.columns:
+            x = df[self.name].values.astype(np.float64)
+        else:
+            x = np.full(len(df), np.nan)
+
+        observed = ~np.isnan(x)
+        p = posterior[observed]
+        x = x[observed]
+        missing = posterior[~observed].sum(axis=0)
+        return {'s0': posterior.sum(axis=0), 's1': p.T.dot(x) + missing * self.mean,
+                's2': p.T.dot(x ** 2) + missing * (self.mean ** 2 + self.variance)}
+
+    def maximise(self, statistics: dict) -> 'GaussianChild':
+        s0 = statistics['s0']
+        seen = s0 > 0
+        mean = np.where(seen, statistics['s1'] / np.where(seen, s0, 1), self.mean)
+        variance = np.where(seen, statistics['s2'] / np.where(seen, s0, 1) - mean ** 2, self.variance)
+        return GaussianChild(self.name, mean, np.maximum(variance, _MINIMUM_VARIANCE))
+
+    def write(self, network, latent_states, index):
+        v = index.get_variable(self.name)
+        node = v.getNode()
+        distribution = node.newDistribution()
+        for k, latent_state in enumerate(latent_states):
+            distribution.setMean(v, float(self.mean[k]), _state_array([latent_state]))
+            distribution.setVariance(v, float(self.variance[k]), _state_array([latent_state]))
+
+        node.setDistribution(distribution)
+
+    def mean_variance(self, df: pd.DataFrame, variable_name: str):
+        """
+        The mean and variance of the variable for each row and latent state, as two N x K arrays.
+        """
+        return np.tile(self.mean, (len(df), 1)), np.tile(self.variance, (len(df), 1))
+
+
+class MultivariateGaussianChild:
+    """
+    A continuous child of the latent variable with several (jointly Gaussian) variables, such as the nodes created by
+    Builder.create_multivariate_continuous_node. The Cholesky factors of the covariance for each latent state are
+    computed once for each pattern of missing values, so a block of N x D evidence is scored with a few matrix
+    operations. Missing columns are marginalised out.
+    """
+
+    def __init__(self, name: str, variables: List[str], mean: np.array, covariance: np.array):
+        """
+        :param mean: a K x D array of means for each latent state
+        :param covariance: a K x D x D array of covariances for each latent state
+        """
+        self.name = name
+        self.variables = variables
+        self.mean = mean
+        self.covariance = covariance
+        self._factors = {}
+
+    def _get_factors(self, observed: tuple):
+        """
+        The inverse of the Cholesky factor and the log determinant of the covariance over the observed columns, for
+        each latent state.
+        """
+        if observed not in self._factors:
+            o = list(observed)
+            covariance = self.covariance[:, o][:, :, o]
+            cholesky = np.linalg.cholesky(covariance)
+            inverse = np.linalg.inv(cholesky)
+            log_determinant = 2 * np.sum(np.log(np.diagonal(cholesky, axis1=1, axis2=2)), axis=1)
+            self._factors[observed] = (inverse, log_determinant)
+
+        return self._factors[observed]
+
+    def _values(self, df: pd.DataFrame) -> np.array:
+        x = np.full((len(df), len(self.variables)), np.nan)
+        for i, v in enumerate(self.variables):
+            if v in df.columns:
+                x[:, i] = df[v].values.astype(np.float64)
+
+        return x
+
+    def _patterns(self, x: np.array):
+        """
+        Group the rows by which columns are observed, yielding (row mask, observed column indexes)
+        """
+        observed = ~np.isnan(x)
+        keys = observed.dot(1 << np.arange(x.shape[1]))
+        for key in np.unique(keys):
+            rows = keys == key
+            yield rows, tuple(np.where(observed[np.argmax(rows)])[0].tolist())
+
+    def log_likelihood(self, df: pd.DataFrame) -> np.array:
+        x = self._values(df)
+        ll = np.zeros((len(df), self.mean.shape[0]))
+        for rows, o in self._patterns(x):
+            if len(o) == 0:
+                continue
+
+            inverse, log_determinant = self._get_factors(o)
+            o = list(o)
+            # N x K x d deviations from each latent state's mean
+            d = x[rows][:, np.newaxis, o] - self.mean[np.newaxis, :, o]
+            z = np.einsum('kij,nkj->nki', inverse, d)
+            ll[rows] = -0.5 * (len(o) * np.log(2 * np.pi) + log_determinant[np.newaxis, :] + np.sum(z ** 2, axis=2))
+
+        return ll
+
+    def mean_variance(self, df: pd.DataFrame, variable_name: str):
+        """
+        The mean and variance of one of the variables for each row and latent state (as two N x K arrays), using
+        the conditional Gaussian given whichever other columns are observed.
+        """
+        t = self.variables.index(variable_name)
+        x = self._values(df)
+        x[:, t] = np.nan
+
+        mean = np.zeros((len(df), self.mean.shape[0]))
+        variance = np.zeros((len(df), self.mean.shape[0]))
+        for rows, o in self._patterns(x):
+            if len(o) == 0:
+                mean[rows] = self.mean[:, t]
+                variance[rows] = self.covariance[:, t, t]
+                continue
+
+            inverse, _ = self._get_factors(o)
+            o = list(o)
+            precision = np.einsum('kji,kjl->kil', inverse, inverse)
+            # regression coefficients of the target on the observed columns, for each latent state
+            beta = np.einsum('ki,kij->kj', self.covariance[:, t, o], precision)
+            d = x[rows][:, np.newaxis, o] - self.mean[np.newaxis, :, o]
+            mean[rows] = self.mean[np.newaxis, :, t] + np.einsum('kj,nkj->nk', beta, d)
+            variance[rows] = self.covariance[:, t, t] - np.einsum('kj,kj->k', beta, self.covariance[:, o, t])
+
+        return mean, variance
+
+    def statistics(self, df: pd.DataFrame, posterior: np.array) -> dict:
+        """
+        The expected zeroth, first and second moments for each latent state. Missing values take their conditional
+        expectation given the observed columns, and their conditional covariance is added to the second moment.
+        """
+        x = self._values(df)
+        k, dimensions = self.mean.shape
+        s1 = np.zeros((k, dimensions))
+        s2 = np.zeros((k, dimensions, dimensions))
+        for rows, o in self._patterns(x):
+            p = posterior[rows]
+            m = [i for i in range(dimensions) if i not in o]
+            # N x K x D expected values of each row under each latent state
+            expected = np.repeat(self.mean[np.newaxis, :, :], int(rows.sum()), axis=0)
+            covariance = np.zeros((k, dimensions, dimensions))
+            if len(o) > 0:
+                expected[:, :, list(o)] = x[rows][:, np.newaxis, list(o)]
+
+            if len(m) > 0:
+                conditional = self.covariance[:, m][:, :, m]
+                if len(o) > 0:
+                    inverse, _ = self._get_factors(o)
+                    o = list(o)
+                    precision = np.einsum('kji,kjl->kil', inverse, inverse)
+                    # regression coefficients of the missing columns on the observed ones, for each latent state
+                    beta = np.einsum('kmi,kij->kmj', self.covariance[:, m][:, :, o], precision)
+                    d = x[rows][:, np.newaxis, o] - self.mean[np.newaxis, :, o]
+                    expected[:, :, m] = self.mean[np.newaxis, :, m] + np.einsum('kmj,nkj->nkm', beta, d)
+                    conditional = conditional - np.einsum('kmj,kjl->kml', beta, self.covariance[:, o][:, :, m])
+
+                covariance[np.ix_(np.arange(k), m, m)] = conditional
+
+            s1 += np.einsum('nk,nkd->kd', p, expected)
+            s2 += np.einsum('nk,nki,nkj->kij', p, expected, expected) + \
+                p.sum(axis=0)[:, np.newaxis, np.newaxis] * covariance
+
+        return {'s0': posterior.sum(axis=0), 's1': s1, 's2': s2}
+
+    def maximise(self, statistics: dict) -> 'MultivariateGaussianChild':
+        s0 = statistics['s0']
+        seen = s0 > 0
+        n = np.where(seen, s0, 1)
+        mean = np.where(seen[:, np.newaxis], statistics['s1'] / n[:, np.newaxis], self.mean)
+        covariance = statistics['s2'] / n[:, np.newaxis, np.newaxis] - np.einsum('ki,kj->kij', mean, mean)
+        covariance = np.where(seen[:, np.newaxis, np.newaxis], covariance, self.covariance)
+        return MultivariateGaussianChild(self.name, self.variables, mean, covariance)
+
+    def write(self, network, latent_states, index):
+        node = network.getNodes().get(self.name)
+        distribution = node.newDistribution()
+        variables = [index.get_variable(name) for name in self.variables]
+        for k, latent_state in enumerate(latent_states):
+            states = _state_array([latent_state])
+            for i, v in enumerate(variables):
+                distribution.setMean(v, float(self.mean[k, i]), states)
+                for j, v1 in enumerate(variables):
+                    if i == j:
+                        distribution.setVariance(v, float(self.covariance[k, i, i]), states)
+                    else:
+                        distribution.setCovariance(v, v1, float(self.covariance[k, i, j]), states)
+
+        node.setDistribution(distribution)
+
+
+class MixtureModel:
+    """
+    The parameters of a trained mixture model and vectorised inference over them. Results are the same as those
+    from the equivalent queries through the Java inference engine (up to floating point error), and missing values
+    are marginalised out.
+    """
+
+    def __init__(self, latent_variable_name: str, latent_states: List[str], prior: np.array, children: list):
+        self.latent_variable_name = latent_variable_name
+        self.latent_states = latent_states
+        self.prior = prior
+        self.children = children
+        self._log_prior = _log(prior)
+
+    @staticmethod
+    def from_network(network, latent_variable_name='Cluster'):
+        """
+        Export the parameters of a trained network, where every node other than the latent variable has the latent
+        variable as its only parent.
+        """
+        if not bayespy.network.is_trained(network):
+            raise ValueError("The network needs to be trained before it can be exported")
+
+        latent = bayespy.network.get_variable(network, latent_variable_name)
+        latent_node = latent.getNode()
+        if len(latent_node.getLinksIn()) > 0:
+            raise ValueError("{} should not have any parents".format(latent_variable_name))
+
+        latent_states = [state for state in latent.getStates()]
+        prior_table = latent_node.getDistribution()
+        prior = np.array([prior_table.get([state]) for state in latent_states])
+
+        children = []
+        for node in network.getNodes():
+            if node.getName() == latent_node.getName():
+                continue
+
+            parents = [link.getFrom().getName() for link in node.getLinksIn()]
+            if parents != [latent_node.getName()]:
+                raise ValueError("{} should only have {} as a parent, so can't be exported as a mixture model"
+                                 .format(node.getName(), latent_variable_name))
+
+            children.append(MixtureModel._export_child(node, latent_states))
+
+        return MixtureModel(latent_variable_name, [state.getName() for state in latent_states], prior, children)
+
+    @staticmethod
+    def _export_child(node, latent_states):
+        variables = [v for v in node.getVariables()]
+        distribution = node.getDistribution()
+        if len(variables) > 1:
+            if not all(bayespy.network.is_variable_continuous(v) for v in variables):
+                raise ValueError("Node {} has more than one variable, which need to be continuous".format(
+                    node.getName()))
+
+            mean = np.array([[distribution.getMean(v, _state_array([state])) for v in variables]
+                             for state in latent_states])
+            covariance = np.array([[[distribution.getCovariance(v, v1, _state_array([state])) for v1 in variables]
+                                    for v in variables] for state in latent_states])
+            return MultivariateGaussianChild(node.getName(), [v.getName() for v in variables], mean, covariance)
+
+        v = variables[0]
+        if bayespy.network.is_variable_discrete(v):
+            states = [state for state in v.getStates()]
+            table = np.array([[distribution.get([latent_state, state]) for state in states]
+                              for latent_state in latent_states])
+            return DiscreteChild(v.getName(), [state.getName() for state in states], table)
+
+        mean = np.array([distribution.getMean(v, _state_array([state])) for state in latent_states])
+        variance = np.array([distribution.getVariance(v, _state_array([state])) for state in latent_states])
+        return GaussianChild(v.getName(), mean, variance)
+
+    def get_child(self, name: str):
+        """
+        Get the child with the specified variable name (or node name, for multivariate nodes)
+        """
+        for child in self.children:
+            if child.name == name or name in getattr(child, 'variables', []):
+                return child
+
+        raise ValueError("Variable {} does not exist".format(name))
+
+    @staticmethod
+    def _retract(df: pd.DataFrame, variable_names: List[str]) -> pd.DataFrame:
+        return df.assign(**{name: np.nan for name in variable_names if name in df.columns})
+
+    def _joint(self, df: pd.DataFrame, exclude=None) -> np.array:
+        """
+        log P(latent = k, evidence) for each row, optionally retracting the evidence on one of the children.
+        """
+        joint = np.tile(self._log_prior, (len(df), 1))
+        for child in self.children:
+            if child.name == exclude:
+                continue
+
+            joint += child.log_likelihood(df)
+
+        return joint
+
+    @staticmethod
+    def _normalise(joint: np.array) -> np.array:
+        return np.exp(joint - _logsumexp(joint)[:, np.newaxis])
+
+    def loglikelihood(self, df: pd.DataFrame) -> np.array:
+        return _logsumexp(self._joint(df))
+
+    def cluster_posterior(self, df: pd.DataFrame) -> np.array:
+        """
+        P(latent = k | evidence) as a N x K array
+        """
+        return self._normalise(self._joint(df))
+
+    def state_probability(self, df: pd.DataFrame, variable_name: str) -> np.array:
+        """
+        The probability of each state of a discrete variable, given the evidence on every other variable (the
+        variable's own evidence is retracted, as with the Java queries).
+        """
+        if variable_name == self.latent_variable_name:
+            return self.cluster_posterior(df)
+
+        child = self.get_child(variable_name)
+        if not isinstance(child, DiscreteChild):
+            raise ValueError("{} needs to be discrete".format(variable_name))
+
+        return self._normalise(self._joint(df, exclude=variable_name)).dot(child.table)
+
+    def mean_variance(self, df: pd.DataFrame, variable_name: str):
+        """
+        The mean and variance of a continuous variable given the evidence on every other variable (the variable's
+        own evidence is retracted), as two arrays.
+        """
+        child = self.get_child(variable_name)
+        if isinstance(child, DiscreteChild):
+            raise ValueError("{} needs to be continuous.".format(variable_name))
+
+        retracted = self._retract(df, [variable_name])
+        posterior = self.cluster_posterior(retracted)
+        means, variances = child.mean_variance(retracted, variable_name)
+        mean = np.sum(posterior * means, axis=1)
+        return mean, np.sum(posterior * (variances + means ** 2), axis=1) - mean ** 2
+
+    def conditional_loglikelihood(self, df: pd.DataFrame, variable_names: List[str]) -> np.array:
+        """
+        The log likelihood of the evidence on the specified variables, given the evidence on every other variable
+        (as with QueryLogLikelihood). Rows with no evidence on the variables have a value of 0.
+        """
+        return self.loglikelihood(df) - self.loglikelihood(self._retract(df, variable_names))
+
+    def statistics(self, df: pd.DataFrame, weight: float = 1.0) -> 'SufficientStatistics':
+        """
+        The expected sufficient statistics of the rows (the E-step of EM), e.g. to update the parameters with new data
+        without revisiting the old.
+        :param weight: the weight of each row
+        """
+        joint = self._joint(df)
+        loglikelihood = _logsumexp(joint)
+        posterior = np.exp(joint - loglikelihood[:, np.newaxis]) * weight
+        return SufficientStatistics(posterior.sum(axis=0), [child.statistics(df, posterior)
+                                                            for child in self.children], len(df) * weight,
+                                    loglikelihood=float(loglikelihood.sum()) * weight)
+
+    def maximise(self, statistics: 'SufficientStatistics') -> 'MixtureModel':
+        """
+        The parameters which maximise the likelihood given the statistics (the M-step of EM), as a new model.
+        """
+        total = statistics.latent_counts.sum()
+        prior = statistics.latent_counts / total if total > 0 else self.prior
+        return MixtureModel(self.latent_variable_name, self.latent_states, prior,
+                            [child.maximise(s) for child, s in zip(self.children, statistics.children)])
+
+    def write_to_network(self, network):
+        """
+        Write the parameters back to the network they were exported from (see from_network).
+        """
+        index = bayespy.network.get_index(network)
+        latent_states = index.get_states(self.latent_variable_name)
+        latent_node = index.get_variable(self.latent_variable_name).getNode()
+        prior = latent_node.newDistribution()
+        for k, state in enumerate(latent_states):
+            prior.set(float(self.prior[k]), [state])
+
+        latent_node.setDistribution(prior)
+        for child in self.children:
+            child.write(network, latent_states, index)
+
+    def get_states(self, variable_name: str) -> List[str]:
+        if variable_name == self.latent_variable_name:
+            return self.latent_states
+
+        return self.get_child(variable_name).states
+
+    def most_likely_state(self, df: pd.DataFrame, variable_name: str) -> np.array:
+        states = np.array(self.get_states(variable_name), dtype=object)
+        return states[np.argmax(self.state_probability(df, variable_name), axis=1)]
+
+    @staticmethod
+    def supports(queries: List[bayespy.model.QueryBase]) -> bool:
+        """
+        Whether all of the queries can be run by query()
+        """
+        for query in queries:
+            if isinstance(query, bayespy.model.QueryStatistics):
+                if query._calc_conflict:
+                    return False
+            elif not isinstance(query, (bayespy.model.QueryStateProbability, bayespy.model.QueryMostLikelyState,
+                                        bayespy.model.QueryLogLikelihood, bayespy.model.QueryMeanVariance)):
+                return False
+
+        return True
+
+    def query(self, df: pd.DataFrame, queries: List[bayespy.model.QueryBase]) -> pd.DataFrame:
+        """
+        Run the supported query types (QueryStatistics/ QueryModelStatistics log likelihood, QueryStateProbability,
+        QueryMostLikelyState, QueryLogLikelihood and QueryMeanVariance) over the dataframe, returning the same columns
+        as a batch query.
+        """
+        results = pd.DataFrame(index=df.index)
+        for query in queries:
+            if isinstance(query, bayespy.model.QueryStatistics):
+                if query._calc_conflict:
+                    raise ValueError("Conflict is not supported by vectorised inference")
+
+                if query._calc_loglikelihood:
+                    results[query._loglikelihood_column] = self.loglikelihood(df)
+
+            elif isinstance(query, bayespy.model.QueryStateProbability):
+                probabilities = self.state_probability(df, query._target_variable_name)
+                for i, state in enumerate(self.get_states(query._target_variable_name)):
+                    results[query._column_name(state)] = probabilities[:, i]
+
+            elif isinstance(query, bayespy.model.QueryMostLikelyState):
+                states = self.most_likely_state(df, query._target_variable_name)
+                dtype = query._output_dtype
+                if bayespy.data.DataFrame.is_numeric(dtype) or bayespy.data.DataFrame.is_bool(dtype):
+                    states = np.array([bayespy.data.DataFrame.cast2(dtype, state) for state in states])
+
+                results[query._target_variable_name + query._suffix] = states
+
+            elif isinstance(query, bayespy.model.QueryLogLikelihood):
+                results[":".join(query._variable_names) + query._column_name] = self.conditional_loglikelihood(
+                    df, query._variable_names)
+
+            elif isinstance(query, bayespy.model.QueryMeanVariance):
+                variable_name = query._variable_name
+                mean, variance = self.mean_variance(df, variable_name)
+                if not query._retract_evidence:
+                    observed = df[variable_name].notnull().values if variable_name in df.columns \
+                        else np.zeros(len(df), dtype=bool)
+                    mean[observed] = df[variable_name].values[observed]
+                    variance[observed] = 0
+
+                if query._output_dtype is not None:
+                    mean = mean.astype(query._output_dtype)
+
+                results[variable_name + query._result_mean_suffix] = mean
+                results[variable_name + query._result_variance_suffix] = variance
+
+            else:
+                raise ValueError("{} is not supported by vectorised inference".format(type(query).__name__))
+
+        return results
+
+
+class SufficientStatistics:
+    """
+    The expected sufficient statistics of a MixtureModel over some data: expected counts for the latent variable and
+    discrete children, and moments for the Gaussian children. Statistics from different data can be added (and
+    scaled down, to forget old data), so parameters can be updated at a cost proportional to the new data.
+    """
+
+    def __init__(self, latent_counts: np.array, children: List[dict], case_count: float, loglikelihood: float = 0.0):
+        self.latent_counts = latent_counts
+        self.children = children
+        self.case_count = case_count
+        # the log likelihood of the data under the parameters the statistics were calculated with.
+        self.loglikelihood = loglikelihood
+
+    def scale(self, factor: float) -> 'SufficientStatistics':
+        return SufficientStatistics(self.latent_counts * factor,
+                                    [{name: value * factor for name, value in child.items()}
+                                     for child in self.children], self.case_count * factor,
+                                    loglikelihood=self.loglikelihood * factor)
+
+    def add(self, other: 'SufficientStatistics') -> 'SufficientStatistics':
+        if len(self.children) != len(other.children):
+            raise ValueError("Statistics are from different models")
+
+        return SufficientStatistics(self.latent_counts + other.latent_counts,
+                                    [{name: value + b[name] for name, value in a.items()}
+                                     for a, b in zip(self.children, other.children)],
+                                    self.case_count + other.case_count,
+                                    loglikelihood=self.loglikelihood + other.loglikelihood)
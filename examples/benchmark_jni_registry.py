@@ -0,0 +1,38 @@
+import bayespy
+from bayespy.jni import bayesServer, jp
+
+import logging
+import timeit
+
+# Compares resolving a Bayes Server class through a new jp.JPackage on every call (what the accessors in bayespy.jni
+# used to do) with the cached handles handed out by the accessors now.
+
+def main():
+    logger = logging.getLogger()
+    logger.addHandler(logging.StreamHandler())
+    logger.setLevel(logging.INFO)
+
+    start = timeit.default_timer()
+    bayespy.jni.attach(logger, lazy=True)
+    logger.info("attach: {:.4f}s (the JVM isn't started yet)".format(timeit.default_timer() - start))
+
+    start = timeit.default_timer()
+    bayesServer()
+    logger.info("first use, starting the JVM: {:.4f}s".format(timeit.default_timer() - start))
+
+    number = 100000
+    lookups = {
+        'uncached State': lambda: jp.JPackage("com.bayesserver").State,
+        'cached State': lambda: bayesServer().State,
+        'uncached VariableValueType.DISCRETE': lambda: jp.JPackage("com.bayesserver").VariableValueType.DISCRETE,
+        'cached VariableValueType.DISCRETE': lambda: bayesServer().VariableValueType.DISCRETE,
+        'uncached inference.QueryDistribution': lambda: jp.JPackage("com.bayesserver.inference").QueryDistribution,
+        'cached inference.QueryDistribution': lambda: bayespy.jni.bayesServerInference().QueryDistribution,
+    }
+
+    for name, lookup in lookups.items():
+        seconds = min(timeit.repeat(lookup, number=number, repeat=3))
+        logger.info("{}: {:.3f}us per call".format(name, seconds / number * 1e6))
+
+if __name__ == "__main__":
+    main()
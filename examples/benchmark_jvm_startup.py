@@ -0,0 +1,72 @@
+import pandas as pd
+import bayespy
+from bayespy.network import Builder as builder
+
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+
+# Measures cold start to first inference for each of the JVM profiles in bayespy.jni.PROFILES. The JVM can only be
+# started once per process, so each profile is run in a new Python process. The fast_start profile is run twice, as
+# the first run writes the AppCDS archive that later runs use.
+
+def run_profile(profile):
+    start = time.perf_counter()
+    bayespy.jni.attach(profile=profile)
+    jvm_started = time.perf_counter()
+
+    logger = logging.getLogger()
+    db_folder = bayespy.utils.get_path_to_parent_dir(__file__)
+    iris = pd.read_csv(os.path.join(db_folder, "data/iris.csv"), index_col=False)
+
+    network = bayespy.network.create_network()
+    cluster = builder.create_cluster_variable(network, 3)
+    node = builder.create_multivariate_continuous_node(network, iris.drop('iris_class', axis=1).columns.tolist(),
+                                                       "joint")
+    builder.create_link(network, cluster, node)
+
+    model = bayespy.model.NetworkModel(network, logger)
+    with bayespy.data.DataSet(iris, db_folder, logger, in_memory=True) as dataset:
+        model.train(dataset)
+    trained = time.perf_counter()
+
+    (engine, _, _) = bayespy.model.InferenceEngine(network).create()
+    query = bayespy.model.SingleQuery(network, engine, logger)
+    query.query([bayespy.model.QueryMostLikelyState('Cluster')],
+                evidence={'petal_length': 1.4, 'sepal_width': 3.5})
+    first_inference = time.perf_counter()
+
+    print(json.dumps({'profile': profile, 'jvm_start_seconds': jvm_started - start,
+                      'build_and_train_seconds': trained - jvm_started,
+                      'first_inference_seconds': first_inference - trained,
+                      'total_seconds': first_inference - start}))
+
+def main():
+    logger = logging.getLogger()
+    logger.addHandler(logging.StreamHandler())
+    logger.setLevel(logging.INFO)
+
+    runs = []
+    for profile in bayespy.jni.PROFILES.keys():
+        runs.append(profile)
+        if bayespy.jni.PROFILES[profile].app_cds_archive is not None:
+            runs.append(profile)
+
+    results = []
+    for i, profile in enumerate(runs):
+        output = subprocess.run([sys.executable, __file__, profile], stdout=subprocess.PIPE, check=True,
+                                universal_newlines=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        result['run'] = i
+        results.append(result)
+
+    logger.info(pd.DataFrame(results).set_index(['run', 'profile']).to_string())
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        run_profile(sys.argv[1])
+    else:
+        main()
@@ -0,0 +1,59 @@
+import pandas as pd
+import numpy as np
+import bayespy
+
+import logging
+import os
+import time
+from sqlalchemy import create_engine, text
+
+# Compares the strategies used by DataSet.create_select_statement to select a subset of rows from storage. This
+# doesn't need the JVM, the statements are run directly against SQLite, which is what the JDBC reader does.
+
+def time_statement(engine, statement, repeats=3):
+    timings = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        with engine.connect() as connection:
+            rows = len(connection.execute(text(statement)).fetchall())
+        timings.append(time.perf_counter() - start)
+
+    return rows, min(timings)
+
+def main():
+    logger = logging.getLogger()
+    logger.addHandler(logging.StreamHandler())
+    logger.setLevel(logging.INFO)
+
+    db_folder = bayespy.utils.get_path_to_parent_dir(__file__)
+    num_rows = 1000000
+    df = pd.DataFrame({'a': np.random.normal(size=num_rows), 'b': np.random.normal(size=num_rows),
+                       'c': np.random.choice(['x', 'y', 'z'], size=num_rows)})
+
+    # a three fold split, training indexes are sorted, test indexes are shuffled.
+    shuffled = np.random.permutation(num_rows)
+    subsets = {'contiguous': np.arange(0, num_rows // 3),
+               'sorted (train fold)': np.sort(shuffled[:2 * num_rows // 3]),
+               'shuffled (test fold)': shuffled[2 * num_rows // 3:]}
+
+    with bayespy.data.DataSet(df, db_folder, logger) as dataset:
+        engine = create_engine("sqlite:///{}.db".format(os.path.join(db_folder, "db", dataset.uuid)))
+        results = []
+        for name, indexes in subsets.items():
+            for strategy in ['in', 'range', 'table']:
+                if strategy == 'range' and bayespy.data._get_contiguous_ranges(indexes) is None:
+                    continue
+
+                start = time.perf_counter()
+                statement = dataset.create_select_statement(indexes, strategy=strategy)
+                prepare = time.perf_counter() - start
+
+                rows, query = time_statement(engine, statement)
+                results.append({'subset': name, 'strategy': strategy, 'rows': rows,
+                                'statement_bytes': len(statement), 'prepare_seconds': prepare,
+                                'query_seconds': query})
+
+        logger.info(pd.DataFrame(results).to_string())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import pandas as pd
+import bayespy
+from bayespy.network import Builder as builder
+
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+
+# Compares throughput and peak resident memory of a batch query on threads sharing one JVM (ThreadedBatchQuery)
+# with the process pool (BatchQuery) at 4, 8 and 16 workers. Each configuration runs in its own Python process so
+# that the memory of one doesn't carry over to the next. Memory is read from /proc, so this only runs on Linux.
+
+def _rss(pid):
+    try:
+        with open("/proc/{}/status".format(pid)) as fh:
+            for line in fh:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError):
+        pass
+
+    return 0
+
+def _tree_rss(root):
+    # the resident memory of a process and all of its descendants (e.g. pool workers).
+    parents = {}
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open("/proc/{}/stat".format(pid)) as fh:
+                parents[int(pid)] = int(fh.read().rsplit(")", 1)[1].split()[1])
+        except (IOError, OSError, IndexError):
+            continue
+
+    tree = {root}
+    changed = True
+    while changed:
+        changed = False
+        for pid, ppid in parents.items():
+            if ppid in tree and pid not in tree:
+                tree.add(pid)
+                changed = True
+
+    return sum(_rss(pid) for pid in tree)
+
+class MemorySampler:
+    def __init__(self, interval=0.2):
+        self._interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self.peak = 0
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, _tree_rss(os.getpid()))
+            self._stop.wait(self._interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self._stop.set()
+        self._thread.join()
+
+def run(mode, workers, num_rows):
+    logger = logging.getLogger()
+    bayespy.jni.attach(logger)
+
+    db_folder = bayespy.utils.get_path_to_parent_dir(__file__)
+    iris = pd.read_csv(os.path.join(db_folder, "data/iris.csv"), index_col=False)
+
+    network = bayespy.network.create_network()
+    cluster = builder.create_cluster_variable(network, 3)
+    node = builder.create_multivariate_continuous_node(network, iris.drop('iris_class', axis=1).columns.tolist(),
+                                                       "joint")
+    builder.create_link(network, cluster, node)
+
+    class_variable = builder.create_discrete_variable(network, iris, 'iris_class', iris['iris_class'].unique())
+    builder.create_link(network, cluster, class_variable)
+
+    model = bayespy.model.NetworkModel(network, logger)
+    with bayespy.data.DataSet(iris, db_folder, logger, in_memory=True) as dataset:
+        model.train(dataset)
+
+    data = iris.drop('iris_class', axis=1).sample(n=num_rows, replace=True).reset_index(drop=True)
+    queries = [bayespy.model.QueryStatistics(), bayespy.model.QueryMostLikelyState('Cluster')]
+
+    with bayespy.data.DataSet(data, db_folder, logger, in_memory=True) as dataset:
+        with MemorySampler() as sampler:
+            start = time.perf_counter()
+            if mode == 'threads':
+                model.batch_query(dataset, queries, threaded=True, max_workers=workers)
+            else:
+                with bayespy.model.QueryWorkerPool(logger, processes=workers) as pool:
+                    model.batch_query(dataset, queries, pool=pool)
+            seconds = time.perf_counter() - start
+
+    print(json.dumps({'mode': mode, 'workers': workers, 'rows_per_second': num_rows / seconds,
+                      'peak_rss_mb': sampler.peak / 1024 ** 2}))
+
+def main():
+    logger = logging.getLogger()
+    logger.addHandler(logging.StreamHandler())
+    logger.setLevel(logging.INFO)
+
+    num_rows = 200000
+    results = []
+    for workers in [4, 8, 16]:
+        for mode in ['threads', 'processes']:
+            output = subprocess.run([sys.executable, __file__, mode, str(workers), str(num_rows)],
+                                    stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+
+    logger.info(pd.DataFrame(results).set_index(['workers', 'mode']).to_string())
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        run(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]))
+    else:
+        main()
@@ -0,0 +1,61 @@
+import pandas as pd
+import numpy as np
+import bayespy
+from bayespy.network import Builder as builder
+
+import logging
+import os
+import time
+
+# Compares the throughput of a batch query through the Java inference engine with the vectorised engine, on a
+# cluster + multivariate Gaussian iris model, with the data replicated up to 1M rows. The batch query is only run on
+# a sample of the rows, and its throughput extrapolated.
+
+def main():
+
+    logger = logging.getLogger()
+    logger.addHandler(logging.StreamHandler())
+    logger.setLevel(logging.INFO)
+
+    bayespy.jni.attach(logger)
+
+    db_folder = bayespy.utils.get_path_to_parent_dir(__file__)
+    iris = pd.read_csv(os.path.join(db_folder, "data/iris.csv"), index_col=False)
+
+    network = bayespy.network.create_network()
+    cluster = builder.create_cluster_variable(network, 3)
+    node = builder.create_multivariate_continuous_node(network, iris.drop('iris_class', axis=1).columns.tolist(),
+                                                       "joint")
+    builder.create_link(network, cluster, node)
+
+    class_variable = builder.create_discrete_variable(network, iris, 'iris_class', iris['iris_class'].unique())
+    builder.create_link(network, cluster, class_variable)
+
+    model = bayespy.model.NetworkModel(network, logger)
+    with bayespy.data.DataSet(iris, db_folder, logger, in_memory=True) as dataset:
+        model.train(dataset)
+
+    num_rows = 1000000
+    sample_rows = 20000
+    data = iris.sample(n=num_rows, replace=True).reset_index(drop=True)
+    # some missing values, so that the conditional Gaussians are exercised.
+    data.loc[data.sample(frac=0.1).index, 'petal_width'] = np.nan
+
+    queries = [bayespy.model.QueryLogLikelihood(['sepal_length', 'sepal_width', 'petal_length', 'petal_width']),
+               bayespy.model.QueryStateProbability('iris_class')]
+
+    mixture = bayespy.vectorized.MixtureModel.from_network(network)
+    start = time.perf_counter()
+    mixture.query(data, queries)
+    vectorized_rows_per_second = num_rows / (time.perf_counter() - start)
+
+    with bayespy.data.DataSet(data.iloc[:sample_rows], db_folder, logger) as dataset:
+        start = time.perf_counter()
+        model.batch_query(dataset, queries, append_to_df=False)
+        batch_rows_per_second = sample_rows / (time.perf_counter() - start)
+
+    logger.info("Batch query: {:.0f} rows/s, vectorised: {:.0f} rows/s ({:.0f}x)".format(
+        batch_rows_per_second, vectorized_rows_per_second, vectorized_rows_per_second / batch_rows_per_second))
+
+if __name__ == "__main__":
+    main()
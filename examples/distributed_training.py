@@ -0,0 +1,69 @@
+import pandas as pd
+import numpy as np
+import bayespy
+from bayespy.network import Builder as builder
+
+import logging
+import os
+
+# Trains a mixture model on a sample of iris, then refines it on all of the data (with some values removed) from the
+# same starting point twice: with EM over 4 worker processes, each holding a quarter of the data, and with
+# NetworkModel.train without priors. The parameters should match to within about 1e-3.
+
+RTOL = 1e-3
+ATOL = 1e-4
+
+def create_network(iris):
+    network = bayespy.network.create_network()
+    cluster = builder.create_cluster_variable(network, 3)
+    node = builder.create_multivariate_continuous_node(network, iris.drop('iris_class', axis=1).columns.tolist(),
+                                                       "joint")
+    builder.create_link(network, cluster, node)
+
+    class_variable = builder.create_discrete_variable(network, iris, 'iris_class', iris['iris_class'].unique())
+    builder.create_link(network, cluster, class_variable)
+    return network
+
+def main():
+    logger = logging.getLogger()
+    logger.addHandler(logging.StreamHandler())
+    logger.setLevel(logging.INFO)
+
+    bayespy.jni.attach(logger)
+
+    db_folder = bayespy.utils.get_path_to_parent_dir(__file__)
+    iris = pd.read_csv(os.path.join(db_folder, "data/iris.csv"), index_col=False)
+
+    rng = np.random.RandomState(0)
+    data = iris.copy()
+    for column in data.columns:
+        data.loc[rng.rand(len(data)) < 0.1, column] = np.nan
+
+    network = create_network(iris)
+    with bayespy.data.DataSet(iris.sample(n=50, random_state=0), db_folder, logger, in_memory=True) as dataset:
+        bayespy.model.NetworkModel(network, logger).train(dataset, seed=0)
+
+    start = network.copy()
+
+    trained = start.copy()
+    with bayespy.data.DataSet(data, db_folder, logger, in_memory=True) as dataset:
+        results = bayespy.model.NetworkModel(trained, logger).train(dataset, init_from=start, priors=False,
+                                                                    max_iterations=5000, tolerance=1e-10)
+    logger.info("NetworkModel.train: {} iterations".format(results.get_iteration_count()))
+
+    distributed = start.copy()
+    with bayespy.distributed.DistributedTrainer(distributed, bayespy.distributed.create_process_shards(data, 4),
+                                                logger, max_iterations=5000, tolerance=1e-12) as trainer:
+        logger.info("DistributedTrainer: {} iterations".format(trainer.train().get_iteration_count()))
+
+    distributed_model = bayespy.vectorized.MixtureModel.from_network(distributed)
+    trained_model = bayespy.vectorized.MixtureModel.from_network(trained)
+    logger.info("Priors match: {}".format(np.allclose(distributed_model.prior, trained_model.prior, rtol=RTOL,
+                                                      atol=ATOL)))
+    for a, b in zip(distributed_model.children, trained_model.children):
+        matches = all(np.allclose(getattr(a, p), getattr(b, p), rtol=RTOL, atol=ATOL)
+                      for p in ['table', 'mean', 'covariance'] if hasattr(a, p))
+        logger.info("{} matches: {}".format(a.name, matches))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import pandas as pd
+import numpy as np
+import bayespy
+
+import logging
+import os
+import time
+
+# Trains a mixture naive Bayes model, then scores the data with both the Java inference engine (a batch query) and
+# the vectorised numpy engine exported from the trained network, checking that the results agree.
+
+def main():
+
+    logger = logging.getLogger()
+    logger.addHandler(logging.StreamHandler())
+    logger.setLevel(logging.INFO)
+
+    bayespy.jni.attach(logger)
+
+    db_folder = bayespy.utils.get_path_to_parent_dir(__file__)
+    iris = pd.read_csv(os.path.join(db_folder, "data/iris.csv"), index_col=False)
+
+    tpl = bayespy.template.MixtureNaiveBayes(logger, discrete=iris[['iris_class']],
+                                             continuous=iris.drop('iris_class', axis=1), latent_states=3)
+
+    network_factory = bayespy.network.NetworkFactory(logger)
+    queries = [bayespy.model.QueryModelStatistics(),
+               bayespy.model.QueryStateProbability("Cluster", suffix=""),
+               bayespy.model.QueryMostLikelyState("iris_class")]
+
+    # blank out some values, to check that missing data is marginalised out in the same way.
+    data = iris.copy()
+    data.loc[data.sample(frac=0.2).index, 'petal_width'] = np.nan
+
+    with bayespy.data.DataSet(data, db_folder, logger) as dataset:
+        model = bayespy.model.NetworkModel(tpl.create(network_factory), logger)
+        model.train(dataset)
+
+        start = time.perf_counter()
+        java_results = model.batch_query(dataset, queries, append_to_df=False).sort_index()
+        java_time = time.perf_counter() - start
+
+        mixture = bayespy.vectorized.MixtureModel.from_network(model.get_network())
+        start = time.perf_counter()
+        numpy_results = mixture.query(data, queries).sort_index()
+        numpy_time = time.perf_counter() - start
+
+    for column in numpy_results.columns:
+        if column == 'iris_class_maxlikelihood':
+            agreement = (numpy_results[column] == java_results[column]).mean()
+            logger.info("{}: {:.1%} agreement".format(column, agreement))
+        else:
+            difference = np.abs(numpy_results[column] - java_results[column]).max()
+            logger.info("{}: max absolute difference {}".format(column, difference))
+            assert np.allclose(numpy_results[column], java_results[column], atol=1e-6)
+
+    logger.info("Java: {:.3f}s, numpy: {:.3f}s".format(java_time, numpy_time))
+
+if __name__ == "__main__":
+    main()
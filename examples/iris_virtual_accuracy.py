@@ -64,14 +64,14 @@ def main():
     samples = bayespy.model.Sampling(network).sample(num_samples=20).drop(["Cluster", "iris_class"], axis=1)
     reader = bayespy.data.DataFrameReader(samples)
     inference = bayespy.model.InferenceEngine(network).create_engine()
-    evidence = bayespy.model.Evidence(network, inference)
     query = bayespy.model.SingleQuery(network, inference, logger)
-    query_type = [bayespy.model.QueryStateProbability('Cluster', suffix="")]
+    # the query is only set up once, then re-run with the evidence from each sample.
+    prepared_query = query.prepare([bayespy.model.QueryStateProbability('Cluster', suffix="")])
 
     # query the expected Cluster membership, and generate a wrapper for
     # comparing the values, weighted by cluster membership.
     while reader.read():
-        result = query.query(query_type, evidence=evidence.apply(reader.to_dict()))
+        result = prepared_query.query(evidence=reader.to_dict())
         cv_results = []
         for i, (key,value) in enumerate(result.items()):
             n = bayespy.network.Discrete.fromstring(key)
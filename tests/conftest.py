@@ -0,0 +1,54 @@
+import logging
+import os
+
+import pandas as pd
+import pytest
+
+DATA_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'examples', 'data')
+
+
+@pytest.fixture(scope='session')
+def logger():
+    return logging.getLogger('bayespy.tests')
+
+
+@pytest.fixture(scope='session')
+def iris():
+    return pd.read_csv(os.path.join(DATA_FOLDER, 'iris.csv'), index_col=False)
+
+
+@pytest.fixture(scope='session')
+def jvm(logger):
+    import bayespy
+    bayespy.jni.attach(logger)
+    return bayespy.jni
+
+
+@pytest.fixture(scope='session')
+def model(jvm, iris, logger, tmp_path_factory):
+    import bayespy
+    from bayespy.network import Builder as builder
+
+    network = bayespy.network.create_network()
+    cluster = builder.create_cluster_variable(network, 3)
+    node = builder.create_multivariate_continuous_node(network, iris.drop('iris_class', axis=1).columns.tolist(),
+                                                       "joint")
+    builder.create_link(network, cluster, node)
+    model = bayespy.model.NetworkModel(network, logger)
+    with bayespy.data.DataSet(iris, str(tmp_path_factory.mktemp('db')), logger, in_memory=True) as dataset:
+        model.train(dataset, seed=0)
+
+    return model
+
+
+@pytest.fixture(scope='session')
+def naive_bayes_model(jvm, iris, logger, tmp_path_factory):
+    import bayespy
+
+    template = bayespy.template.MixtureNaiveBayes(logger, discrete=iris[['iris_class']],
+                                                  continuous=iris.drop('iris_class', axis=1), latent_states=3)
+    model = bayespy.model.NetworkModel(template.create(bayespy.network.NetworkFactory(logger)), logger)
+    with bayespy.data.DataSet(iris, str(tmp_path_factory.mktemp('db')), logger, in_memory=True) as dataset:
+        model.train(dataset, seed=0)
+
+    return model
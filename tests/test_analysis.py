@@ -0,0 +1,46 @@
+import pytest
+
+pytest.importorskip('jpype')
+pytest.importorskip('sqlalchemy')
+pytest.importorskip('sklearn.cross_validation')
+
+import bayespy
+import bayespy.analysis
+from bayespy.model import NetworkModel
+
+
+def _templates(iris, logger):
+    return [bayespy.template.MixtureNaiveBayes(logger, discrete=iris[['iris_class']],
+                                               continuous=iris.drop('iris_class', axis=1), latent_states=3)]
+
+
+@pytest.fixture
+def trained(monkeypatch):
+    runs = []
+    train = NetworkModel.train
+
+    def _train(self, dataset, **kwargs):
+        results = train(self, dataset, **kwargs)
+        runs.append((self, kwargs.get('init_from'), results.get_metrics()))
+        return results
+
+    monkeypatch.setattr(NetworkModel, 'train', _train)
+    return runs
+
+
+@pytest.mark.parametrize('warm_start', [False, True])
+def test_analyse(jvm, iris, logger, trained, warm_start):
+    analysis = bayespy.analysis.LogLikelihoodAnalysis(logger)
+    results = analysis.analyse(iris, _templates(iris, logger), k=3, warm_start=warm_start)
+
+    assert results.columns.tolist() == ['MixtureNaiveBayes']
+    assert len(results) == len(iris)
+    assert results.MixtureNaiveBayes.notnull().all()
+
+    assert len(trained) == 3
+    assert trained[0][1] is None
+    assert not trained[0][2]['warm_start']
+    assert all(metrics['warm_start'] == warm_start for _, _, metrics in trained[1:])
+    # each fold after the first starts from the model trained in the fold before.
+    for (_, init_from, _), (previous, _, _) in zip(trained[1:], trained):
+        assert init_from is (previous if warm_start else None)
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('jpype')
+pytest.importorskip('sqlalchemy')
+
+import bayespy
+from bayespy.model import QueryModelStatistics, QueryMostLikelyState, QueryStateProbability
+
+QUERIES = [QueryModelStatistics(), QueryStateProbability('Cluster', suffix=""), QueryMostLikelyState('iris_class')]
+
+
+@pytest.fixture
+def data(iris):
+    data = iris.copy()
+    data.loc[data.sample(frac=0.2, random_state=0).index, 'petal_width'] = np.nan
+    return data
+
+
+@pytest.fixture
+def expected(naive_bayes_model, data, logger, tmp_path):
+    with bayespy.data.DataSet(data, str(tmp_path), logger, in_memory=True) as dataset:
+        return naive_bayes_model.batch_query(dataset, QUERIES, append_to_df=False).sort_index()
+
+
+def test_threaded_matches_batch_query(naive_bayes_model, data, expected, logger, tmp_path):
+    with bayespy.data.DataSet(data, str(tmp_path), logger, in_memory=True) as dataset:
+        results = naive_bayes_model.batch_query(dataset, QUERIES, append_to_df=False, threaded=True, max_workers=3)
+
+    pd.testing.assert_frame_equal(results.sort_index(), expected, check_dtype=False)
+
+
+def test_query_iter_matches_batch_query(naive_bayes_model, data, expected, logger, tmp_path, monkeypatch):
+    # as if no workers had been started yet, so iris is small enough to be queried in this process.
+    monkeypatch.setattr(bayespy.model, '_worker_startup_seconds', None)
+    with bayespy.data.DataSet(data, str(tmp_path), logger, in_memory=True) as dataset:
+        query = bayespy.model.BatchQuery(naive_bayes_model.get_network(), dataset, logger)
+        chunks = list(query.query_iter(QUERIES, chunk_size=40))
+
+    assert [len(chunk) for chunk in chunks] == [40, 40, 40, 30]
+    pd.testing.assert_frame_equal(pd.concat(chunks).sort_index(), expected, check_dtype=False)
+
+    timings = query.get_chunk_timings()
+    assert timings.index.tolist() == [0, 1, 2, 3]
+    assert timings['rows'].sum() == len(data)
+
+
+def test_query_iter_over_dataframe_chunks(naive_bayes_model, data, expected, logger):
+    chunks = (data.iloc[start:start + 50] for start in range(0, len(data), 50))
+    results = pd.concat(naive_bayes_model.batch_query_iter(chunks, QUERIES))
+
+    pd.testing.assert_frame_equal(results.sort_index(), expected, check_dtype=False)
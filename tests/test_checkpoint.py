@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+pytest.importorskip('jpype')
+pytest.importorskip('sqlalchemy')
+
+import bayespy
+from bayespy.model import TrainingCheckpoint, TrainingProgress
+
+
+def _write_checkpoint(path, network, metadata):
+    with open(path, 'w') as fh:
+        fh.write(network.saveToString())
+
+    with open(path + '.json', 'w') as fh:
+        json.dump(metadata, fh)
+
+
+def _run(network, df, seed=0, priors=True):
+    return {'network': bayespy.model._structure_fingerprint(network), 'data': bayespy.model._data_fingerprint(df),
+            'seed': seed, 'priors': priors}
+
+
+def test_mismatched_checkpoint_is_refused(model, iris, logger, tmp_path):
+    network = model.get_network()
+    path = str(tmp_path / 'checkpoint.bayes')
+    _write_checkpoint(path, network, dict(_run(network, iris, seed=1), iteration=5))
+
+    checkpoint = TrainingCheckpoint(path, logger, interval_iterations=1)
+    retrained = bayespy.model.NetworkModel(network.copy(), logger)
+    with bayespy.data.DataSet(iris, str(tmp_path), logger, in_memory=True) as dataset:
+        with pytest.raises(ValueError):
+            retrained.train(dataset, seed=0, progress=TrainingProgress(logger, checkpoint=checkpoint))
+
+    assert checkpoint.exists()
+
+
+def test_resume_counts_earlier_iterations(model, iris, logger, tmp_path):
+    network = model.get_network()
+    path = str(tmp_path / 'checkpoint.bayes')
+    _write_checkpoint(path, network, dict(_run(network, iris), iteration=5))
+
+    checkpoint = TrainingCheckpoint(path, logger, interval_iterations=1)
+    retrained = bayespy.model.NetworkModel(network.copy(), logger)
+    with bayespy.data.DataSet(iris, str(tmp_path), logger, in_memory=True) as dataset:
+        results = retrained.train(dataset, seed=0, max_iterations=8, tolerance=1e-12,
+                                  progress=TrainingProgress(logger, checkpoint=checkpoint))
+
+    assert 5 < results.get_iteration_count() <= 8
+    assert results.get_trace()['iteration'].iloc[0] == 6
+    assert not checkpoint.exists()
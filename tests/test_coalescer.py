@@ -0,0 +1,26 @@
+import pytest
+
+pytest.importorskip('jpype')
+pytest.importorskip('sqlalchemy')
+
+import bayespy
+from bayespy.model import QueryMostLikelyState
+
+
+def test_queued_requests_complete_on_close(model, logger):
+    coalescer = bayespy.model.RequestCoalescer(model.get_network(), [QueryMostLikelyState('Cluster')], logger,
+                                               max_latency=1.0)
+    futures = [coalescer.submit({'petal_length': 1.4}) for i in range(10)]
+    coalescer.close()
+
+    for future in futures:
+        assert future.done()
+        assert future.exception() is None
+
+
+def test_submit_after_close_raises(model, logger):
+    coalescer = bayespy.model.RequestCoalescer(model.get_network(), [QueryMostLikelyState('Cluster')], logger)
+    coalescer.close()
+
+    with pytest.raises(ValueError):
+        coalescer.submit({'petal_length': 1.4})
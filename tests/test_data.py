@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('jpype')
+pytest.importorskip('sqlalchemy')
+
+import bayespy
+
+
+def _read_all(reader):
+    rows = []
+    while reader.read():
+        rows.append([None if reader.isNull(i) else reader.getObject(i) for i in range(reader.getColumnCount())])
+
+    reader.close()
+    return rows
+
+
+def test_data_table_matches_dataframe(jvm):
+    df = pd.DataFrame({'x': [1.5, np.nan, 3.0], 'n': [1, 2, 3], 'flag': [True, False, True],
+                       'label': ['a', None, 'c']}, index=[10, 11, 12])
+    table = bayespy.data.create_data_table(df)
+
+    rows = _read_all(table.createDataReader())
+    assert [int(row[0]) for row in rows] == [10, 11, 12]
+    assert [None if row[1] is None else float(row[1]) for row in rows] == [1.5, None, 3.0]
+    assert [int(row[2]) for row in rows] == [1, 2, 3]
+    assert [bool(row[3]) for row in rows] == [True, False, True]
+    assert [None if row[4] is None else str(row[4]) for row in rows] == ['a', None, 'c']
+
+
+def test_reader_command_reads_the_table_each_time(jvm, iris):
+    command = bayespy.data.InMemoryDataReaderCommand(iris).as_java()
+    first = _read_all(command.executeReader())
+    second = _read_all(command.executeReader())
+
+    assert len(first) == len(iris)
+    assert len(second) == len(iris)
+
+
+def test_in_memory_matches_sqlite(naive_bayes_model, iris, logger, tmp_path):
+    data = iris.copy()
+    data.loc[data.sample(frac=0.2, random_state=0).index, 'petal_width'] = np.nan
+    queries = [bayespy.model.QueryModelStatistics(), bayespy.model.QueryStateProbability('Cluster', suffix=""),
+               bayespy.model.QueryMostLikelyState('iris_class')]
+
+    results = []
+    for in_memory in (True, False):
+        with bayespy.data.DataSet(data, str(tmp_path), logger, in_memory=in_memory) as dataset:
+            results.append(naive_bayes_model.batch_query(dataset, queries, append_to_df=False).sort_index())
+
+    pd.testing.assert_frame_equal(results[0], results[1], check_dtype=False)
+
+
+@pytest.fixture
+def stored(iris, logger, tmp_path):
+    with bayespy.data.DataSet(iris, str(tmp_path), logger) as dataset:
+        yield dataset
+
+
+def _select(dataset, statement):
+    return sorted(pd.read_sql(statement, dataset._engine)['ix'].tolist())
+
+
+def test_contiguous_ranges():
+    assert bayespy.data._get_contiguous_ranges(np.arange(10)) == [(0, 9)]
+    assert bayespy.data._get_contiguous_ranges(np.array([0, 1, 2, 5, 6, 9])) == [(0, 2), (5, 6), (9, 9)]
+    assert bayespy.data._get_contiguous_ranges(np.array([3, 1, 2])) is None
+    assert bayespy.data._get_contiguous_ranges(np.array([1, 1, 2])) is None
+    assert bayespy.data._get_contiguous_ranges(np.array([], dtype=np.int64)) == []
+
+
+def test_select_contiguous(stored):
+    statement = stored.create_select_statement(list(range(10, 20)))
+    assert 'between 10 and 19' in statement
+    assert _select(stored, statement) == list(range(10, 20))
+
+
+def test_select_sparse(stored):
+    indexes = [0, 1, 2, 5, 6, 9]
+    ranged = stored.create_select_statement(indexes)
+    tabled = stored.create_select_statement(indexes, max_ranges=2)
+
+    assert 'between' in ranged
+    assert 'join' in tabled
+    assert _select(stored, ranged) == indexes
+    assert _select(stored, tabled) == indexes
+
+
+def test_select_unsorted(stored):
+    indexes = [30, 4, 17]
+    assert 'join' in stored.create_select_statement(indexes)
+    assert _select(stored, stored.create_select_statement(indexes)) == sorted(indexes)
+    assert _select(stored, stored.create_select_statement(indexes, strategy='in')) == sorted(indexes)
+
+    with pytest.raises(ValueError):
+        stored.create_select_statement(indexes, strategy='range')
+
+
+def test_select_empty(iris, logger, tmp_path):
+    with bayespy.data.DataSet(iris.iloc[:0], str(tmp_path), logger) as dataset:
+        statement = dataset.create_select_statement(strategy='range')
+        assert _select(dataset, statement) == []
+
+
+def test_select_non_integer_index(iris, logger, tmp_path):
+    data = iris.set_index(pd.Index(['row{}'.format(i) for i in range(len(iris))]))
+    with bayespy.data.DataSet(data, str(tmp_path), logger) as dataset:
+        with pytest.raises(ValueError):
+            dataset.create_select_statement()
@@ -0,0 +1,127 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('jpype')
+pytest.importorskip('sqlalchemy')
+
+import bayespy
+from bayespy.distributed import DistributedTrainer, LocalShard, Shard
+from bayespy.network import Builder as builder
+from bayespy.vectorized import DiscreteChild, GaussianChild, MixtureModel, MultivariateGaussianChild
+
+# distributed training and NetworkModel.train (without priors) should agree to within this, from the same start.
+RTOL = 1e-3
+ATOL = 1e-4
+
+
+def _with_missing(df: pd.DataFrame, fraction: float, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.RandomState(seed)
+    df = df.copy()
+    for column in df.columns:
+        df.loc[rng.rand(len(df)) < fraction, column] = np.nan
+
+    return df
+
+
+def _mixture():
+    return MixtureModel('Cluster', ['c0', 'c1'], np.array([0.5, 0.5]), [
+        MultivariateGaussianChild('joint', ['a', 'b', 'c'], np.array([[0.0, 0.0, 0.0], [1.0, 1.0, 1.0]]),
+                                  np.array([np.eye(3) * 2] * 2)),
+        GaussianChild('x', np.array([1.0, 3.0]), np.array([3.0, 3.0])),
+        DiscreteChild('d', ['p', 'q'], np.array([[0.4, 0.6], [0.5, 0.5]]))])
+
+
+def _synthetic(n=2000, seed=1):
+    rng = np.random.RandomState(seed)
+    z = rng.rand(n) < 0.4
+    covariance = np.array([[1, 0.6, 0.2], [0.6, 1, 0.3], [0.2, 0.3, 1]])
+    x = rng.multivariate_normal([0, 0, 0], covariance, n) + z[:, np.newaxis] * np.array([3, -2, 1])
+    df = pd.DataFrame(x, columns=['a', 'b', 'c'])
+    df['x'] = np.where(z, rng.normal(5, 1, n), rng.normal(0, 2, n))
+    df['d'] = np.where(z, 'p', 'q')
+    return _with_missing(df, 0.2, seed=seed)
+
+
+def _assert_same_parameters(a: MixtureModel, b: MixtureModel):
+    np.testing.assert_allclose(a.prior, b.prior, rtol=RTOL, atol=ATOL)
+    for x, y in zip(a.children, b.children):
+        for name in ['table', 'mean', 'variance', 'covariance']:
+            if hasattr(x, name):
+                np.testing.assert_allclose(getattr(x, name), getattr(y, name), rtol=RTOL, atol=ATOL,
+                                           err_msg="{}.{}".format(x.name, name))
+
+
+def test_em_loglikelihood_never_decreases_with_missing_values():
+    df = _synthetic()
+    model = _mixture()
+    loglikelihoods = []
+    for i in range(30):
+        statistics = model.statistics(df)
+        loglikelihoods.append(statistics.loglikelihood)
+        model = model.maximise(statistics)
+
+    assert np.all(np.diff(loglikelihoods) > -1e-8)
+
+
+def test_shards_add_up_to_single_process():
+    df = _synthetic()
+    model = _mixture()
+    whole = model.statistics(df)
+    parts = [model.statistics(df.iloc[rows]) for rows in np.array_split(np.arange(len(df)), 3)]
+    total = parts[0].add(parts[1]).add(parts[2])
+
+    np.testing.assert_allclose(total.latent_counts, whole.latent_counts)
+    assert total.loglikelihood == pytest.approx(whole.loglikelihood)
+    for a, b in zip(total.children, whole.children):
+        for name in a:
+            np.testing.assert_allclose(a[name], b[name])
+
+
+def test_max_iterations_is_validated(logger):
+    with pytest.raises(ValueError):
+        DistributedTrainer(None, [LocalShard(pd.DataFrame())], logger, max_iterations=0)
+
+
+def _create_network(iris):
+    network = bayespy.network.create_network()
+    cluster = builder.create_cluster_variable(network, 3)
+    node = builder.create_multivariate_continuous_node(network, iris.drop('iris_class', axis=1).columns.tolist(),
+                                                       "joint")
+    builder.create_link(network, cluster, node)
+    class_variable = builder.create_discrete_variable(network, iris, 'iris_class', iris['iris_class'].unique())
+    builder.create_link(network, cluster, class_variable)
+    return network
+
+
+def test_matches_network_model_train(jvm, iris, logger, tmpdir):
+    data = _with_missing(iris, 0.1)
+    network = _create_network(iris)
+    with bayespy.data.DataSet(iris.sample(n=50, random_state=0), str(tmpdir), logger, in_memory=True) as sample:
+        bayespy.model.NetworkModel(network, logger).train(sample, seed=0)
+
+    start = network.copy()
+
+    trained = network.copy()
+    with bayespy.data.DataSet(data, str(tmpdir), logger, in_memory=True) as dataset:
+        bayespy.model.NetworkModel(trained, logger).train(dataset, init_from=start, priors=False,
+                                                          max_iterations=5000, tolerance=1e-10)
+
+    distributed = start.copy()
+    shards = [LocalShard(data.iloc[rows]) for rows in np.array_split(np.arange(len(data)), 3)]
+    with DistributedTrainer(distributed, shards, logger, max_iterations=5000, tolerance=1e-12) as trainer:
+        trainer.train()
+
+    _assert_same_parameters(MixtureModel.from_network(distributed), MixtureModel.from_network(trained))
+
+
+def test_shard_is_abstract():
+    with pytest.raises(TypeError):
+        Shard()
+
+    class IncompleteShard(Shard):
+        def get_case_count(self):
+            return 0
+
+    with pytest.raises(TypeError):
+        IncompleteShard()
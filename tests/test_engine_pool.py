@@ -0,0 +1,47 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('jpype')
+pytest.importorskip('sqlalchemy')
+
+import bayespy
+from bayespy.model import EnginePool
+
+
+def test_checkout_past_capacity_times_out(model):
+    pool = EnginePool(model.get_network(), max_size=1)
+    with pool.engine():
+        with pytest.raises(TimeoutError):
+            pool.checkout(timeout=0.1)
+
+    assert pool.get_metrics()['waits'] == 1
+    assert pool.get_metrics()['checked_out'] == 0
+
+
+def test_checkout_waits_for_a_returned_engine(model):
+    pool = EnginePool(model.get_network(), max_size=1)
+    inference_engine = pool.checkout()
+    threading.Timer(0.1, pool.checkin, args=(inference_engine,)).start()
+
+    start = time.perf_counter()
+    assert pool.checkout(timeout=5) is inference_engine
+    assert time.perf_counter() - start >= 0.05
+    assert pool.get_metrics()['created'] == 1
+
+
+def test_returned_engine_is_cleared(model, logger):
+    network = model.get_network()
+    pool = EnginePool(network, max_size=1)
+    with pool.engine() as inference_engine:
+        bayespy.model.Evidence(network, inference_engine).apply({'petal_length': 1.4})
+        bayespy.model.PreparedQuery(network, [bayespy.model.QueryMostLikelyState('Cluster')], logger,
+                                    inference_engine=inference_engine)
+        assert inference_engine.getEvidence().size() > 0
+        assert inference_engine.getQueryDistributions().size() > 0
+
+    with pool.engine() as reused:
+        assert reused is inference_engine
+        assert reused.getEvidence().size() == 0
+        assert reused.getQueryDistributions().size() == 0
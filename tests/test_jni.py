@@ -0,0 +1,21 @@
+import os
+
+import pytest
+
+pytest.importorskip('jpype')
+
+from bayespy.jni import JvmProfile
+
+
+def test_options_have_no_side_effects(tmp_path):
+    archive = str(tmp_path / 'cache' / 'bayesserver.jsa')
+    options = JvmProfile(app_cds_archive=archive).get_options(java_version=17)
+
+    assert "-XX:ArchiveClassesAtExit={}".format(archive) in options
+    assert not os.path.exists(os.path.dirname(archive))
+
+
+def test_app_cds_needs_jdk_13(tmp_path):
+    profile = JvmProfile(app_cds_archive=str(tmp_path / 'bayesserver.jsa'))
+    for java_version in (None, 8, 11):
+        assert not any('Archive' in option for option in profile.get_options(java_version=java_version))
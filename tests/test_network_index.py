@@ -0,0 +1,29 @@
+import gc
+
+import pytest
+
+pytest.importorskip('jpype')
+pytest.importorskip('sqlalchemy')
+
+import bayespy
+from bayespy.network import Builder as builder
+
+
+def test_index_is_reused(jvm):
+    network = bayespy.network.create_network()
+    builder.create_cluster_variable(network, 3)
+    assert bayespy.network.get_index(network) is bayespy.network.get_index(network)
+
+
+def test_index_goes_with_its_network(jvm):
+    network = bayespy.network.create_network()
+    builder.create_cluster_variable(network, 3)
+    index = bayespy.network.get_index(network)
+    assert index.get_network() is network
+
+    count = len(bayespy.network._indexes)
+    del network
+    gc.collect()
+
+    assert len(bayespy.network._indexes) == count - 1
+    assert index.get_network() is None
@@ -0,0 +1,65 @@
+import gc
+import os
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('jpype')
+pytest.importorskip('sqlalchemy')
+
+import bayespy
+from bayespy.jni import jp
+from bayespy.model import QueryMostLikelyState, QueryStateProbability
+
+ITERATIONS = 100000
+SAMPLES = 10
+
+
+def _java_used_memory():
+    runtime = jp.java.lang.Runtime.getRuntime()
+    runtime.gc()
+    return runtime.totalMemory() - runtime.freeMemory()
+
+
+def _handle_count():
+    # open file descriptors where /proc is available, plus threads, as neither should grow with the calls.
+    fds = len(os.listdir('/proc/self/fd')) if os.path.isdir('/proc/self/fd') else 0
+    return fds + threading.active_count()
+
+
+def _measure(engine):
+    gc.collect()
+    return {'java_memory': _java_used_memory(), 'python_objects': len(gc.get_objects()),
+            'handles': _handle_count(), 'query_distributions': engine.getQueryDistributions().size()}
+
+
+def test_long_run_is_flat(model, iris, logger):
+    network = model.get_network()
+    engine = bayespy.model.InferenceEngine(network).create_engine()
+    prepared = bayespy.model.PreparedQuery(network, [QueryStateProbability('Cluster', suffix=""),
+                                                     QueryMostLikelyState('Cluster')], logger,
+                                           inference_engine=engine)
+    evidence = iris.drop('iris_class', axis=1).to_dict('records')
+
+    samples = []
+    seconds = []
+    interval = ITERATIONS // SAMPLES
+    for start in range(0, ITERATIONS, interval):
+        started = time.perf_counter()
+        for i in range(start, start + interval):
+            prepared.query(evidence=evidence[i % len(evidence)], aslist=True)
+
+        seconds.append(time.perf_counter() - started)
+        samples.append(_measure(engine))
+
+    # the first interval warms up the JVM, so compare the rest against the second.
+    baseline = samples[1]
+    for sample in samples[2:]:
+        assert sample['query_distributions'] == baseline['query_distributions']
+        assert sample['handles'] <= baseline['handles']
+        assert sample['python_objects'] <= baseline['python_objects'] + 1000
+        assert sample['java_memory'] <= baseline['java_memory'] + 16 * 1024 ** 2
+
+    # constant per call cost, with room for noise.
+    assert max(seconds[2:]) <= 2 * seconds[1]
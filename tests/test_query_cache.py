@@ -0,0 +1,47 @@
+import pytest
+
+pytest.importorskip('jpype')
+pytest.importorskip('sqlalchemy')
+
+import bayespy
+from bayespy.model import QueryCache, QueryMostLikelyState, QueryStatistics
+
+
+def test_cache_key_is_stable_after_setup():
+    query = QueryMostLikelyState('Cluster')
+    key = query.cache_key()
+    # as set by setup
+    query._distribution = object()
+    query._query_distribution = object()
+    query._states = ['a', 'b']
+    assert query.cache_key() == key
+
+
+def test_cache_key_normalises_arguments():
+    assert QueryMostLikelyState('Cluster').cache_key() == \
+        QueryMostLikelyState(target_variable_name='Cluster', output_dtype='object').cache_key()
+    assert QueryMostLikelyState('Cluster').cache_key() != QueryMostLikelyState('Other').cache_key()
+    assert QueryStatistics().cache_key() != QueryStatistics(calc_conflict=True).cache_key()
+
+
+def test_second_lookup_hits_cache(model, logger):
+    network = model.get_network()
+    (engine, _, _) = bayespy.model.InferenceEngine(network).create()
+    cache = QueryCache()
+    query = bayespy.model.SingleQuery(network, engine, logger, cache=cache)
+    evidence = {'petal_length': 1.4, 'sepal_width': 3.5}
+
+    first = query.query([QueryMostLikelyState('Cluster')], evidence=evidence)
+    second = query.query([QueryMostLikelyState('Cluster')], evidence=evidence)
+
+    assert first == second
+    assert cache.get_metrics()['hits'] == 1
+    assert cache.get_metrics()['misses'] == 1
+
+
+def test_network_keys_are_distinct(model):
+    network = model.get_network()
+    copy = network.copy()
+    assert bayespy.model._network_key(network) == bayespy.model._network_key(network)
+    assert bayespy.model._network_key(network) != bayespy.model._network_key(copy)
+
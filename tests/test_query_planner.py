@@ -0,0 +1,53 @@
+import pytest
+
+pytest.importorskip('jpype')
+pytest.importorskip('sqlalchemy')
+
+import bayespy
+from bayespy.model import QueryCache, QueryPlanner, QueryStatistics
+
+
+@pytest.fixture
+def network(model):
+    # a copy, so calibrations from other tests aren't reused.
+    return model.get_network().copy()
+
+
+@pytest.fixture
+def timed_planner(logger, monkeypatch):
+    """
+    A planner which records each sample it queries
+    """
+    planner = QueryPlanner(logger, max_workers=4, memory_budget=16 * 1024 ** 3)
+    calls = []
+    time_rows = planner._time_rows
+    monkeypatch.setattr(planner, '_time_rows', lambda *args: calls.append(args) or time_rows(*args))
+    return planner, calls
+
+
+def test_planner_calibrates_once(network, iris, timed_planner):
+    planner, calls = timed_planner
+    first = planner.plan(network, iris, [QueryStatistics()])
+    second = planner.plan(network, iris, [QueryStatistics()])
+
+    assert len(calls) == 3
+    assert first.per_row_seconds == second.per_row_seconds
+
+
+def test_invalidate_network_resets_calibration(network, iris, timed_planner):
+    planner, calls = timed_planner
+    planner.plan(network, iris, [QueryStatistics()])
+    QueryCache.invalidate_network(network)
+    planner.plan(network, iris, [QueryStatistics()])
+
+    assert len(calls) == 6
+
+
+def test_small_input_runs_inline(network, iris, logger, monkeypatch):
+    # as if no workers had been started yet, so the default startup cost applies.
+    monkeypatch.setattr(bayespy.model, '_worker_startup_seconds', None)
+    plan = QueryPlanner(logger, max_workers=4, memory_budget=16 * 1024 ** 3).plan(network, iris, [QueryStatistics()])
+
+    assert plan.workers == 1
+    assert plan.chunk_size == len(iris)
+    assert plan.startup_seconds == 0.0
@@ -0,0 +1,90 @@
+import logging
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('jpype')
+pytest.importorskip('sqlalchemy')
+
+import bayespy.model
+from bayespy.model import ResultBuffer
+
+COLUMNS = [('loglikelihood', 'float64'), ('count', 'int64'), ('flag', 'bool'), ('state', 'object')]
+
+
+def test_unwritten_rows_are_missing():
+    buffer = ResultBuffer(COLUMNS, 3)
+    for row in (0, 2):
+        buffer.set('loglikelihood', row, -1.0)
+        buffer.set('count', row, 7)
+        buffer.set('flag', row, True)
+        buffer.set('state', row, 'a')
+
+    df = buffer.to_frame()
+    assert np.isnan(df['loglikelihood'][1])
+    assert np.isnan(df['count'][1])
+    assert df['count'][0] == 7
+    assert pd.isnull(df['flag'][1])
+    assert pd.isnull(df['state'][1])
+
+
+def test_fully_written_columns_keep_their_dtype():
+    buffer = ResultBuffer(COLUMNS, 2)
+    for row in range(2):
+        buffer.set('count', row, row)
+        buffer.set('flag', row, False)
+
+    df = buffer.to_frame()
+    assert df['count'].dtype == np.int64
+    assert df['flag'].dtype == bool
+
+
+@pytest.mark.parametrize('rows', [1, 1000, 100000])
+def test_memory_ceiling(rows):
+    buffer = ResultBuffer(COLUMNS, rows)
+    assert buffer.get_allocated_memory() == ResultBuffer.estimate_memory(COLUMNS, rows)
+
+    # writing every row doesn't allocate anything more, other than the objects themselves.
+    for row in range(rows):
+        buffer.set('count', row, row)
+        buffer.set('state', row, 'a')
+
+    assert buffer.get_allocated_memory() == ResultBuffer.estimate_memory(COLUMNS, rows)
+    assert buffer.get_allocated_memory() <= rows * 8 * (len(COLUMNS) + 2)
+
+
+class _Engine:
+    """
+    Stands in for an inference engine whose query fails on the rows listed
+    """
+
+    def __init__(self, failing_rows):
+        self.failing_rows = failing_rows
+        self.row = None
+
+    def query(self, query_options, query_output):
+        if self.row in self.failing_rows:
+            raise RuntimeError("Inference failed")
+
+
+class _Query:
+    def write(self, inference_engine, query_output, buffer, row):
+        buffer.set('loglikelihood', row, -float(inference_engine.row))
+        buffer.set('count', row, inference_engine.row)
+
+
+def test_failed_inference_leaves_row_missing():
+    buffer = ResultBuffer(COLUMNS, 3)
+    engine = _Engine(failing_rows={1})
+    succeeded = []
+    for row in range(3):
+        engine.row = row
+        succeeded.append(bayespy.model._query_row(engine, None, None, [_Query()], buffer, row,
+                                                  logging.getLogger('bayespy.tests')))
+
+    df = buffer.to_frame()
+    assert succeeded == [True, False, True]
+    assert df['loglikelihood'][0] == 0.0 and df['loglikelihood'][2] == -2.0
+    assert np.isnan(df['loglikelihood'][1])
+    assert np.isnan(df['count'][1])
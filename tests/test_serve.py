@@ -0,0 +1,55 @@
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+pytest.importorskip('jpype')
+pytest.importorskip('sqlalchemy')
+
+import bayespy.serve
+
+QUERIES = [{'type': 'QueryMostLikelyState', 'target_variable_name': 'Cluster'}]
+
+
+@pytest.fixture(scope='module')
+def server(model, logger, tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('serve') / 'iris.bayes')
+    with open(path, 'w') as fh:
+        fh.write(model.get_network().saveToString())
+
+    with bayespy.serve.ModelServer({'iris': path}, logger, port=0, engines=2) as server:
+        yield server
+
+
+def _post(server, body):
+    host, port = server.get_address()
+    request = urllib.request.Request("http://{}:{}/models/iris/query".format(host, port),
+                                     data=json.dumps(body).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.loads(response.read().decode('utf-8'))
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read().decode('utf-8'))
+
+
+def test_single_request(server):
+    status, body = _post(server, {'evidence': {'petal_length': 1.4}, 'queries': QUERIES})
+    assert status == 200
+    assert len(body['results']) == 1
+
+
+def test_batch_request(server):
+    status, body = _post(server, {'evidence': [{'petal_length': 1.4}, {'petal_length': 5.5}], 'queries': QUERIES})
+    assert status == 200
+    assert len(body['results']) == 2
+
+
+@pytest.mark.parametrize('body', [[1, 2], "evidence", {'evidence': [1], 'queries': QUERIES},
+                                  {'evidence': {}, 'queries': ['QueryMostLikelyState']},
+                                  {'evidence': {}, 'queries': {'type': 'QueryMostLikelyState'}}])
+def test_malformed_body(server, body):
+    status, response = _post(server, body)
+    assert status == 400
+    assert 'error' in response
@@ -0,0 +1,216 @@
+import pytest
+
+pytest.importorskip('jpype')
+pytest.importorskip('sqlalchemy')
+
+import bayespy
+from bayespy.model import NetworkModel
+
+
+@pytest.fixture
+def dataset(jvm, iris, logger, tmp_path):
+    with bayespy.data.DataSet(iris, str(tmp_path), logger, in_memory=True) as dataset:
+        yield dataset
+
+
+def _untrained_model(iris, logger) -> NetworkModel:
+    template = bayespy.template.MixtureNaiveBayes(logger, discrete=iris[['iris_class']],
+                                                  continuous=iris.drop('iris_class', axis=1), latent_states=3)
+    return NetworkModel(template.create(bayespy.network.NetworkFactory(logger)), logger)
+
+
+def _fail_seeds(monkeypatch, seeds):
+    learn = NetworkModel._learn
+
+    def _learn(network, dataset, seed=None, **kwargs):
+        if seed in seeds:
+            raise RuntimeError("restart with seed {} failed".format(seed))
+
+        return learn(network, dataset, seed=seed, **kwargs)
+
+    monkeypatch.setattr(NetworkModel, '_learn', staticmethod(_learn))
+
+
+@pytest.mark.parametrize('select_by', ['loglikelihood', 'bic'])
+def test_select_by_picks_the_best_restart(iris, logger, dataset, select_by):
+    metrics = _untrained_model(iris, logger).train(dataset, restarts=4, n_jobs=2, seed=0,
+                                                   select_by=select_by).get_metrics()
+
+    runs = metrics['restarts']
+    assert sorted(run['restart'] for run in runs) == [0, 1, 2, 3]
+    assert [run['seed'] for run in runs] == [run['restart'] for run in runs]
+
+    selected = [run for run in runs if run['selected']]
+    assert len(selected) == 1
+    assert selected[0][select_by] == max(run[select_by] for run in runs)
+    assert metrics[select_by] == selected[0][select_by]
+    assert metrics['seed'] == selected[0]['seed']
+
+
+def test_unknown_select_by_raises(iris, logger, dataset):
+    with pytest.raises(ValueError):
+        _untrained_model(iris, logger).train(dataset, restarts=2, select_by='aic')
+
+
+def test_failed_restart_is_skipped(iris, logger, dataset, monkeypatch):
+    _fail_seeds(monkeypatch, {1})
+    model = _untrained_model(iris, logger)
+    metrics = model.train(dataset, restarts=3, seed=0).get_metrics()
+
+    failed = [run for run in metrics['restarts'] if 'error' in run]
+    assert [run['restart'] for run in failed] == [1]
+    assert not failed[0]['selected']
+    assert metrics['seed'] != 1
+    assert model.is_trained()
+
+
+def test_all_restarts_failing_raises(iris, logger, dataset, monkeypatch):
+    _fail_seeds(monkeypatch, {0, 1, 2})
+    with pytest.raises(ValueError, match="All 3 training restarts failed"):
+        _untrained_model(iris, logger).train(dataset, restarts=3, seed=0)
+
+
+@pytest.mark.parametrize('restarts', [1, 3])
+def test_fixed_seed_gives_the_same_result(iris, logger, dataset, restarts):
+    def train():
+        model = _untrained_model(iris, logger)
+        results = model.train(dataset, restarts=restarts, n_jobs=restarts, seed=5)
+        queries = [bayespy.model.QueryStatistics()]
+        return results.get_metrics(), model.batch_query(dataset, queries, append_to_df=False)
+
+    metrics, likelihoods = train()
+    other_metrics, other_likelihoods = train()
+
+    assert metrics['loglikelihood'] == other_metrics['loglikelihood']
+    assert metrics['iteration_count'] == other_metrics['iteration_count']
+    assert metrics['seed'] == other_metrics['seed']
+    assert likelihoods.loglikelihood.tolist() == other_likelihoods.loglikelihood.tolist()
+
+
+def test_restarts_with_init_from_raises(iris, logger, dataset, naive_bayes_model):
+    with pytest.raises(ValueError):
+        _untrained_model(iris, logger).train(dataset, restarts=2, init_from=naive_bayes_model)
+
+
+def _split(iris):
+    shuffled = iris.sample(frac=1, random_state=0).reset_index(drop=True)
+    return shuffled.iloc[:100].reset_index(drop=True), shuffled.iloc[100:].reset_index(drop=True)
+
+
+@pytest.mark.parametrize('weight,forgetting', [(1.0, 1.0), (2.0, 0.5)])
+def test_update_is_one_step_of_online_em(iris, logger, jvm, tmp_path, weight, forgetting):
+    from bayespy.vectorized import MixtureModel
+
+    train, delta = _split(iris)
+    model = _untrained_model(iris, logger)
+    with bayespy.data.DataSet(train, str(tmp_path), logger, in_memory=True) as dataset:
+        model.train(dataset, seed=0, keep_statistics=True)
+
+    trained = MixtureModel.from_network(model.get_network())
+    expected = trained.maximise(trained.statistics(train).scale(forgetting)
+                                .add(trained.statistics(delta, weight=weight)))
+
+    with bayespy.data.DataSet(delta, str(tmp_path), logger, in_memory=True) as dataset_delta:
+        results = model.update(dataset_delta, weight=weight, forgetting=forgetting)
+
+    assert results.get_metrics()['case_count'] == len(delta)
+    assert results.get_metrics()['effective_case_count'] == pytest.approx(len(train) * forgetting +
+                                                                          len(delta) * weight)
+    updated = MixtureModel.from_network(model.get_network())
+    assert updated.prior == pytest.approx(expected.prior)
+    assert updated.loglikelihood(iris) == pytest.approx(expected.loglikelihood(iris), rel=1e-6)
+    assert not updated.loglikelihood(iris) == pytest.approx(trained.loglikelihood(iris), rel=1e-6)
+
+
+def test_update_without_statistics_raises(iris, logger, dataset):
+    model = _untrained_model(iris, logger)
+    model.train(dataset, seed=0)
+    with pytest.raises(ValueError):
+        model.update(dataset)
+
+
+@pytest.mark.parametrize('forgetting', [0.0, 1.5])
+def test_update_with_bad_forgetting_raises(iris, logger, dataset, forgetting):
+    model = _untrained_model(iris, logger)
+    model.train(dataset, seed=0, keep_statistics=True)
+    with pytest.raises(ValueError):
+        model.update(dataset, forgetting=forgetting)
+
+
+def _stop_after(iterations):
+    calls = []
+
+    def callback(entry):
+        calls.append(entry)
+        return len(calls) >= iterations
+
+    return callback, calls
+
+
+def test_progress_traces_each_iteration(iris, logger, dataset):
+    progress = bayespy.model.TrainingProgress(logger)
+    results = _untrained_model(iris, logger).train(dataset, seed=0, progress=progress, max_iterations=5)
+
+    trace = results.get_trace()
+    assert set(trace.columns) == {'iteration', 'loglikelihood', 'loglikelihood_delta', 'elapsed_seconds',
+                                  'iteration_seconds', 'cases_per_second'}
+    assert 0 < len(trace) <= 5
+    assert trace.iteration.diff().dropna().eq(1).all()
+    assert trace.elapsed_seconds.is_monotonic_increasing
+    assert trace.loglikelihood.notnull().all()
+    assert results.get_metrics()['stop_reason'] is None
+
+
+def test_callback_stops_training(iris, logger, dataset):
+    callback, calls = _stop_after(3)
+    progress = bayespy.model.TrainingProgress(logger, callback=callback)
+    results = _untrained_model(iris, logger).train(dataset, seed=0, progress=progress)
+
+    assert len(calls) == 3
+    assert len(results.get_trace()) == 3
+    assert results.get_metrics()['stop_reason'] == "stopped by callback"
+    assert not results.get_metrics()['converged']
+
+
+def test_failing_callback_stops_training(iris, logger, dataset):
+    def callback(entry):
+        raise RuntimeError("bad callback")
+
+    progress = bayespy.model.TrainingProgress(logger, callback=callback)
+    results = _untrained_model(iris, logger).train(dataset, seed=0, progress=progress)
+
+    assert len(results.get_trace()) == 1
+    assert results.get_metrics()['stop_reason'] == "callback raised bad callback"
+
+
+def test_min_loglikelihood_delta_stops_training(iris, logger, dataset):
+    progress = bayespy.model.TrainingProgress(logger, min_loglikelihood_delta=1e9)
+    results = _untrained_model(iris, logger).train(dataset, seed=0, progress=progress)
+
+    # the first iteration has nothing to compare with.
+    assert len(results.get_trace()) == 2
+    assert results.get_metrics()['stop_reason'].startswith("log likelihood changed by less than")
+
+
+def test_min_loglikelihood_delta_needs_monitoring(logger):
+    with pytest.raises(ValueError):
+        bayespy.model.TrainingProgress(logger, min_loglikelihood_delta=1.0, monitor_loglikelihood=False)
+
+
+def test_java_proxies_are_kept(jvm, logger):
+    progress = bayespy.model.TrainingProgress(logger)
+    assert progress.as_java_progress() is progress.as_java_progress()
+    assert progress.as_java_stop() is progress.as_java_stop()
+
+
+def test_each_restart_has_its_own_progress(iris, logger, dataset):
+    callback, calls = _stop_after(2)
+    progress = bayespy.model.TrainingProgress(logger, callback=callback)
+    metrics = _untrained_model(iris, logger).train(dataset, restarts=2, seed=0, progress=progress).get_metrics()
+
+    for run in metrics['restarts']:
+        assert len(run['trace']) >= 1
+
+    # the callback is shared, so training stops once the restarts have run two iterations between them.
+    assert sum(len(run['trace']) for run in metrics['restarts']) <= 3
+    assert progress.get_trace() == []
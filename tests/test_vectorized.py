@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('jpype')
+pytest.importorskip('sqlalchemy')
+
+import bayespy
+from bayespy.model import QueryMeanVariance, QueryModelStatistics, QueryMostLikelyState, QueryStateProbability
+
+
+def query_both(model, data, queries, logger, tmp_path):
+    """
+    :return: the results of the Java engine (a batch query) and of the vectorised engine, in the same order
+    """
+    with bayespy.data.DataSet(data, str(tmp_path), logger, in_memory=True) as dataset:
+        java = model.batch_query(dataset, queries, append_to_df=False).sort_index()
+
+    mixture = bayespy.vectorized.MixtureModel.from_network(model.get_network())
+    return java, mixture.query(data, queries).sort_index()
+
+
+def assert_same_results(java, vectorized):
+    assert sorted(java.columns) == sorted(vectorized.columns)
+    for column in vectorized.columns:
+        if column.endswith('_maxlikelihood'):
+            assert (java[column].astype(str).values == vectorized[column].astype(str).values).all()
+        else:
+            np.testing.assert_allclose(vectorized[column].values.astype(float), java[column].values.astype(float),
+                                       atol=1e-6)
+
+
+def test_matches_java_engine(naive_bayes_model, iris, logger, tmp_path):
+    data = iris.copy()
+    data.loc[data.sample(frac=0.2, random_state=0).index, 'petal_width'] = np.nan
+    data.loc[data.sample(frac=0.1, random_state=1).index, 'iris_class'] = np.nan
+    queries = [QueryModelStatistics(), QueryStateProbability('Cluster', suffix=""),
+               QueryMostLikelyState('iris_class')]
+
+    assert_same_results(*query_both(naive_bayes_model, data, queries, logger, tmp_path))
+
+
+def test_matches_java_engine_multivariate(model, iris, logger, tmp_path):
+    data = iris.drop('iris_class', axis=1)
+    data.loc[data.sample(frac=0.2, random_state=0).index, 'petal_width'] = np.nan
+    queries = [QueryModelStatistics(), QueryStateProbability('Cluster', suffix="")]
+
+    assert_same_results(*query_both(model, data, queries, logger, tmp_path))
+
+
+def test_matches_java_engine_with_missing_subsets(model, iris, logger, tmp_path):
+    # each row leaves out a random subset of the continuous variables (keeping at least one), so the scores use the
+    # Cholesky factors of many different observed blocks, and the means the conditional Gaussian given the rest.
+    data = iris.drop('iris_class', axis=1)
+    rng = np.random.RandomState(0)
+    missing = rng.rand(*data.shape) < 0.4
+    missing[np.arange(len(data)), rng.randint(0, data.shape[1], len(data))] = False
+    data = data.mask(missing)
+    assert len({tuple(row) for row in missing}) > 5
+
+    queries = [QueryModelStatistics(), QueryStateProbability('Cluster', suffix=""),
+               QueryMeanVariance('petal_width'), QueryMeanVariance('sepal_length')]
+
+    assert_same_results(*query_both(model, data, queries, logger, tmp_path))
+
+
+def test_unknown_state_raises(naive_bayes_model, iris):
+    mixture = bayespy.vectorized.MixtureModel.from_network(naive_bayes_model.get_network())
+    data = iris.head(3).copy()
+    data.loc[data.index[1], 'iris_class'] = 'Iris-unknown'
+
+    with pytest.raises(ValueError):
+        mixture.query(data, [QueryStateProbability('Cluster')])